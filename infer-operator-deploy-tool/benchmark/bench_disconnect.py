@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""Tasks and memory per open stream of the proxy's client disconnect handling, driven in process over ASGI."""
+import argparse
+import asyncio
+import functools
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'start'))
+
+from client_disconnect import DisconnectMiddleware  # noqa: E402
+
+BODY = b'{"model": "mock", "prompt": "hello", "stream": true}'
+MODES = ('with_cancellation', 'middleware')
+
+
+async def listen_for_disconnect(request: Request) -> None:
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            break
+
+
+def with_cancellation(handler_func):
+    """The proxy's former per-request handler and disconnect listener tasks."""
+    @functools.wraps(handler_func)
+    async def wrapper(*args, **kwargs):
+        request = kwargs["request"]
+        handler_task = asyncio.create_task(handler_func(*args, **kwargs))
+        cancellation_task = asyncio.create_task(listen_for_disconnect(request))
+        done, pending = await asyncio.wait([handler_task, cancellation_task], return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        if handler_task in done:
+            return handler_task.result()
+        return None
+
+    return wrapper
+
+
+class Upstream:
+    """Stands in for the decoder: every stream sends one event, then waits for tokens that never come."""
+
+    def __init__(self):
+        self.started = 0
+        self.closed = 0
+        self.all_started = asyncio.Event()
+        self.all_closed = asyncio.Event()
+        self.streams = 0
+        self.stalled = asyncio.get_running_loop().create_future()
+
+    async def generate(self):
+        self.started += 1
+        if self.started == self.streams:
+            self.all_started.set()
+        try:
+            yield b'data: {"choices": []}\n\n'
+            await self.stalled
+        finally:
+            self.closed += 1
+            if self.closed == self.streams:
+                self.all_closed.set()
+
+
+def build_app(mode, upstream):
+    app = FastAPI()
+
+    async def completions(request: Request):
+        await request.body()
+        return StreamingResponse(upstream.generate(), media_type="text/event-stream")
+
+    if mode == 'with_cancellation':
+        completions = with_cancellation(completions)
+    else:
+        app.add_middleware(DisconnectMiddleware, paths=("/v1/completions",))
+    app.post("/v1/completions")(completions)
+    return app
+
+
+def scope(port):
+    return {
+        "type": "http", "asgi": {"version": "3.0", "spec_version": "2.3"}, "http_version": "1.1",
+        "method": "POST", "scheme": "http", "path": "/v1/completions", "raw_path": b"/v1/completions",
+        "root_path": "", "query_string": b"", "headers": [(b"content-type", b"application/json")],
+        "server": ("127.0.0.1", 19000), "client": ("127.0.0.1", port),
+    }
+
+
+async def run_mode(mode, streams):
+    """Open streams concurrent streams like uvicorn does, one task each, then disconnect all of their clients."""
+    upstream = Upstream()
+    upstream.streams = streams
+    app = build_app(mode, upstream)
+    # Starlette builds the middleware stack on the first request otherwise
+    app.middleware_stack = app.build_middleware_stack()
+    loop = asyncio.get_running_loop()
+    gc.collect()
+    created = 0
+
+    def count_tasks(loop, coro, **kwargs):
+        nonlocal created
+        created += 1
+        return asyncio.Task(coro, loop=loop, **kwargs)
+
+    loop.set_task_factory(count_tasks)
+    baseline_tasks = len(asyncio.all_tasks())
+    tracemalloc.start()
+    baseline_memory = tracemalloc.get_traced_memory()[0]
+    disconnects = []
+
+    def client(i):
+        disconnect = asyncio.Event()
+        disconnects.append(disconnect)
+        messages = [{"type": "http.request", "body": BODY, "more_body": False}]
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            await disconnect.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            pass
+
+        return receive, send
+
+    start = time.perf_counter()
+    requests = [loop.create_task(app(scope(1024 + i % 60000), *client(i))) for i in range(streams)]
+    await upstream.all_started.wait()
+    # Let every stream reach its stalled upstream read
+    for _ in range(5):
+        await asyncio.sleep(0)
+    open_time = time.perf_counter() - start
+    gc.collect()
+    memory = tracemalloc.get_traced_memory()[0] - baseline_memory
+    tasks = len(asyncio.all_tasks()) - baseline_tasks
+    tracemalloc.stop()
+    opened = created
+
+    start = time.perf_counter()
+    for disconnect in disconnects:
+        disconnect.set()
+    try:
+        await asyncio.wait_for(upstream.all_closed.wait(), 30)
+    except asyncio.TimeoutError:
+        pass
+    close_time = time.perf_counter() - start
+    await asyncio.gather(*requests, return_exceptions=True)
+    return {
+        'created': opened,
+        'tasks': tasks,
+        'memory': memory,
+        'open_time': open_time,
+        'closed': upstream.closed,
+        'close_time': close_time,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare with_cancellation with DisconnectMiddleware')
+    parser.add_argument('--streams', type=int, default=10000, help='Concurrent open streams')
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=MODES)
+    args = parser.parse_args()
+
+    print(f"{args.streams} concurrent streams")
+    print(f"{'mode':>18} {'created/stream':>15} {'live/stream':>12} {'KiB/stream':>11} {'open (ms)':>10} "
+          f"{'upstreams closed':>17} {'close (ms)':>11}")
+    for mode in args.modes:
+        result = asyncio.run(run_mode(mode, args.streams))
+        print(f"{mode:>18} {result['created'] / args.streams:>15.2f} {result['tasks'] / args.streams:>12.2f} "
+              f"{result['memory'] / args.streams / 1024:>11.2f} {result['open_time'] * 1000:>10.1f} "
+              f"{result['closed']:>17} {result['close_time'] * 1000:>11.1f}")
+
+
+if __name__ == '__main__':
+    main()
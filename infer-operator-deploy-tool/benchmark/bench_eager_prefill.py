@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+import argparse
+import asyncio
+import sys
+import time
+
+import httpx
+
+from bench_multi_worker import MOCK_SCRIPT, PROXY_SCRIPT, start_process, wait_ready
+
+MODES = {
+    'callback': [],
+    'eager': ['--eager-prefill'],
+}
+
+
+async def measure_ttft(url, args):
+    body = {'model': 'mock', 'prompt': 'hello ' * args.prompt_words, 'max_tokens': args.max_tokens, 'stream': True}
+    ttfts = []
+    errors = 0
+    remaining = args.requests
+    async with httpx.AsyncClient(timeout=60.0) as client:
+
+        async def user():
+            nonlocal errors, remaining
+            while remaining > 0:
+                remaining -= 1
+                start = time.perf_counter()
+                ttft = None
+                try:
+                    async with client.stream('POST', url, json=body) as response:
+                        async for _ in response.aiter_bytes():
+                            if ttft is None:
+                                ttft = time.perf_counter() - start
+                    if response.status_code == 200 and ttft is not None:
+                        ttfts.append(ttft)
+                    else:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+
+        await asyncio.gather(*(user() for _ in range(args.concurrency)))
+    ttfts.sort()
+    return ttfts, errors
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(len(values) * q))] if values else float('nan')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare TTFT of callback and eager prefill dispatch in the PD proxy')
+    parser.add_argument('--modes', nargs='+', choices=list(MODES), default=list(MODES))
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--prompt-words', type=int, default=2048)
+    parser.add_argument('--max-tokens', type=int, default=4)
+    parser.add_argument('--prefill-latency', type=float, default=0.05)
+    parser.add_argument('--network-latency', type=float, default=0.005,
+                        help='Per request latency of the prefiller before it has the whole body')
+    parser.add_argument('--kv-transfer-latency', type=float, default=0.01)
+    parser.add_argument('--token-latency', type=float, default=0.005)
+    parser.add_argument('--port', type=int, default=19000)
+    parser.add_argument('--backend-port', type=int, default=18000, help='First port used by the mock backends')
+    args = parser.parse_args()
+
+    prefill_port = args.backend_port
+    decode_port = args.backend_port + 100
+    mocks = [
+        start_process([sys.executable, MOCK_SCRIPT, '--role', 'prefill', '--port', str(prefill_port),
+                       '--prefill-latency', str(args.prefill_latency),
+                       '--network-latency', str(args.network_latency),
+                       '--kv-transfer-latency', str(args.kv_transfer_latency)]),
+        start_process([sys.executable, MOCK_SCRIPT, '--role', 'decode', '--port', str(decode_port),
+                       '--token-latency', str(args.token_latency), '--wait-kv']),
+    ]
+    try:
+        for port in (prefill_port, decode_port):
+            wait_ready(f"http://127.0.0.1:{port}/health")
+        print(f"{'mode':>9} {'mean (ms)':>10} {'p50 (ms)':>9} {'p90 (ms)':>9} {'p99 (ms)':>9} {'errors':>7}")
+        for mode in args.modes:
+            proxy = start_process(
+                [sys.executable, PROXY_SCRIPT, '--host', '127.0.0.1', '--port', str(args.port),
+                 '--prefiller-hosts', '127.0.0.1', '--prefiller-ports', str(prefill_port),
+                 '--decoder-hosts', '127.0.0.1', '--decoder-ports', str(decode_port), *MODES[mode]]
+            )
+            try:
+                wait_ready(f"http://127.0.0.1:{args.port}/healthcheck")
+                ttfts, errors = asyncio.run(measure_ttft(f"http://127.0.0.1:{args.port}/v1/completions", args))
+            finally:
+                proxy.terminate()
+                proxy.wait()
+            mean = sum(ttfts) / len(ttfts) if ttfts else float('nan')
+            print(f"{mode:>9} {mean * 1000:>10.1f} {percentile(ttfts, 0.5) * 1000:>9.1f} "
+                  f"{percentile(ttfts, 0.9) * 1000:>9.1f} {percentile(ttfts, 0.99) * 1000:>9.1f} {errors:>7}")
+    finally:
+        for mock in mocks:
+            mock.terminate()
+        for mock in mocks:
+            mock.wait()
+
+
+if __name__ == '__main__':
+    main()
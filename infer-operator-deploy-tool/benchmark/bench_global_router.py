@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""Skewed traffic to two service replicas, sent directly to their routers or through the global router."""
+import argparse
+import asyncio
+import os
+import random
+import sys
+
+import httpx
+
+from bench_multi_worker import BENCHMARK_DIR, MOCK_SCRIPT, PROXY_SCRIPT, start_process, wait_ready
+from load_generator import Results, percentile, send_request
+
+GLOBAL_ROUTER_SCRIPT = os.path.join(BENCHMARK_DIR, '..', 'src', 'start', 'global_router.py')
+MODES = ('direct', 'global', 'spillover')
+
+
+def launch_replica(index, args):
+    """Start the mock backends and the router of one replica, return its processes and router URL."""
+    base_port = args.backend_port + index * 200
+    prefill_ports = [base_port + i for i in range(args.prefillers)]
+    decode_ports = [base_port + 100 + i for i in range(args.decoders)]
+    processes = [
+        start_process([sys.executable, MOCK_SCRIPT, '--role', 'prefill', '--port', str(port),
+                       '--prefill-latency', str(args.prefill_latency)])
+        for port in prefill_ports
+    ] + [
+        start_process([sys.executable, MOCK_SCRIPT, '--role', 'decode', '--port', str(port),
+                       '--token-latency', str(args.token_latency)])
+        for port in decode_ports
+    ]
+    for port in prefill_ports + decode_ports:
+        wait_ready(f"http://127.0.0.1:{port}/health")
+    port = args.port + 1 + index
+    processes.append(start_process(
+        [sys.executable, PROXY_SCRIPT, '--host', '127.0.0.1', '--port', str(port),
+         '--prefiller-hosts', *['127.0.0.1'] * args.prefillers, '--prefiller-ports', *map(str, prefill_ports),
+         '--decoder-hosts', *['127.0.0.1'] * args.decoders, '--decoder-ports', *map(str, decode_ports),
+         '--max-requests-per-backend', str(args.max_requests), '--admission-queue-size', str(args.queue_size),
+         '--admission-queue-timeout', str(args.queue_timeout)]
+    ))
+    url = f"http://127.0.0.1:{port}"
+    wait_ready(f"{url}/healthcheck")
+    return processes, url
+
+
+async def generate_load(targets, args, results):
+    """Poisson arrivals at args.rate, target i gets args.skew[i] of them like clients sticking to a replica."""
+    body = {'model': 'mock', 'prompt': 'hello ' * args.prompt_words, 'max_tokens': args.max_tokens, 'stream': True}
+    rng = random.Random(args.seed)
+    loop = asyncio.get_running_loop()
+    async with httpx.AsyncClient(timeout=120.0, limits=httpx.Limits(max_connections=None)) as client:
+        tasks = []
+        start = next_at = loop.time()
+        while True:
+            next_at += rng.expovariate(args.rate)
+            if next_at - start > args.duration:
+                break
+            delay = next_at - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            target = rng.choices(targets, weights=args.skew[:len(targets)])[0]
+            results.sent += 1
+            tasks.append(asyncio.create_task(send_request(client, target + '/v1/completions', body, True, results)))
+        await asyncio.gather(*tasks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare direct replica access with the global router')
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=MODES)
+    parser.add_argument('--rate', type=float, default=12.0, help='Mean request arrival rate over both replicas')
+    parser.add_argument('--skew', type=float, nargs=2, default=[0.9, 0.1], help='Share of traffic per replica')
+    parser.add_argument('--duration', type=float, default=20.0)
+    parser.add_argument('--prefillers', type=int, default=1, help='Prefillers per replica')
+    parser.add_argument('--decoders', type=int, default=2, help='Decoders per replica')
+    parser.add_argument('--max-requests', type=int, default=4, help='Concurrent requests per decoder')
+    parser.add_argument('--queue-size', type=int, default=8, help='Admission queue size of each replica router')
+    parser.add_argument('--queue-timeout', type=float, default=1.0)
+    parser.add_argument('--prefill-latency', type=float, default=0.02)
+    parser.add_argument('--token-latency', type=float, default=0.05)
+    parser.add_argument('--prompt-words', type=int, default=64)
+    parser.add_argument('--max-tokens', type=int, default=16)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--port', type=int, default=19000, help='Global router port, replica routers follow it')
+    parser.add_argument('--backend-port', type=int, default=18000, help='First port used by the mock backends')
+    args = parser.parse_args()
+
+    processes, replicas = [], []
+    try:
+        for index in range(2):
+            replica_processes, url = launch_replica(index, args)
+            processes.extend(replica_processes)
+            replicas.append(url)
+        print(f"{'mode':>10} {'sent':>6} {'ok':>6} {'errors':>7} {'ttft p50':>9} {'ttft p99':>9} "
+              f"{'lat p99':>9}  per replica")
+        for mode in args.modes:
+            router = None
+            targets = replicas
+            if mode != 'direct':
+                router_args = ['--spillover'] if mode == 'spillover' else []
+                router = start_process([sys.executable, GLOBAL_ROUTER_SCRIPT, '--host', '127.0.0.1',
+                                        '--port', str(args.port), '--replicas', *replicas, *router_args])
+                wait_ready(f"http://127.0.0.1:{args.port}/healthcheck")
+                targets = [f"http://127.0.0.1:{args.port}"]
+            results = Results()
+            asyncio.run(generate_load(targets, args, results))
+            spread = ''
+            if router is not None:
+                stats = httpx.get(f"http://127.0.0.1:{args.port}/healthcheck").json()['replicas']
+                spread = ' / '.join(str(stats[url]['requests']) for url in replicas)
+                router.terminate()
+                router.wait()
+            for values in (results.ttfts, results.latencies):
+                values.sort()
+            print(f"{mode:>10} {results.sent:>6} {results.completed:>6} {results.errors:>7} "
+                  f"{percentile(results.ttfts, 0.5) * 1000:>9.1f} {percentile(results.ttfts, 0.99) * 1000:>9.1f} "
+                  f"{percentile(results.latencies, 0.99) * 1000:>9.1f}  {spread}")
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+import argparse
+import heapq
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'start'))
+
+from indexed_heap import IndexedHeap  # noqa: E402
+
+BACKEND_COUNTS = [8, 128, 1024]
+
+
+class ListRebuildSelector:
+    """Selection logic of the proxy before the indexed heap: rebuild the heap list on every update."""
+
+    def __init__(self, size):
+        self.active_tokens = [0] * size
+        self.heap = [(0, i) for i in range(size)]
+        heapq.heapify(self.heap)
+
+    def _update(self, idx):
+        self.heap = [(p, i) for p, i in self.heap if i != idx]
+        heapq.heappush(self.heap, (self.active_tokens[idx], idx))
+
+    def select(self, tokens):
+        _, chosen = heapq.heappop(self.heap)
+        self.active_tokens[chosen] += tokens
+        self._update(chosen)
+        return chosen
+
+    def release(self, idx, tokens):
+        self.active_tokens[idx] -= tokens
+        self._update(idx)
+
+
+class IndexedHeapSelector:
+    def __init__(self, size):
+        self.active_tokens = [0] * size
+        self.heap = IndexedHeap({i: 0 for i in range(size)})
+
+    def select(self, tokens):
+        _, chosen = self.heap.peek()
+        self.active_tokens[chosen] += tokens
+        self.heap.update(chosen, self.active_tokens[chosen])
+        return chosen
+
+    def release(self, idx, tokens):
+        self.active_tokens[idx] -= tokens
+        self.heap.update(idx, self.active_tokens[idx])
+
+
+def run(selector_cls, size, ops, concurrency, seed):
+    rng = random.Random(seed)
+    token_counts = [rng.randint(100, 8000) for _ in range(ops)]
+    selector = selector_cls(size)
+    in_flight = []
+    start = time.perf_counter()
+    for tokens in token_counts:
+        in_flight.append((selector.select(tokens), tokens))
+        if len(in_flight) >= concurrency:
+            idx, released = in_flight.pop(rng.randrange(len(in_flight)))
+            selector.release(idx, released)
+    for idx, released in in_flight:
+        selector.release(idx, released)
+    elapsed = time.perf_counter() - start
+    # every op is one select plus one release
+    return ops / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare select/release throughput of the proxy selection heaps')
+    parser.add_argument('--ops', type=int, default=200000, help='Number of select/release pairs per run')
+    parser.add_argument('--concurrency', type=int, default=256, help='Requests kept in flight before releasing')
+    parser.add_argument('--backends', type=int, nargs='+', default=BACKEND_COUNTS)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'backends':>8} {'list rebuild (ops/s)':>22} {'indexed heap (ops/s)':>22} {'speedup':>8}")
+    for size in args.backends:
+        baseline = run(ListRebuildSelector, size, args.ops, args.concurrency, args.seed)
+        indexed = run(IndexedHeapSelector, size, args.ops, args.concurrency, args.seed)
+        print(f"{size:>8} {baseline:>22,.0f} {indexed:>22,.0f} {indexed / baseline:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
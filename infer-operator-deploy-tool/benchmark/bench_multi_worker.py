@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+import argparse
+import asyncio
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+PROXY_SCRIPT = os.path.join(BENCHMARK_DIR, '..', 'src', 'start', 'load_balance_proxy_layerwise_server_example.py')
+MOCK_SCRIPT = os.path.join(BENCHMARK_DIR, 'mock_vllm_server.py')
+
+
+def start_process(cmd):
+    return subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_ready(url, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not become ready in {timeout}s")
+
+
+async def _client_loop(url, concurrency, duration, max_tokens):
+    body = {"model": "mock", "prompt": "hello " * 64, "max_tokens": max_tokens, "stream": True}
+    latencies = []
+    errors = 0
+    deadline = time.monotonic() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=60.0, limits=limits) as client:
+
+        async def user():
+            nonlocal errors
+            while time.monotonic() < deadline:
+                start = time.perf_counter()
+                try:
+                    async with client.stream("POST", url, json=body) as response:
+                        async for _ in response.aiter_bytes():
+                            pass
+                    if response.status_code == 200:
+                        latencies.append(time.perf_counter() - start)
+                    else:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+
+        await asyncio.gather(*(user() for _ in range(concurrency)))
+    return latencies, errors
+
+
+def _client_process(url, concurrency, duration, max_tokens, results):
+    results.put(asyncio.run(_client_loop(url, concurrency, duration, max_tokens)))
+
+
+def run_load(url, args):
+    """Closed-loop load from several client processes, so the client is not the bottleneck."""
+    results = multiprocessing.Queue()
+    per_process = max(1, args.concurrency // args.client_procs)
+    processes = [
+        multiprocessing.Process(target=_client_process, args=(url, per_process, args.duration, args.max_tokens, results))
+        for _ in range(args.client_procs)
+    ]
+    for process in processes:
+        process.start()
+    latencies, errors = [], 0
+    for _ in processes:
+        process_latencies, process_errors = results.get()
+        latencies.extend(process_latencies)
+        errors += process_errors
+    for process in processes:
+        process.join()
+    latencies.sort()
+    return {
+        'rps': len(latencies) / args.duration,
+        'p50': latencies[len(latencies) // 2] if latencies else float('nan'),
+        'p99': latencies[int(len(latencies) * 0.99)] if latencies else float('nan'),
+        'errors': errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure PD proxy requests/s with 1 to N worker processes')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--prefillers', type=int, default=2)
+    parser.add_argument('--decoders', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=256, help='Concurrent streams over all client processes')
+    parser.add_argument('--client-procs', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds of load per worker count')
+    parser.add_argument('--max-tokens', type=int, default=16)
+    parser.add_argument('--token-latency', type=float, default=0.0)
+    parser.add_argument('--port', type=int, default=19000)
+    parser.add_argument('--backend-port', type=int, default=18000, help='First port used by the mock backends')
+    args = parser.parse_args()
+
+    prefill_ports = [args.backend_port + i for i in range(args.prefillers)]
+    decode_ports = [args.backend_port + 100 + i for i in range(args.decoders)]
+    mocks = [
+        start_process([sys.executable, MOCK_SCRIPT, '--role', 'prefill', '--port', str(port)]) for port in prefill_ports
+    ] + [
+        start_process([sys.executable, MOCK_SCRIPT, '--role', 'decode', '--port', str(port),
+                       '--token-latency', str(args.token_latency)])
+        for port in decode_ports
+    ]
+    try:
+        for port in prefill_ports + decode_ports:
+            wait_ready(f"http://127.0.0.1:{port}/health")
+        print(f"{'workers':>8} {'req/s':>10} {'speedup':>8} {'p50 (ms)':>9} {'p99 (ms)':>9} {'errors':>7}")
+        baseline = None
+        for workers in args.workers:
+            proxy = start_process(
+                [sys.executable, PROXY_SCRIPT, '--host', '127.0.0.1', '--port', str(args.port),
+                 '--prefiller-hosts', *['127.0.0.1'] * args.prefillers,
+                 '--prefiller-ports', *map(str, prefill_ports),
+                 '--decoder-hosts', *['127.0.0.1'] * args.decoders,
+                 '--decoder-ports', *map(str, decode_ports),
+                 '--workers', str(workers)]
+            )
+            try:
+                wait_ready(f"http://127.0.0.1:{args.port}/healthcheck")
+                result = run_load(f"http://127.0.0.1:{args.port}/v1/completions", args)
+            finally:
+                proxy.terminate()
+                proxy.wait()
+            baseline = baseline or result['rps']
+            print(f"{workers:>8} {result['rps']:>10.1f} {result['rps'] / baseline:>7.2f}x "
+                  f"{result['p50'] * 1000:>9.1f} {result['p99'] * 1000:>9.1f} {result['errors']:>7}")
+    finally:
+        for mock in mocks:
+            mock.terminate()
+        for mock in mocks:
+            mock.wait()
+
+
+if __name__ == '__main__':
+    main()
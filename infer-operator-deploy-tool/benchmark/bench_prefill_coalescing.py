@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""Bursts of identical prompts with and without single-flight coalescing of their prefills."""
+import argparse
+import asyncio
+import random
+import sys
+
+import httpx
+
+from bench_multi_worker import MOCK_SCRIPT, PROXY_SCRIPT, start_process, wait_ready
+from load_generator import Results, percentile, send_request
+
+MODES = {
+    'independent': [],
+    'coalesced': ['--coalesce-prefills'],
+}
+
+
+async def generate_load(url, args, results):
+    """Poisson arrivals of new prompts, args.burst_share of them sent args.burst_size times at once."""
+    rng = random.Random(args.seed)
+    loop = asyncio.get_running_loop()
+    async with httpx.AsyncClient(timeout=120.0, limits=httpx.Limits(max_connections=None)) as client:
+        tasks = []
+        start = next_at = loop.time()
+        index = 0
+        while True:
+            next_at += rng.expovariate(args.rate)
+            if next_at - start > args.duration:
+                break
+            delay = next_at - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            index += 1
+            # Every prompt is new, so only copies sent together can share a prefill
+            body = {'model': 'mock', 'prompt': f"{index} " + 'hello ' * args.prompt_words,
+                    'max_tokens': args.max_tokens, 'stream': True}
+            copies = args.burst_size if rng.random() < args.burst_share else 1
+            for _ in range(copies):
+                results.sent += 1
+                tasks.append(asyncio.create_task(send_request(client, url, body, True, results)))
+        await asyncio.gather(*tasks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare independent and coalesced prefills of identical prompts')
+    parser.add_argument('--modes', nargs='+', choices=list(MODES), default=list(MODES))
+    parser.add_argument('--rate', type=float, default=5.0, help='Mean arrival rate of new prompts')
+    parser.add_argument('--duration', type=float, default=20.0)
+    parser.add_argument('--burst-share', type=float, default=0.3, help='Share of prompts sent as a burst of copies')
+    parser.add_argument('--burst-size', type=int, default=8, help='Identical requests in a burst')
+    parser.add_argument('--prompt-words', type=int, default=2000)
+    parser.add_argument('--max-tokens', type=int, default=4)
+    parser.add_argument('--prefill-token-latency', type=float, default=0.0001)
+    parser.add_argument('--token-latency', type=float, default=0.005)
+    parser.add_argument('--max-requests-per-prefiller', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--port', type=int, default=19000)
+    parser.add_argument('--backend-port', type=int, default=18000, help='First port used by the mock backends')
+    args = parser.parse_args()
+
+    prefill_port = args.backend_port
+    decode_port = args.backend_port + 100
+    print(f"{'mode':>12} {'sent':>6} {'errors':>7} {'coalesced':>10} {'rate':>6} {'coalesced tok':>13} "
+          f"{'prefilled tokens':>17} {'ttft p50':>9} {'ttft p99':>9}")
+    for mode in args.modes:
+        # Fresh prefiller prefix cache for every mode
+        mocks = [
+            start_process([sys.executable, MOCK_SCRIPT, '--role', 'prefill', '--port', str(prefill_port),
+                           '--prefill-token-latency', str(args.prefill_token_latency), '--prefix-cache', '1000']),
+            start_process([sys.executable, MOCK_SCRIPT, '--role', 'decode', '--port', str(decode_port),
+                           '--token-latency', str(args.token_latency)]),
+        ]
+        proxy = None
+        try:
+            for port in (prefill_port, decode_port):
+                wait_ready(f"http://127.0.0.1:{port}/health")
+            proxy = start_process(
+                [sys.executable, PROXY_SCRIPT, '--host', '127.0.0.1', '--port', str(args.port),
+                 '--prefiller-hosts', '127.0.0.1', '--prefiller-ports', str(prefill_port),
+                 '--decoder-hosts', '127.0.0.1', '--decoder-ports', str(decode_port),
+                 '--max-requests-per-prefiller', str(args.max_requests_per_prefiller), *MODES[mode]]
+            )
+            wait_ready(f"http://127.0.0.1:{args.port}/healthcheck")
+            results = Results()
+            asyncio.run(generate_load(f"http://127.0.0.1:{args.port}/v1/completions", args, results))
+            coalescing = httpx.get(f"http://127.0.0.1:{args.port}/healthcheck").json()['prefill_coalescing']
+            prefilled = httpx.get(f"http://127.0.0.1:{prefill_port}/stats").json()['prefill_tokens']
+        finally:
+            for process in ([proxy] if proxy else []) + mocks:
+                process.terminate()
+            for process in ([proxy] if proxy else []) + mocks:
+                process.wait()
+        results.ttfts.sort()
+        print(f"{mode:>12} {results.sent:>6} {results.errors:>7} {coalescing['coalesced']:>10} "
+              f"{coalescing['coalescing_rate']:>6.2f} {coalescing['coalesced_prompt_tokens']:>13} {prefilled:>17} "
+              f"{percentile(results.ttfts, 0.5) * 1000:>9.1f} {percentile(results.ttfts, 0.99) * 1000:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+import argparse
+from collections import OrderedDict
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'start'))
+
+from indexed_heap import IndexedHeap  # noqa: E402
+from routing_policy import LeastLoadPolicy, PrefixAffinityPolicy, prefix_block_hashes  # noqa: E402
+
+
+class MockBackend:
+    """Backend with an LRU prefix KV cache measured in blocks."""
+
+    def __init__(self, capacity_blocks):
+        self.capacity_blocks = capacity_blocks
+        self.cache = OrderedDict()
+        self.cached_blocks = 0
+        self.total_blocks = 0
+        self.total_tokens = 0
+
+    def serve(self, block_hashes, tokens):
+        self.total_tokens += tokens
+        self.total_blocks += len(block_hashes)
+        reusing = True
+        for block_hash in block_hashes:
+            if reusing and block_hash in self.cache:
+                self.cached_blocks += 1
+                self.cache.move_to_end(block_hash)
+                continue
+            # a prefix cache can only reuse blocks up to the first miss
+            reusing = False
+            self.cache[block_hash] = True
+        while len(self.cache) > self.capacity_blocks:
+            self.cache.popitem(last=False)
+
+
+def build_workload(args, rng):
+    system_prompts = [
+        ''.join(rng.choices(string.ascii_letters, k=rng.randint(args.prefix_len // 2, args.prefix_len)))
+        for _ in range(args.system_prompts)
+    ]
+    weights = [1.0 / (rank + 1) ** args.zipf for rank in range(args.system_prompts)]
+    workload = []
+    for _ in range(args.requests):
+        prefix = rng.choices(system_prompts, weights)[0]
+        suffix = ''.join(rng.choices(string.ascii_letters, k=rng.randint(16, args.suffix_len)))
+        workload.append(prefix + suffix)
+    return workload
+
+
+def replay(policy, workload, args, concurrency, seed):
+    rng = random.Random(seed)
+    backends = [MockBackend(args.cache_blocks) for _ in range(args.backends)]
+    heap = IndexedHeap({i: 0 for i in range(args.backends)})
+    in_flight = []
+    start = time.perf_counter()
+    for prompt in workload:
+        hashes = prefix_block_hashes(prompt, args.block_size, args.max_blocks)
+        tokens = len(prompt)
+        chosen = policy.select(heap, tokens, hashes)
+        heap.update(chosen, heap.priority(chosen) + tokens)
+        backends[chosen].serve(hashes, tokens)
+        in_flight.append((chosen, tokens))
+        if len(in_flight) >= concurrency:
+            idx, released = in_flight.pop(rng.randrange(len(in_flight)))
+            heap.update(idx, heap.priority(idx) - released)
+    elapsed = time.perf_counter() - start
+
+    cached = sum(b.cached_blocks for b in backends)
+    total = sum(b.total_blocks for b in backends)
+    loads = [b.total_tokens for b in backends]
+    return {
+        'cache_hit': cached / total if total else 0.0,
+        'imbalance': max(loads) / (sum(loads) / len(loads)),
+        'route_us': elapsed / len(workload) * 1e6,
+        'stats': policy.stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a shared-prefix workload against mock prefix-caching backends')
+    parser.add_argument('--requests', type=int, default=50000)
+    parser.add_argument('--backends', type=int, default=16)
+    parser.add_argument('--system-prompts', type=int, default=64, help='Number of distinct shared prefixes')
+    parser.add_argument('--zipf', type=float, default=1.1, help='Zipf exponent of shared prefix popularity')
+    parser.add_argument('--prefix-len', type=int, default=8192, help='Maximum shared prefix length in bytes')
+    parser.add_argument('--suffix-len', type=int, default=1024, help='Maximum per-request suffix length in bytes')
+    parser.add_argument('--block-size', type=int, default=512)
+    parser.add_argument('--max-blocks', type=int, default=64)
+    parser.add_argument('--cache-blocks', type=int, default=256, help='Prefix cache capacity per backend in blocks')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[4, 256],
+                        help='Requests in flight, one run per value, a low value checks affinity on a light load')
+    parser.add_argument('--load-factor', type=float, default=1.25)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    workload = build_workload(args, random.Random(args.seed))
+    print(f"{'concurrency':>11} {'policy':>16} {'backend cache hit':>18} {'load max/mean':>14} {'route (us)':>11} "
+          f"{'affinity hit':>13}")
+    for concurrency in args.concurrency:
+        policies = [
+            LeastLoadPolicy(),
+            PrefixAffinityPolicy(load_factor=args.load_factor),
+        ]
+        for policy in policies:
+            result = replay(policy, workload, args, concurrency, args.seed)
+            affinity = result['stats'].get('hit_rate')
+            affinity = f"{affinity:.1%}" if affinity is not None else '-'
+            print(f"{concurrency:>11} {policy.name:>16} {result['cache_hit']:>18.1%} {result['imbalance']:>14.2f} "
+                  f"{result['route_us']:>11.1f} {affinity:>13}")
+
+
+if __name__ == '__main__':
+    main()
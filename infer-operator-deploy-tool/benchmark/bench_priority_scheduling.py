@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""Per-class latency of the admission queue's scheduling policies under a mixed short/long workload."""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'start'))
+
+from admission_control import SCHEDULING_POLICIES, AdmissionController, AdmissionRejected  # noqa: E402
+from priority_classes import PriorityClass  # noqa: E402
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(len(values) * q))] if values else float('nan')
+
+
+class MockBackends:
+    """Backends serving max_requests requests each, with a service time linear in the request's tokens."""
+
+    def __init__(self, count, max_requests):
+        self.active = [0] * count
+        self.max_requests = max_requests
+
+    def try_admit(self, token_count):
+        idx = min(range(len(self.active)), key=self.active.__getitem__)
+        if self.active[idx] >= self.max_requests:
+            return None
+        self.active[idx] += 1
+        return idx
+
+    def release(self, idx):
+        self.active[idx] -= 1
+
+
+def build_workload(args, rng):
+    """Return (arrival offset, tokens, class) tuples: many short interactive requests, few long batch ones."""
+    classes = {
+        'short': PriorityClass('short', deadline=args.short_deadline, weight=args.short_weight),
+        'long': PriorityClass('long', deadline=args.long_deadline),
+    }
+    workload = []
+    arrival = 0.0
+    while True:
+        arrival += rng.expovariate(args.rate)
+        if arrival > args.duration:
+            return workload
+        if rng.random() < args.long_fraction:
+            tokens = int(rng.uniform(0.5, 1.5) * args.long_tokens)
+            workload.append((arrival, tokens, classes['long']))
+        else:
+            tokens = int(rng.uniform(0.5, 1.5) * args.short_tokens)
+            workload.append((arrival, tokens, classes['short']))
+
+
+async def run_policy(policy, workload, args):
+    backends = MockBackends(args.backends, args.max_requests)
+    admission = AdmissionController(
+        max_queue_size=len(workload), queue_timeout=args.queue_timeout, scheduling=policy, sjf_aging=args.sjf_aging
+    )
+    latencies = {}
+    rejected = {}
+
+    async def serve(tokens, priority_class):
+        arrival = time.monotonic()
+        deadline = arrival + priority_class.deadline if priority_class.deadline else None
+        try:
+            idx = await admission.admit(backends.try_admit, backends.release, tokens, deadline, priority_class.weight)
+        except AdmissionRejected:
+            rejected[priority_class.name] = rejected.get(priority_class.name, 0) + 1
+            return
+        try:
+            await asyncio.sleep(args.service_base + tokens * args.service_per_token)
+        finally:
+            backends.release(idx)
+            admission.wake()
+        latencies.setdefault(priority_class.name, []).append(time.monotonic() - arrival)
+
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    tasks = []
+    for arrival, tokens, priority_class in workload:
+        delay = start + arrival - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(serve(tokens, priority_class)))
+    await asyncio.gather(*tasks)
+    return latencies, rejected
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare fifo/edf/sjf admission queues on a mixed workload')
+    parser.add_argument('--policies', nargs='+', default=list(SCHEDULING_POLICIES), choices=SCHEDULING_POLICIES)
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds during which requests arrive')
+    parser.add_argument('--rate', type=float, default=200.0, help='Mean request arrival rate per second')
+    parser.add_argument('--backends', type=int, default=4)
+    parser.add_argument('--max-requests', type=int, default=1, help='Concurrent requests per backend')
+    parser.add_argument('--short-tokens', type=int, default=200)
+    parser.add_argument('--long-tokens', type=int, default=8000)
+    parser.add_argument('--long-fraction', type=float, default=0.2)
+    parser.add_argument('--service-base', type=float, default=0.001, help='Fixed service seconds per request')
+    parser.add_argument('--service-per-token', type=float, default=0.00001, help='Service seconds per token')
+    parser.add_argument('--short-deadline', type=float, default=0.1, help='Deadline of short requests (s)')
+    parser.add_argument('--long-deadline', type=float, default=2.0, help='Deadline of long requests (s)')
+    parser.add_argument('--short-weight', type=float, default=1.0, help='sjf weight of short requests')
+    parser.add_argument('--sjf-aging', type=float, default=1000.0)
+    parser.add_argument('--queue-timeout', type=float, default=30.0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    workload = build_workload(args, random.Random(args.seed))
+    mean_service = sum(args.service_base + tokens * args.service_per_token for _, tokens, _ in workload) / len(workload)
+    utilization = args.rate * mean_service / (args.backends * args.max_requests)
+    print(f"{len(workload)} requests, offered utilization {utilization:.0%}")
+    print(f"{'policy':>7} {'class':>6} {'p50 (ms)':>9} {'p99 (ms)':>9} {'max (ms)':>9} {'missed':>7} {'rejected':>9}")
+    for policy in args.policies:
+        latencies, rejected = asyncio.run(run_policy(policy, workload, args))
+        for name, deadline in (('short', args.short_deadline), ('long', args.long_deadline)):
+            values = sorted(latencies.get(name, []))
+            missed = sum(1 for value in values if value > deadline) / max(len(values), 1)
+            print(f"{policy:>7} {name:>6} {percentile(values, 0.5) * 1000:>9.1f} "
+                  f"{percentile(values, 0.99) * 1000:>9.1f} {(values[-1] if values else 0) * 1000:>9.1f} "
+                  f"{missed:>7.1%} {rejected.get(name, 0):>9}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""Prefill attempts during a partial outage with and without the retry budget, and TTFT with hedged prefills."""
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+import httpx
+
+from bench_multi_worker import MOCK_SCRIPT, PROXY_SCRIPT, start_process, wait_ready
+from load_generator import percentile
+
+# Outlier detection would eject the failing prefiller and hide the retries
+NO_OUTLIER_DETECTION = ['--outlier-detection-config', json.dumps({'enabled': False})]
+SCENARIOS = {
+    'outage': {
+        'no_budget': {'budget': False},
+        'budget': {'budget': True},
+    },
+    'stragglers': {
+        'no_hedge': {},
+        'hedge': {'hedge_prefill': True},
+    },
+}
+
+
+async def measure(url, args):
+    body = {'model': 'mock', 'prompt': 'hello ' * args.prompt_words, 'max_tokens': args.max_tokens, 'stream': True}
+    ttfts = []
+    errors = 0
+    remaining = args.requests
+    async with httpx.AsyncClient(timeout=60.0) as client:
+
+        async def user():
+            nonlocal errors, remaining
+            while remaining > 0:
+                remaining -= 1
+                start = time.perf_counter()
+                ttft = None
+                try:
+                    async with client.stream('POST', url, json=body) as response:
+                        async for _ in response.aiter_bytes():
+                            if ttft is None:
+                                ttft = time.perf_counter() - start
+                    if response.status_code == 200 and ttft is not None:
+                        ttfts.append(ttft)
+                    else:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+
+        await asyncio.gather(*(user() for _ in range(args.concurrency)))
+    ttfts.sort()
+    return ttfts, errors
+
+
+def prefiller_stats(ports):
+    return [httpx.get(f"http://127.0.0.1:{port}/stats").json() for port in ports]
+
+
+def run_scenario(scenario, args):
+    prefill_ports = [args.backend_port, args.backend_port + 1]
+    decode_port = args.backend_port + 100
+    if scenario == 'outage':
+        # One of the two prefillers fails most of its requests
+        prefill_args = [['--error-rate', str(args.error_rate)], []]
+    else:
+        prefill_args = [['--slow-rate', str(args.slow_rate), '--slow-factor', str(args.slow_factor)]] * 2
+    print(f"{scenario}:")
+    print(f"{'mode':>10} {'requests':>9} {'attempts':>9} {'failed':>7} {'attempts/req':>13} {'ttft p50':>9} "
+          f"{'ttft p99':>9} {'errors':>7}")
+    for mode, retry_config in SCENARIOS[scenario].items():
+        mocks = [
+            start_process([sys.executable, MOCK_SCRIPT, '--role', 'prefill', '--port', str(port),
+                           '--prefill-latency', str(args.prefill_latency), '--seed', str(index), *extra])
+            for index, (port, extra) in enumerate(zip(prefill_ports, prefill_args))
+        ]
+        mocks.append(start_process([sys.executable, MOCK_SCRIPT, '--role', 'decode', '--port', str(decode_port),
+                                    '--token-latency', str(args.token_latency)]))
+        proxy = None
+        try:
+            for port in prefill_ports + [decode_port]:
+                wait_ready(f"http://127.0.0.1:{port}/health")
+            retry_config = {'min_retries_per_second': args.min_retries_per_second, **retry_config}
+            proxy = start_process(
+                [sys.executable, PROXY_SCRIPT, '--host', '127.0.0.1', '--port', str(args.port),
+                 '--prefiller-hosts', '127.0.0.1', '127.0.0.1', '--prefiller-ports', *map(str, prefill_ports),
+                 '--decoder-hosts', '127.0.0.1', '--decoder-ports', str(decode_port),
+                 '--max-retries', str(args.max_retries), '--retry-config', json.dumps(retry_config),
+                 *NO_OUTLIER_DETECTION]
+            )
+            wait_ready(f"http://127.0.0.1:{args.port}/healthcheck")
+            ttfts, errors = asyncio.run(measure(f"http://127.0.0.1:{args.port}/v1/completions", args))
+            stats = prefiller_stats(prefill_ports)
+        finally:
+            for process in ([proxy] if proxy else []) + mocks:
+                process.terminate()
+            for process in ([proxy] if proxy else []) + mocks:
+                process.wait()
+        attempts = sum(stat['requests'] for stat in stats)
+        failed = sum(stat['failed'] for stat in stats)
+        print(f"{mode:>10} {args.requests:>9} {attempts:>9} {failed:>7} {attempts / args.requests:>13.2f} "
+              f"{percentile(ttfts, 0.5) * 1000:>9.1f} {percentile(ttfts, 0.99) * 1000:>9.1f} {errors:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare retries without and with the retry budget, and hedging')
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--prompt-words', type=int, default=64)
+    parser.add_argument('--max-tokens', type=int, default=2)
+    parser.add_argument('--prefill-latency', type=float, default=0.02)
+    parser.add_argument('--token-latency', type=float, default=0.001)
+    parser.add_argument('--max-retries', type=int, default=3)
+    parser.add_argument('--min-retries-per-second', type=float, default=1.0)
+    parser.add_argument('--error-rate', type=float, default=0.9, help='Outage: failure rate of the first prefiller')
+    parser.add_argument('--slow-rate', type=float, default=0.03, help='Stragglers: share of slow prefills')
+    parser.add_argument('--slow-factor', type=float, default=20.0)
+    parser.add_argument('--port', type=int, default=19000)
+    parser.add_argument('--backend-port', type=int, default=18000, help='First port used by the mock backends')
+    args = parser.parse_args()
+    for scenario in args.scenarios:
+        run_scenario(scenario, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""Requests lost while the router restarts, with a drain and restart versus a SO_REUSEPORT handover."""
+import argparse
+import asyncio
+import signal
+import sys
+import time
+
+import httpx
+
+from bench_multi_worker import MOCK_SCRIPT, PROXY_SCRIPT, start_process, wait_ready
+
+MODES = {
+    # The old router drains on SIGTERM and exits, the new one starts after it
+    'restart': [],
+    # The new router binds the port next to the old one, which then drains
+    'handover': ['--reuse-port'],
+}
+
+
+class Outcomes:
+    def __init__(self):
+        self.completed = 0
+        self.refused = 0
+        self.failed = 0
+
+
+async def stream_requests(url, args, outcomes, stop):
+    body = {'model': 'mock', 'prompt': 'hello ' * 64, 'max_tokens': args.max_tokens, 'stream': True}
+    async with httpx.AsyncClient(timeout=60.0) as client:
+
+        async def user():
+            while not stop.is_set():
+                try:
+                    async with client.stream('POST', url, json=body) as response:
+                        content = b''.join([chunk async for chunk in response.aiter_bytes()])
+                except httpx.HTTPError:
+                    outcomes.failed += 1
+                    await asyncio.sleep(0.05)
+                    continue
+                if response.status_code == 200 and b'[DONE]' in content:
+                    outcomes.completed += 1
+                elif response.status_code == 503:
+                    outcomes.refused += 1
+                    await asyncio.sleep(0.05)
+                else:
+                    outcomes.failed += 1
+
+        await asyncio.gather(*(user() for _ in range(args.concurrency)))
+
+
+def start_proxy(args, mode):
+    return start_process(
+        [sys.executable, PROXY_SCRIPT, '--host', '127.0.0.1', '--port', str(args.port),
+         '--prefiller-hosts', '127.0.0.1', '--prefiller-ports', str(args.backend_port),
+         '--decoder-hosts', '127.0.0.1', '--decoder-ports', str(args.backend_port + 100), *MODES[mode]]
+    )
+
+
+async def restart(args, mode, old):
+    """Replace the old router by a new one, return it and the seconds from SIGTERM until it serves alone."""
+    if mode == 'handover':
+        new = start_proxy(args, mode)
+        # The port of the new router's worker comes after the one the old router keeps
+        await asyncio.to_thread(wait_ready, f"http://127.0.0.1:{args.port + 2}/healthcheck")
+        started = time.monotonic()
+        old.send_signal(signal.SIGTERM)
+        await asyncio.to_thread(old.wait)
+        return new, time.monotonic() - started
+    started = time.monotonic()
+    old.send_signal(signal.SIGTERM)
+    await asyncio.to_thread(old.wait)
+    new = start_proxy(args, mode)
+    await asyncio.to_thread(wait_ready, f"http://127.0.0.1:{args.port}/healthcheck")
+    return new, time.monotonic() - started
+
+
+async def run_mode(args, mode):
+    outcomes = Outcomes()
+    stop = asyncio.Event()
+    old = start_proxy(args, mode)
+    new = None
+    try:
+        await asyncio.to_thread(wait_ready, f"http://127.0.0.1:{args.port}/healthcheck")
+        url = f"http://127.0.0.1:{args.port}/v1/completions"
+        load = asyncio.create_task(stream_requests(url, args, outcomes, stop))
+        await asyncio.sleep(args.warmup)
+        new, seconds = await restart(args, mode, old)
+        await asyncio.sleep(args.warmup)
+        stop.set()
+        await load
+    finally:
+        for process in (old, new):
+            if process is not None and process.poll() is None:
+                process.terminate()
+                process.wait()
+    return outcomes, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare a drain and restart of the router with a port handover')
+    parser.add_argument('--modes', nargs='+', choices=list(MODES), default=list(MODES))
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--max-tokens', type=int, default=200)
+    parser.add_argument('--token-latency', type=float, default=0.01)
+    parser.add_argument('--prefill-latency', type=float, default=0.05)
+    parser.add_argument('--warmup', type=float, default=5.0, help='Seconds of load before and after the restart')
+    parser.add_argument('--port', type=int, default=19000)
+    parser.add_argument('--backend-port', type=int, default=18000, help='First port used by the mock backends')
+    args = parser.parse_args()
+
+    mocks = [
+        start_process([sys.executable, MOCK_SCRIPT, '--role', 'prefill', '--port', str(args.backend_port),
+                       '--prefill-latency', str(args.prefill_latency)]),
+        start_process([sys.executable, MOCK_SCRIPT, '--role', 'decode', '--port', str(args.backend_port + 100),
+                       '--token-latency', str(args.token_latency)]),
+    ]
+    try:
+        for port in (args.backend_port, args.backend_port + 100):
+            wait_ready(f"http://127.0.0.1:{port}/health")
+        print(f"{'mode':>10} {'completed':>10} {'refused':>8} {'failed':>7} {'restart (s)':>12}")
+        for mode in args.modes:
+            outcomes, seconds = asyncio.run(run_mode(args, mode))
+            print(f"{mode:>10} {outcomes.completed:>10} {outcomes.refused:>8} {outcomes.failed:>7} {seconds:>12.1f}")
+    finally:
+        for process in mocks:
+            process.terminate()
+        for process in mocks:
+            process.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'start'))
+
+from sse_framer import SSEFramer  # noqa: E402
+
+RECOMPUTE_MARKER = b'"recomputed"'
+
+
+def build_stream(stream_idx, events_per_stream, recompute):
+    events = []
+    for i in range(events_per_stream):
+        stop_reason = "recomputed" if recompute and i == events_per_stream - 1 else None
+        payload = {
+            "id": f"cmpl-{stream_idx}-0",
+            "object": "text_completion",
+            "choices": [{"index": 0, "text": f" token{i}", "stop_reason": stop_reason}],
+        }
+        events.append(b"data: " + json.dumps(payload).encode("utf-8") + b"\n\n")
+    return b"".join(events)
+
+
+def split_reads(blob, rng, split_ratio):
+    """Cut a stream into TCP-like reads: mostly one event per read, some split or coalesced."""
+    reads = []
+    pos = 0
+    while pos < len(blob):
+        end = blob.find(b"\n\n", pos) + 2
+        if rng.random() < split_ratio:
+            end = pos + rng.randint(1, max(1, 2 * (end - pos)))
+        reads.append(blob[pos:end])
+        pos = end
+    return reads
+
+
+def per_chunk_decode(streams):
+    """Old behaviour: treat each read as one event and json-decode it."""
+    decode_failures = 0
+    recomputes = 0
+    for reads in zip_streams(streams):
+        for _, chunk in reads:
+            try:
+                chunk_str = chunk.decode("utf-8").strip()
+            except UnicodeDecodeError:
+                decode_failures += 1
+                continue
+            if chunk_str.startswith("data: "):
+                chunk_str = chunk_str[len("data: "):]
+            try:
+                chunk_json = json.loads(chunk_str)
+            except json.JSONDecodeError:
+                decode_failures += 1
+                continue
+            if not isinstance(chunk_json, dict):
+                decode_failures += 1
+                continue
+            choices = chunk_json.get("choices", [])
+            if choices and choices[0].get("stop_reason") == "recomputed":
+                recomputes += 1
+    return decode_failures, recomputes
+
+
+def framed_scan(streams):
+    """New behaviour: frame whole events and only decode the ones carrying the recompute marker."""
+    framers = [SSEFramer() for _ in streams]
+    decode_failures = 0
+    recomputes = 0
+    for reads in zip_streams(streams):
+        for stream_idx, chunk in reads:
+            for event in framers[stream_idx].feed(chunk):
+                if RECOMPUTE_MARKER not in event:
+                    continue
+                try:
+                    chunk_json = json.loads(event[len(b"data: "):])
+                except json.JSONDecodeError:
+                    decode_failures += 1
+                    continue
+                if chunk_json["choices"][0].get("stop_reason") == "recomputed":
+                    recomputes += 1
+    return decode_failures, recomputes
+
+
+def zip_streams(streams):
+    """Interleave reads of all streams round-robin, as the event loop would deliver them."""
+    depth = max(len(reads) for reads in streams)
+    for i in range(depth):
+        yield [(stream_idx, reads[i]) for stream_idx, reads in enumerate(streams) if i < len(reads)]
+
+
+def measure(func, streams):
+    start = time.perf_counter()
+    result = func(streams)
+    elapsed = time.perf_counter() - start
+    # memory is traced in a separate run, tracing slows the timed one down
+    tracemalloc.start()
+    func(streams)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare per-chunk decode with incremental SSE framing')
+    parser.add_argument('--streams', type=int, default=10000, help='Number of concurrent streams')
+    parser.add_argument('--events', type=int, default=32, help='Events per stream')
+    parser.add_argument('--split-ratio', type=float, default=0.1, help='Share of reads not aligned to one event')
+    parser.add_argument('--recompute-ratio', type=float, default=0.01, help='Share of streams ending in recompute')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    streams = []
+    expected_recomputes = 0
+    for stream_idx in range(args.streams):
+        recompute = rng.random() < args.recompute_ratio
+        expected_recomputes += recompute
+        blob = build_stream(stream_idx, args.events, recompute)
+        streams.append(split_reads(blob, rng, args.split_ratio))
+    total_events = args.streams * args.events
+
+    print(f"{args.streams} streams x {args.events} events, {expected_recomputes} recomputes expected")
+    print(f"{'method':>18} {'events/s':>12} {'peak mem (KiB)':>15} {'decode errors':>14} {'recomputes':>11}")
+    for name, func in (('per-chunk decode', per_chunk_decode), ('framed scan', framed_scan)):
+        elapsed, peak, (failures, recomputes) = measure(func, streams)
+        print(f"{name:>18} {total_events / elapsed:>12,.0f} {peak / 1024:>15,.0f} {failures:>14} {recomputes:>11}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""Open-loop load generator for the PD proxy, optionally against mock backends it starts itself."""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shlex
+import sys
+import time
+
+import httpx
+
+from bench_multi_worker import MOCK_SCRIPT, PROXY_SCRIPT, start_process, wait_ready
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+
+def process_tree(pid):
+    """Return pid and all its descendants, e.g. the proxy's worker processes."""
+    pids = [pid]
+    for current in pids:
+        try:
+            for tid in os.listdir(f'/proc/{current}/task'):
+                with open(f'/proc/{current}/task/{tid}/children', encoding='utf-8') as f:
+                    pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            continue
+    return pids
+
+
+def cpu_seconds(pids):
+    """Return user + system CPU seconds per pid, read from /proc."""
+    usage = {}
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/stat', encoding='utf-8') as f:
+                # The command name may contain spaces, the fields after it do not
+                stat_fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        usage[pid] = (int(stat_fields[11]) + int(stat_fields[12])) / CLOCK_TICKS
+    return usage
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(len(values) * q))] if values else float('nan')
+
+
+class Results:
+    def __init__(self):
+        self.sent = 0
+        self.completed = 0
+        self.errors = 0
+        self.output_tokens = 0
+        self.ttfts = []
+        self.tpots = []
+        self.latencies = []
+        self.arrival_lags = []
+
+
+async def send_request(client, url, body, stream, results):
+    start = time.perf_counter()
+    first_event = last_event = None
+    events = 0
+    chunks = []
+    try:
+        async with client.stream('POST', url, json=body) as response:
+            async for chunk in response.aiter_bytes():
+                now = time.perf_counter()
+                if first_event is None:
+                    first_event = now
+                last_event = now
+                if stream:
+                    events += chunk.count(b'data: ') - chunk.count(b'data: [DONE]')
+                else:
+                    chunks.append(chunk)
+            if response.status_code != 200 or first_event is None:
+                results.errors += 1
+                return
+    except httpx.HTTPError:
+        results.errors += 1
+        return
+    end = time.perf_counter()
+    results.completed += 1
+    results.latencies.append(end - start)
+    results.ttfts.append(first_event - start)
+    if stream:
+        results.output_tokens += events
+        if events > 1:
+            results.tpots.append((last_event - first_event) / (events - 1))
+    else:
+        try:
+            results.output_tokens += json.loads(b''.join(chunks)).get('usage', {}).get('completion_tokens') or 0
+        except ValueError:
+            pass
+
+
+async def generate_load(args, results):
+    """Poisson arrivals at args.rate, each request is sent whether or not earlier ones finished."""
+    api = '/v1/chat/completions' if args.chat else '/v1/completions'
+    prompt = 'hello ' * args.prompt_words
+    body = {'model': args.model, 'max_tokens': args.max_tokens, 'stream': args.stream}
+    if args.chat:
+        body['messages'] = [{'role': 'user', 'content': prompt}]
+    else:
+        body['prompt'] = prompt
+    rng = random.Random(args.seed)
+    loop = asyncio.get_running_loop()
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=args.keepalive)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        tasks = []
+        start = loop.time()
+        next_at = start
+        while True:
+            next_at += rng.expovariate(args.rate)
+            if next_at - start > args.duration:
+                break
+            delay = next_at - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            # How late the generator sends, if it grows the generator itself is the bottleneck
+            results.arrival_lags.append(loop.time() - next_at)
+            results.sent += 1
+            tasks.append(asyncio.create_task(send_request(client, args.url + api, body, args.stream, results)))
+        await asyncio.gather(*tasks)
+
+
+def launch_backends(args):
+    """Start mock prefillers and decoders and a proxy routing to them, return the processes."""
+    prefill_ports = [args.backend_port + i for i in range(args.prefillers)]
+    decode_ports = [args.backend_port + 100 + i for i in range(args.decoders)]
+    mocks = [
+        start_process([sys.executable, MOCK_SCRIPT, '--role', 'prefill', '--port', str(port),
+                       '--prefill-latency', str(args.prefill_latency),
+                       '--prefill-token-latency', str(args.prefill_token_latency)])
+        for port in prefill_ports
+    ] + [
+        start_process([sys.executable, MOCK_SCRIPT, '--role', 'decode', '--port', str(port),
+                       '--token-latency', str(args.token_latency),
+                       '--recompute-rate', str(args.recompute_rate), '--seed', str(args.seed + i)])
+        for i, port in enumerate(decode_ports)
+    ]
+    for port in prefill_ports + decode_ports:
+        wait_ready(f"http://127.0.0.1:{port}/health")
+    proxy = start_process(
+        [sys.executable, PROXY_SCRIPT, '--host', '127.0.0.1', '--port', str(args.port),
+         '--prefiller-hosts', *['127.0.0.1'] * args.prefillers, '--prefiller-ports', *map(str, prefill_ports),
+         '--decoder-hosts', *['127.0.0.1'] * args.decoders, '--decoder-ports', *map(str, decode_ports),
+         *shlex.split(args.proxy_args)]
+    )
+    wait_ready(f"http://127.0.0.1:{args.port}/healthcheck")
+    args.url = f"http://127.0.0.1:{args.port}"
+    args.proxy_pid = args.proxy_pid or [proxy.pid]
+    return mocks + [proxy]
+
+
+def summarize(results, elapsed, proxy_cpu):
+    for values in (results.ttfts, results.tpots, results.latencies, results.arrival_lags):
+        values.sort()
+    summary = {
+        'sent': results.sent,
+        'completed': results.completed,
+        'errors': results.errors,
+        'elapsed_s': elapsed,
+        'throughput_rps': results.completed / elapsed,
+        'output_tokens_per_s': results.output_tokens / elapsed,
+        'arrival_lag_p99_ms': percentile(results.arrival_lags, 0.99) * 1000,
+    }
+    for name, values in (('ttft', results.ttfts), ('tpot', results.tpots), ('latency', results.latencies)):
+        for q in (0.5, 0.9, 0.99):
+            summary[f'{name}_p{int(q * 100)}_ms'] = percentile(values, q) * 1000
+    if proxy_cpu is not None:
+        summary['proxy_cpu_s'] = proxy_cpu
+        summary['proxy_cpu_utilization'] = proxy_cpu / elapsed
+        summary['proxy_cpu_ms_per_request'] = proxy_cpu * 1000 / max(results.completed, 1)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Open-loop load generator reporting throughput, TTFT/TPOT and '
+                                                 'proxy CPU per request')
+    parser.add_argument('--url', type=str, default='http://127.0.0.1:19000', help='Proxy base URL')
+    parser.add_argument('--rate', type=float, default=50.0, help='Mean request arrival rate per second')
+    parser.add_argument('--duration', type=float, default=30.0, help='Seconds during which requests are sent')
+    parser.add_argument('--model', type=str, default='mock')
+    parser.add_argument('--chat', action='store_true', help='Send /v1/chat/completions instead of /v1/completions')
+    parser.add_argument('--prompt-words', type=int, default=256)
+    parser.add_argument('--max-tokens', type=int, default=64)
+    parser.add_argument('--no-stream', dest='stream', action='store_false')
+    parser.add_argument('--timeout', type=float, default=120.0)
+    parser.add_argument('--keepalive', type=int, default=512, help='Keep-alive connections kept by the client')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--proxy-pid', type=int, nargs='*', default=[],
+                        help='Proxy processes whose CPU time is measured, their children included')
+    parser.add_argument('--json', action='store_true', help='Print the summary as JSON')
+    launch = parser.add_argument_group('launch', 'Start mock backends and a proxy instead of using --url')
+    launch.add_argument('--launch', action='store_true')
+    launch.add_argument('--prefillers', type=int, default=2)
+    launch.add_argument('--decoders', type=int, default=4)
+    launch.add_argument('--prefill-latency', type=float, default=0.02)
+    launch.add_argument('--prefill-token-latency', type=float, default=0.0)
+    launch.add_argument('--token-latency', type=float, default=0.02)
+    launch.add_argument('--recompute-rate', type=float, default=0.0)
+    launch.add_argument('--proxy-args', type=str, default='', help='Extra proxy arguments, e.g. "--workers 2"')
+    launch.add_argument('--port', type=int, default=19000)
+    launch.add_argument('--backend-port', type=int, default=18000, help='First port used by the mock backends')
+    args = parser.parse_args()
+
+    processes = launch_backends(args) if args.launch else []
+    try:
+        results = Results()
+        proxy_pids = [pid for root in args.proxy_pid for pid in process_tree(root)]
+        cpu_before = cpu_seconds(proxy_pids)
+        start = time.perf_counter()
+        asyncio.run(generate_load(args, results))
+        elapsed = time.perf_counter() - start
+        proxy_cpu = None
+        if args.proxy_pid:
+            # Worker processes restarted during the run count from zero
+            cpu_after = cpu_seconds(pid for root in args.proxy_pid for pid in process_tree(root))
+            proxy_cpu = sum(used - cpu_before.get(pid, 0.0) for pid, used in cpu_after.items())
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+    summary = summarize(results, elapsed, proxy_cpu)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+    print(f"requests: {summary['sent']} sent, {summary['completed']} completed, {summary['errors']} errors "
+          f"in {elapsed:.1f}s")
+    print(f"throughput: {summary['throughput_rps']:.1f} req/s, {summary['output_tokens_per_s']:.1f} tokens/s")
+    print(f"{'':>12} {'p50 (ms)':>9} {'p90 (ms)':>9} {'p99 (ms)':>9}")
+    for name in ('ttft', 'tpot', 'latency'):
+        print(f"{name:>12} {summary[f'{name}_p50_ms']:>9.1f} {summary[f'{name}_p90_ms']:>9.1f} "
+              f"{summary[f'{name}_p99_ms']:>9.1f}")
+    if proxy_cpu is not None:
+        print(f"proxy cpu: {proxy_cpu:.2f}s, {summary['proxy_cpu_utilization'] * 100:.1f}% of one core, "
+              f"{summary['proxy_cpu_ms_per_request']:.3f} ms per request")
+    print(f"arrival lag p99: {summary['arrival_lag_p99_ms']:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""Mock vLLM prefill/decode server for benchmarking the PD proxy without NPUs."""
+import argparse
+import asyncio
+from collections import OrderedDict
+import json
+import random
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Request ids remembered as already recomputed, so that every request is recomputed at most once
+_RECOMPUTED_IDS = 65536
+
+
+def prompt_tokens(req_data: dict) -> int:
+    # Whitespace separated words stand in for tokens
+    if "messages" in req_data:
+        text = " ".join(str(message.get("content", "")) for message in req_data["messages"])
+    else:
+        text = str(req_data.get("prompt", ""))
+    return len(text.split())
+
+
+def create_app(args) -> FastAPI:
+    app = FastAPI()
+    metaserver_client = httpx.AsyncClient(timeout=None)
+    rng = random.Random(args.seed)
+    # Decoder side: request id -> set once the prefiller pushed the request's KV cache
+    kv_ready = {}
+    recomputed = OrderedDict()
+    stats = {"requests": 0, "active": 0, "recomputed": 0, "aborted": 0, "failed": 0, "prefill_tokens": 0}
+    # Prefiller side with --prefix-cache: prompts prefilled before, whose KV cache is reused
+    cached_prompts = OrderedDict()
+    # Prefiller side: request id -> set when the proxy aborts the request through /v1/abort_requests
+    prefill_aborts = {}
+
+    async def push_kv(kv_transfer_params):
+        # Simulated layerwise KV transfer to the decoder named in the kv_transfer_params
+        await asyncio.sleep(args.kv_transfer_latency)
+        url = f"http://{kv_transfer_params['remote_host']}:{kv_transfer_params['remote_port']}/kv_ready"
+        await metaserver_client.post(url, json={"request_id": kv_transfer_params["request_id"]})
+
+    def should_recompute(request_id: str, max_tokens: int) -> bool:
+        if not args.recompute_rate or max_tokens <= args.recompute_after or request_id in recomputed:
+            return False
+        if rng.random() >= args.recompute_rate:
+            return False
+        recomputed[request_id] = True
+        if len(recomputed) > _RECOMPUTED_IDS:
+            recomputed.popitem(last=False)
+        stats["recomputed"] += 1
+        return True
+
+    async def handle(request: Request, api: str):
+        if args.network_latency:
+            # Connection setup and upload of the request, before the body is complete
+            await asyncio.sleep(args.network_latency)
+        req_data = await request.json()
+        request_id = request.headers.get("X-Request-Id", "mock")
+        chat = api == "/chat/completions"
+        stats["requests"] += 1
+        if args.role == "prefill":
+            if args.error_rate and rng.random() < args.error_rate:
+                stats["failed"] += 1
+                return JSONResponse({"error": "mock failure"}, status_code=503)
+            stats["active"] += 1
+            aborted = prefill_aborts[request_id] = asyncio.Event()
+            try:
+                prompt = json.dumps(req_data.get("messages") or req_data.get("prompt"))
+                # Like vLLM, a cached prompt still computes its last token
+                tokens = 1 if prompt in cached_prompts else prompt_tokens(req_data)
+                stats["prefill_tokens"] += tokens
+                latency = args.prefill_latency + args.prefill_token_latency * tokens
+                if args.slow_rate and rng.random() < args.slow_rate:
+                    latency *= args.slow_factor
+                try:
+                    await asyncio.wait_for(aborted.wait(), latency)
+                except asyncio.TimeoutError:
+                    pass
+                else:
+                    stats["aborted"] += 1
+                    return JSONResponse({"error": "request aborted"}, status_code=499)
+                if args.prefix_cache:
+                    cached_prompts[prompt] = True
+                    cached_prompts.move_to_end(prompt)
+                    if len(cached_prompts) > args.prefix_cache:
+                        cached_prompts.popitem(last=False)
+                kv_transfer_params = req_data.get("kv_transfer_params") or {}
+                if kv_transfer_params.get("remote_host"):
+                    await push_kv(kv_transfer_params)
+            finally:
+                stats["active"] -= 1
+                prefill_aborts.pop(request_id, None)
+            return JSONResponse({"id": request_id, "choices": [{"index": 0, "text": ""}]})
+
+        api_request_id = f"chatcmpl-{request_id}" if chat else f"cmpl-{request_id}-0"
+        kv_transfer_params = req_data.get("kv_transfer_params") or {}
+        if kv_transfer_params.get("metaserver"):
+            if args.wait_kv:
+                kv_ready[api_request_id] = asyncio.Event()
+            # The decoder asks the proxy to run the prefill before it starts decoding
+            await metaserver_client.post(
+                kv_transfer_params["metaserver"],
+                json={"request_id": api_request_id, "remote_host": args.host, "remote_port": args.port},
+            )
+            if args.wait_kv:
+                try:
+                    await asyncio.wait_for(kv_ready[api_request_id].wait(), args.kv_wait_timeout)
+                except asyncio.TimeoutError:
+                    return JSONResponse({"error": "KV cache never arrived"}, status_code=500)
+                finally:
+                    del kv_ready[api_request_id]
+        max_tokens = req_data.get("max_completion_tokens") or req_data.get("max_tokens") or 16
+        stream = bool(req_data.get("stream"))
+        # Like vLLM, a preempted request stops with stop_reason "recomputed" and the proxy resubmits it
+        recompute_at = args.recompute_after if should_recompute(request_id, max_tokens) else None
+
+        async def generate():
+            stats["active"] += 1
+            try:
+                generated = 0
+                for i in range(max_tokens):
+                    if args.token_latency:
+                        await asyncio.sleep(args.token_latency)
+                    generated += 1
+                    if i == recompute_at:
+                        finish_reason, stop_reason = "stop", "recomputed"
+                    else:
+                        finish_reason = "length" if i == max_tokens - 1 else None
+                        stop_reason = None
+                    if stream:
+                        choice = {"index": 0, "finish_reason": finish_reason, "stop_reason": stop_reason}
+                        if chat:
+                            choice["delta"] = {"content": "tok "}
+                        else:
+                            choice["text"] = "tok "
+                        yield b"data: " + json.dumps({"id": api_request_id, "choices": [choice]}).encode() + b"\n\n"
+                    if stop_reason is not None:
+                        break
+                if stream:
+                    yield b"data: [DONE]\n\n"
+                else:
+                    stop_reason = "recomputed" if recompute_at is not None else None
+                    choice = {"index": 0, "finish_reason": "length", "stop_reason": stop_reason}
+                    if chat:
+                        choice["message"] = {"role": "assistant", "content": "tok " * generated}
+                    else:
+                        choice["text"] = "tok " * generated
+                    usage = {"prompt_tokens": prompt_tokens(req_data), "completion_tokens": generated}
+                    yield json.dumps({"id": api_request_id, "choices": [choice], "usage": usage}).encode()
+            finally:
+                stats["active"] -= 1
+
+        return StreamingResponse(generate(), media_type="text/event-stream" if stream else "application/json")
+
+    @app.post("/v1/completions")
+    async def completions(request: Request):
+        return await handle(request, "/completions")
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        return await handle(request, "/chat/completions")
+
+    @app.post("/v1/abort_requests")
+    async def abort_requests(request: Request):
+        for request_id in (await request.json()).get("request_ids", []):
+            aborted = prefill_aborts.get(request_id)
+            if aborted is not None:
+                aborted.set()
+        return {}
+
+    @app.post("/kv_ready")
+    async def kv_ready_callback(request: Request):
+        event = kv_ready.get((await request.json())["request_id"])
+        if event is not None:
+            event.set()
+        return {}
+
+    @app.get("/health")
+    async def health():
+        return {}
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mock vLLM prefill/decode server')
+    parser.add_argument('--role', choices=['prefill', 'decode'], required=True)
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, required=True)
+    parser.add_argument('--prefill-latency', type=float, default=0.0, help='Seconds a prefill request takes')
+    parser.add_argument('--prefill-token-latency', type=float, default=0.0,
+                        help='Additional prefill seconds per prompt token (whitespace separated word)')
+    parser.add_argument('--token-latency', type=float, default=0.0, help='Seconds per generated token')
+    parser.add_argument('--network-latency', type=float, default=0.0,
+                        help='Seconds between a request arriving and its body being read')
+    parser.add_argument('--kv-transfer-latency', type=float, default=0.0,
+                        help='Prefill: seconds the KV push to the decoder takes after the prefill')
+    parser.add_argument('--wait-kv', action='store_true',
+                        help='Decode: only start decoding once the prefiller pushed the KV cache')
+    parser.add_argument('--kv-wait-timeout', type=float, default=30.0)
+    parser.add_argument('--recompute-rate', type=float, default=0.0,
+                        help='Decode: fraction of requests stopped once with stop_reason "recomputed"')
+    parser.add_argument('--recompute-after', type=int, default=2,
+                        help='Decode: index of the token a recomputed request stops at')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Prefill: fraction of requests failed with 503 right away')
+    parser.add_argument('--slow-rate', type=float, default=0.0,
+                        help='Prefill: fraction of requests taking --slow-factor times as long, like stragglers')
+    parser.add_argument('--slow-factor', type=float, default=10.0)
+    parser.add_argument('--prefix-cache', type=int, default=0,
+                        help='Prefill: number of prefilled prompts whose KV cache is reused by identical prompts')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    uvicorn.run(create_app(args), host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
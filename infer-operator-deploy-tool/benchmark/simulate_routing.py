@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+"""
+Discrete-event trace replay of the PD proxy's routing against simulated backends.
+
+Routing decisions come from the proxy's own ProxyState.select_*/release_* and its
+routing policies, only time and the backends are simulated. A request picks its
+decoder on arrival and its prefiller when the decoder's metaserver callback would
+arrive, like in the proxy. Prefillers are FIFO queues with a fixed number of slots,
+a prefix KV cache (LRU of prompt blocks) and a service time linear in the uncached
+prompt tokens. Decoders run continuous batching: up to --decode-slots sequences
+share the decoder and each step takes longer the larger the batch, which is
+simulated as processor sharing, so each request costs a constant number of events
+whatever its output length. With --capacity-modes speed the proxy is told each
+backend's speed as its capacity, as run_router does from the hardware type and
+dp/tp sizes. With --topology-groups backends are spread over topology groups and
+KV transfers across groups take --cross-group-factor times longer; --topology-modes
+on lets the proxy prefer same-group prefillers.
+"""
+import argparse
+from bisect import bisect_left
+from collections import OrderedDict, deque
+import heapq
+from itertools import accumulate
+import json
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'start'))
+
+import load_balance_proxy_layerwise_server_example as proxy  # noqa: E402
+from outlier_detection import OutlierDetectionConfig  # noqa: E402
+from routing_policy import ROUTING_POLICIES, LeastLoadPolicy, create_routing_policy  # noqa: E402
+from topology import LOCAL, REMOTE, TopologyConfig  # noqa: E402
+
+# Event kinds, ordered so that simultaneous events keep a deterministic order
+ARRIVAL, CALLBACK, PREFILL_DONE, KV_ARRIVED, DECODE_STEP = range(5)
+
+
+class SimRequest:
+    __slots__ = (
+        'arrival', 'prompt_tokens', 'output_tokens', 'hash_ids', 'decoder', 'decoder_score', 'prefiller',
+        'prefiller_score', 'prefill_queued', 'prefill_wait', 'decode_queued', 'decode_wait', 'first_token', 'end',
+        'transfer', 'locality',
+    )
+
+    def __init__(self, arrival, prompt_tokens, output_tokens, hash_ids):
+        self.arrival = arrival
+        self.prompt_tokens = prompt_tokens
+        self.output_tokens = max(1, output_tokens)
+        self.hash_ids = hash_ids
+        self.decode_wait = 0.0
+
+
+def load_trace(path, time_scale):
+    """
+    Read a JSON lines trace. Each record has an arrival time in seconds ("arrival")
+    or milliseconds ("timestamp"), "prompt_tokens" or "input_length",
+    "output_tokens" or "output_length" and optionally the prompt's block hashes
+    ("hash_ids"), which is the Mooncake trace format.
+    """
+    requests = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            arrival = record['arrival'] if 'arrival' in record else record['timestamp'] / 1000.0
+            requests.append(SimRequest(
+                arrival * time_scale,
+                record.get('prompt_tokens', record.get('input_length', 0)),
+                record.get('output_tokens', record.get('output_length', 1)),
+                record.get('hash_ids'),
+            ))
+    requests.sort(key=lambda request: request.arrival)
+    return requests
+
+
+def synthetic_trace(args):
+    """Poisson arrivals, lognormal lengths and Zipf-distributed shared prefixes."""
+    rng = random.Random(args.seed)
+    weights = [1.0 / (rank + 1) ** args.zipf for rank in range(args.prefix_groups)]
+    cumulative = list(accumulate(weights))
+    prefix_blocks = max(1, args.prefix_tokens // args.block_tokens)
+    next_hash = args.prefix_groups * prefix_blocks
+    requests = []
+    now = 0.0
+    for _ in range(args.requests):
+        now += rng.expovariate(args.rate)
+        prompt_tokens = max(1, int(rng.lognormvariate(math.log(args.prompt_tokens), args.length_sigma)))
+        output_tokens = max(1, int(rng.lognormvariate(math.log(args.output_tokens), args.length_sigma)))
+        hash_ids = None
+        if args.prefix_groups:
+            group = min(bisect_left(cumulative, rng.random() * cumulative[-1]), len(cumulative) - 1)
+            blocks = max(1, -(-prompt_tokens // args.block_tokens))
+            shared = min(prefix_blocks, blocks)
+            # Blocks after the shared prefix are unique to the request
+            hash_ids = list(range(group * prefix_blocks, group * prefix_blocks + shared))
+            hash_ids.extend(range(next_hash, next_hash + blocks - shared))
+            next_hash += blocks - shared
+        requests.append(SimRequest(now, prompt_tokens, output_tokens, hash_ids))
+    return requests
+
+
+class PrefillBackend:
+    """FIFO prefiller with slots and an LRU prefix cache of prompt blocks."""
+
+    def __init__(self, slots, speed, cache_blocks):
+        self.slots = slots
+        self.speed = speed
+        self.cache_blocks = cache_blocks
+        self.cache = OrderedDict()
+        self.running = 0
+        self.queue = deque()
+        self.busy_time = 0.0
+        self.cached_tokens = 0
+        self.prompt_tokens = 0
+
+    def service_time(self, request, args):
+        cached = 0
+        if request.hash_ids and self.cache_blocks:
+            cache = self.cache
+            for hash_id in request.hash_ids:
+                if hash_id not in cache:
+                    break
+                cache.move_to_end(hash_id)
+                cached += 1
+            for hash_id in request.hash_ids[cached:]:
+                cache[hash_id] = True
+            while len(cache) > self.cache_blocks:
+                cache.popitem(last=False)
+        cached_tokens = min(cached * args.block_tokens, request.prompt_tokens)
+        self.cached_tokens += cached_tokens
+        self.prompt_tokens += request.prompt_tokens
+        service = (args.prefill_base + args.prefill_per_token * (request.prompt_tokens - cached_tokens)) / self.speed
+        self.busy_time += service
+        return service
+
+
+class DecodeBackend:
+    """
+    Continuous batching decoder. With b running sequences a step takes
+    (decode_base + decode_per_seq * b) / speed and gives every sequence one token.
+    Progress is tracked as the number of steps since start, each sequence finishes
+    when it reaches its own target step, so only batch changes are events.
+    """
+
+    def __init__(self, slots, speed):
+        self.slots = slots
+        self.speed = speed
+        self.steps = 0.0
+        self.last_update = 0.0
+        self.running = []
+        self.queue = deque()
+        self.version = 0
+        self.seq = 0
+        self.occupancy = 0.0
+
+    def step_time(self, args):
+        return (args.decode_base + args.decode_per_seq * len(self.running)) / self.speed
+
+    def advance(self, now, args):
+        if self.running:
+            elapsed = now - self.last_update
+            self.steps += elapsed / self.step_time(args)
+            self.occupancy += elapsed * len(self.running)
+        self.last_update = now
+
+
+class Simulator:
+    def __init__(self, args, policy_name, capacity_mode='equal', topology_mode='off'):
+        self.args = args
+        policy_kwargs = {}
+        if policy_name != LeastLoadPolicy.name:
+            policy_kwargs = {'load_factor': args.load_factor, 'max_entries': args.prefix_index_size}
+        prefill_speeds = expand(args.prefiller_speeds, args.prefillers)
+        decode_speeds = expand(args.decoder_speeds, args.decoders)
+        groups = {}
+        if args.topology_groups:
+            groups = {f'prefill-{i}': f'group-{i % args.topology_groups}' for i in range(args.prefillers)}
+            groups.update({f'decode-{i}': f'group-{i % args.topology_groups}' for i in range(args.decoders)})
+        self.state = proxy.ProxyState(
+            [(f'prefill-{i}', 8000) for i in range(args.prefillers)],
+            [(f'decode-{i}', 8000) for i in range(args.decoders)],
+            prefiller_policy=create_routing_policy(policy_name, **policy_kwargs),
+            decoder_policy=create_routing_policy(policy_name, **policy_kwargs),
+            outlier_detection=OutlierDetectionConfig(enabled=False),
+            prefiller_capacities=prefill_speeds if capacity_mode == 'speed' else None,
+            decoder_capacities=decode_speeds if capacity_mode == 'speed' else None,
+            topology=TopologyConfig(
+                enabled=topology_mode == 'on', load_factor=args.topology_load_factor, groups=groups, kubernetes=False
+            ),
+        )
+        self.prefillers = {
+            idx: PrefillBackend(args.prefill_slots, speed, args.prefill_cache_blocks)
+            for idx, speed in zip(self.state.prefillers, prefill_speeds)
+        }
+        self.decoders = {idx: DecodeBackend(args.decode_slots, speed)
+                         for idx, speed in zip(self.state.decoders, decode_speeds)}
+        self.events = []
+        self.event_seq = 0
+        self.completed = []
+
+    def schedule(self, when, kind, payload):
+        self.event_seq += 1
+        heapq.heappush(self.events, (when, kind, self.event_seq, payload))
+
+    def run(self, requests):
+        state = self.state
+        args = self.args
+        for request in requests:
+            self.schedule(request.arrival, ARRIVAL, request)
+        now = 0.0
+        while self.events:
+            now, kind, _, payload = heapq.heappop(self.events)
+            if kind == ARRIVAL:
+                payload.decoder_score = state.calculate_decode_scores(payload.prompt_tokens, payload.output_tokens)
+                payload.decoder = state.select_decoder(payload.decoder_score, payload.hash_ids)
+                self.schedule(now + args.callback_latency, CALLBACK, payload)
+            elif kind == CALLBACK:
+                payload.prefiller_score = state.calculate_prefill_scores(payload.prompt_tokens)
+                decoder_group = state.decoders[payload.decoder].group
+                payload.prefiller = state.select_prefiller(payload.prefiller_score, payload.hash_ids, decoder_group)
+                payload.locality = state.pairing_locality(payload.prefiller, decoder_group)
+                payload.prefill_queued = now
+                backend = self.prefillers[payload.prefiller]
+                if backend.running < backend.slots:
+                    self.start_prefill(backend, payload, now)
+                else:
+                    backend.queue.append(payload)
+            elif kind == PREFILL_DONE:
+                state.release_prefiller(payload.prefiller, payload.prefiller_score)
+                state.release_prefiller_kv(payload.prefiller, payload.prefiller_score)
+                backend = self.prefillers[payload.prefiller]
+                backend.running -= 1
+                if backend.queue:
+                    self.start_prefill(backend, backend.queue.popleft(), now)
+                transfer = args.kv_transfer_base + args.kv_transfer_per_token * payload.prompt_tokens
+                if payload.locality == REMOTE:
+                    transfer *= args.cross_group_factor
+                payload.transfer = transfer
+                self.schedule(now + transfer, KV_ARRIVED, payload)
+            elif kind == KV_ARRIVED:
+                backend = self.decoders[payload.decoder]
+                payload.decode_queued = now
+                if len(backend.running) < backend.slots:
+                    self.start_decode(backend, payload, now)
+                    self.reschedule(backend, now)
+                else:
+                    backend.queue.append(payload)
+            else:
+                backend, version = payload
+                if version == backend.version:
+                    self.finish_decodes(backend, now)
+        return now
+
+    def start_prefill(self, backend, request, now):
+        backend.running += 1
+        request.prefill_wait = now - request.prefill_queued
+        self.schedule(now + backend.service_time(request, self.args), PREFILL_DONE, request)
+
+    def start_decode(self, backend, request, now):
+        backend.advance(now, self.args)
+        request.decode_wait = now - request.decode_queued
+        backend.seq += 1
+        heapq.heappush(backend.running, (backend.steps + request.output_tokens, backend.seq, request))
+        # The first token comes after one step at the batch size it joins
+        request.first_token = now + backend.step_time(self.args)
+
+    def reschedule(self, backend, now):
+        backend.version += 1
+        if backend.running:
+            remaining = max(0.0, backend.running[0][0] - backend.steps)
+            self.schedule(now + remaining * backend.step_time(self.args), DECODE_STEP, (backend, backend.version))
+
+    def finish_decodes(self, backend, now):
+        args = self.args
+        state = self.state
+        backend.advance(now, args)
+        running = backend.running
+        # Float rounding may leave a sequence a hair short of its target
+        while running and running[0][0] <= backend.steps + 1e-9:
+            request = heapq.heappop(running)[2]
+            request.end = now
+            request.first_token = min(request.first_token, now)
+            state.release_decoder(request.decoder, request.decoder_score)
+            self.completed.append(request)
+        while backend.queue and len(running) < backend.slots:
+            self.start_decode(backend, backend.queue.popleft(), now)
+        self.reschedule(backend, now)
+
+
+def expand(speeds, count):
+    return [speeds[i % len(speeds)] for i in range(count)] if speeds else [1.0] * count
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(len(values) * q))] if values else float('nan')
+
+
+def report(policy_name, simulator, end_time, wall_time, args):
+    completed = simulator.completed
+    ttfts = sorted(r.first_token - r.arrival for r in completed)
+    tpots = sorted((r.end - r.first_token) / (r.output_tokens - 1) for r in completed if r.output_tokens > 1)
+    prefill_waits = sorted(r.prefill_wait for r in completed)
+    decode_waits = sorted(r.decode_wait for r in completed)
+    attained = sum(
+        1 for r in completed
+        if r.first_token - r.arrival <= args.slo_ttft
+        and (r.output_tokens == 1 or (r.end - r.first_token) / (r.output_tokens - 1) <= args.slo_tpot)
+    )
+    prefill_util = [b.busy_time / (b.slots * end_time) for b in simulator.prefillers.values()]
+    decode_util = [b.occupancy / (b.slots * end_time) for b in simulator.decoders.values()]
+    cached = sum(b.cached_tokens for b in simulator.prefillers.values())
+    prompt = sum(b.prompt_tokens for b in simulator.prefillers.values())
+    print(f"{policy_name:>20} {len(completed) / wall_time:>10.0f} {percentile(ttfts, 0.5) * 1000:>9.1f} "
+          f"{percentile(ttfts, 0.99) * 1000:>9.1f} {percentile(tpots, 0.5) * 1000:>9.1f} "
+          f"{percentile(tpots, 0.99) * 1000:>9.1f} {percentile(prefill_waits, 0.99) * 1000:>11.1f} "
+          f"{percentile(decode_waits, 0.99) * 1000:>11.1f} {cached / max(prompt, 1) * 100:>7.1f}% "
+          f"{min(prefill_util) * 100:>4.0f}-{max(prefill_util) * 100:<3.0f}% "
+          f"{min(decode_util) * 100:>4.0f}-{max(decode_util) * 100:<3.0f}% "
+          f"{attained / max(len(completed), 1) * 100:>6.1f}%")
+    if args.topology_groups:
+        local = sum(1 for r in completed if r.locality == LOCAL)
+        transfers = sorted(r.transfer for r in completed)
+        print(f"{'':>20} same-group pairs {local / max(len(completed), 1) * 100:.1f}%, "
+              f"kv transfer mean {sum(transfers) / max(len(transfers), 1) * 1000:.2f} ms "
+              f"p99 {percentile(transfers, 0.99) * 1000:.2f} ms, "
+              f"locality fallbacks {simulator.state.locality_fallbacks}")
+    if args.per_backend:
+        servers = {**simulator.state.prefillers, **simulator.state.decoders}
+        for idx, util in zip(list(simulator.prefillers) + list(simulator.decoders), prefill_util + decode_util):
+            print(f"{'':>20} {servers[idx].host}: utilisation {util * 100:.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a request trace through the proxy routing policies')
+    parser.add_argument('--policies', nargs='+', choices=list(ROUTING_POLICIES), default=list(ROUTING_POLICIES))
+    parser.add_argument('--trace', type=str, default=None, help='JSON lines trace, synthetic load when omitted')
+    parser.add_argument('--time-scale', type=float, default=1.0, help='Multiply trace arrival times, < 1 speeds up')
+    workload = parser.add_argument_group('synthetic workload')
+    workload.add_argument('--requests', type=int, default=200000)
+    workload.add_argument('--rate', type=float, default=80.0, help='Mean arrivals per simulated second')
+    workload.add_argument('--prompt-tokens', type=int, default=3072, help='Median prompt length')
+    workload.add_argument('--output-tokens', type=int, default=128, help='Median output length')
+    workload.add_argument('--length-sigma', type=float, default=0.5, help='Sigma of the lognormal lengths')
+    workload.add_argument('--prefix-groups', type=int, default=512, help='Shared prompt prefixes, 0 for none')
+    workload.add_argument('--prefix-tokens', type=int, default=2048, help='Length of the shared prefixes')
+    workload.add_argument('--zipf', type=float, default=1.0)
+    workload.add_argument('--seed', type=int, default=0)
+    cluster = parser.add_argument_group('simulated cluster')
+    cluster.add_argument('--prefillers', type=int, default=4)
+    cluster.add_argument('--decoders', type=int, default=8)
+    cluster.add_argument('--prefiller-speeds', type=float, nargs='*', default=[],
+                         help='Relative speed per prefiller, repeated over the prefillers')
+    cluster.add_argument('--decoder-speeds', type=float, nargs='*', default=[],
+                         help='Relative speed per decoder, repeated over the decoders')
+    cluster.add_argument('--prefill-slots', type=int, default=1, help='Prefills a prefiller runs at once')
+    cluster.add_argument('--prefill-base', type=float, default=0.01, help='Seconds per prefill')
+    cluster.add_argument('--prefill-per-token', type=float, default=0.00002, help='Seconds per uncached token')
+    cluster.add_argument('--prefill-cache-blocks', type=int, default=1024, help='Prefix cache size in blocks')
+    cluster.add_argument('--block-tokens', type=int, default=512, help='Tokens per prompt block (hash id)')
+    cluster.add_argument('--decode-slots', type=int, default=128, help='Maximum decode batch size')
+    cluster.add_argument('--decode-base', type=float, default=0.02, help='Seconds per decode step')
+    cluster.add_argument('--decode-per-seq', type=float, default=0.0002, help='Step seconds per batched sequence')
+    cluster.add_argument('--kv-transfer-base', type=float, default=0.002)
+    cluster.add_argument('--kv-transfer-per-token', type=float, default=0.000001)
+    cluster.add_argument('--topology-groups', type=int, default=0,
+                         help='Topology groups the backends are spread over round robin, 0 for none')
+    cluster.add_argument('--cross-group-factor', type=float, default=4.0,
+                         help='KV transfer slowdown between topology groups')
+    cluster.add_argument('--callback-latency', type=float, default=0.001,
+                         help='Seconds from decoder selection to the metaserver callback')
+    routing = parser.add_argument_group('routing')
+    routing.add_argument('--load-factor', type=float, default=1.25, help='Prefix affinity load factor')
+    routing.add_argument('--prefix-index-size', type=int, default=100000)
+    routing.add_argument('--topology-modes', nargs='+', choices=['off', 'on'], default=['off'],
+                         help='Run without and/or with topology-aware prefiller selection')
+    routing.add_argument('--topology-load-factor', type=float, default=1.5,
+                         help='Load factor up to which same-group prefillers are preferred')
+    routing.add_argument('--capacity-modes', nargs='+', choices=['equal', 'speed'], default=['equal'],
+                         help='Backend capacities given to the proxy: all equal, or the simulated speeds')
+    slo = parser.add_argument_group('service level objective')
+    slo.add_argument('--slo-ttft', type=float, default=1.0, help='TTFT objective in seconds')
+    slo.add_argument('--slo-tpot', type=float, default=0.05, help='TPOT objective in seconds')
+    parser.add_argument('--per-backend', action='store_true', help='Print the utilisation of every backend')
+    args = parser.parse_args()
+
+    print(f"{'policy':>20} {'req/s sim':>10} {'ttft p50':>9} {'ttft p99':>9} {'tpot p50':>9} {'tpot p99':>9} "
+          f"{'p-queue p99':>11} {'d-queue p99':>11} {'cached':>8} {'prefill util':>10} {'decode util':>10} "
+          f"{'SLO':>7}")
+    for policy_name in args.policies:
+        for capacity_mode in args.capacity_modes:
+            for topology_mode in args.topology_modes:
+                # Fresh trace per run, requests carry per-run state
+                requests = load_trace(args.trace, args.time_scale) if args.trace else synthetic_trace(args)
+                simulator = Simulator(args, policy_name, capacity_mode, topology_mode)
+                start = time.perf_counter()
+                end_time = simulator.run(requests)
+                wall_time = time.perf_counter() - start
+                label = policy_name
+                if capacity_mode == 'speed':
+                    label += '/cap'
+                if topology_mode == 'on':
+                    label += '/topo'
+                report(label, simulator, end_time, wall_time, args)
+    print('Latencies in ms. req/s sim is simulated requests per wall clock second, utilisation is min-max over '
+          'backends, SLO is the share of requests meeting both --slo-ttft and --slo-tpot.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Any, Callable, Dict, Optional
+
+# Order of the admission queue: arrival, earliest deadline first or shortest job first
+SCHEDULING_POLICIES = ("fifo", "edf", "sjf")
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted; the client should retry after retry_after seconds."""
+
+    def __init__(self, message: str, reason: str, retry_after: int):
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ("token_count", "try_admit", "future", "timer", "queued")
+
+    def __init__(self, token_count, try_admit, future):
+        self.token_count = token_count
+        self.try_admit = try_admit
+        self.future = future
+        self.timer = None
+        self.queued = True
+
+
+class AdmissionController:
+    """
+    Bounded admission queue in front of backend selection.
+
+    try_admit(token_count) returns the admitted backend index, or None while every
+    backend is at capacity. Requests that cannot be admitted right away wait in the
+    queue until wake() finds capacity for them, or until queue_timeout expires. A
+    full queue rejects immediately, so saturated proxies answer fast instead of
+    piling up latency.
+
+    Waiting requests are ordered by a key in time.monotonic() seconds that never
+    changes once queued:
+
+    - fifo: the arrival time.
+    - edf: the request's deadline, or arrival + queue_timeout without one. Requests
+      that waited longer are closer to their deadline, so nothing starves.
+    - sjf: the arrival time plus token_count * weight / sjf_aging. A job's size is
+      worth size / sjf_aging seconds of waiting, so a large job still overtakes
+      smaller ones arriving more than that much later.
+    """
+
+    def __init__(
+        self,
+        max_queue_size: int = 1024,
+        queue_timeout: float = 5.0,
+        retry_after: int = 1,
+        scheduling: str = "fifo",
+        sjf_aging: float = 1000.0,
+    ):
+        if max_queue_size < 0:
+            raise ValueError(f"max_queue_size must not be negative, got: {max_queue_size}")
+        if queue_timeout < 0:
+            raise ValueError(f"queue_timeout must not be negative, got: {queue_timeout}")
+        if scheduling not in SCHEDULING_POLICIES:
+            raise ValueError(f"Unknown scheduling policy '{scheduling}', expected one of {list(SCHEDULING_POLICIES)}")
+        if sjf_aging <= 0:
+            raise ValueError(f"sjf_aging must be positive, got: {sjf_aging}")
+        self.max_queue_size = max_queue_size
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.scheduling = scheduling
+        self.sjf_aging = sjf_aging
+        # (key, sequence, waiter); waiters that left are dropped lazily when they reach the top
+        self._heap = []
+        self._sequence = itertools.count()
+        self._queue_depth = 0
+        self.admitted = 0
+        self.queued = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue_depth
+
+    def _key(self, now: float, token_count: float, deadline: Optional[float], weight: float) -> float:
+        if self.scheduling == "edf":
+            return deadline if deadline is not None else now + self.queue_timeout
+        if self.scheduling == "sjf":
+            return now + token_count * weight / self.sjf_aging
+        return now
+
+    async def admit(self, try_admit: Callable[[float], Optional[int]], release: Callable[[int], None],
+                    token_count: float, deadline: Optional[float] = None, weight: float = 1.0) -> int:
+        """
+        Return the admitted backend index or raise AdmissionRejected.
+
+        deadline (time.monotonic() seconds) and weight only order the queue, see the
+        class docstring; a request past its deadline is still admitted.
+        """
+        if not self._queue_depth:
+            chosen = try_admit(token_count)
+            if chosen is not None:
+                self.admitted += 1
+                return chosen
+        if self._queue_depth >= self.max_queue_size or self.queue_timeout == 0:
+            self.rejected_queue_full += 1
+            raise AdmissionRejected(
+                "all backends are saturated and the admission queue is full", "queue_full", self.retry_after
+            )
+
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(token_count, try_admit, loop.create_future())
+        waiter.timer = loop.call_later(self.queue_timeout, self._expire, waiter)
+        key = self._key(time.monotonic(), token_count, deadline, weight)
+        if len(self._heap) > 2 * self._queue_depth + 64:
+            # Mostly waiters that timed out or went away behind a blocked head
+            self._heap = [entry for entry in self._heap if entry[2].queued]
+            heapq.heapify(self._heap)
+        heapq.heappush(self._heap, (key, next(self._sequence), waiter))
+        self._queue_depth += 1
+        self.queued += 1
+        if self.scheduling != "fifo":
+            # May go ahead of the blocked head of the queue
+            self.wake()
+        try:
+            return await waiter.future
+        except asyncio.CancelledError:
+            # The client went away; give back a slot that was handed out concurrently
+            if waiter.future.done() and not waiter.future.cancelled() and waiter.future.exception() is None:
+                release(waiter.future.result())
+            raise
+        finally:
+            waiter.timer.cancel()
+            if not waiter.future.done() or waiter.future.cancelled():
+                self._discard(waiter)
+
+    def wake(self):
+        """Admit queued requests in order while there is capacity; call after capacity is released."""
+        heap = self._heap
+        while heap:
+            waiter = heap[0][2]
+            if not waiter.queued or waiter.future.done():
+                # Cancelled with its client before admit() could take it out of the queue
+                heapq.heappop(heap)
+                self._discard(waiter)
+                continue
+            chosen = waiter.try_admit(waiter.token_count)
+            if chosen is None:
+                return
+            heapq.heappop(heap)
+            self._discard(waiter)
+            self.admitted += 1
+            waiter.future.set_result(chosen)
+
+    def _expire(self, waiter: _Waiter):
+        if waiter.future.done():
+            return
+        self._discard(waiter)
+        self.rejected_timeout += 1
+        waiter.future.set_exception(
+            AdmissionRejected(f"no backend capacity within {self.queue_timeout}s", "timeout", self.retry_after)
+        )
+
+    def _discard(self, waiter: _Waiter):
+        if waiter.queued:
+            waiter.queued = False
+            self._queue_depth -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "scheduling": self.scheduling,
+            "queue_depth": self._queue_depth,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+        }
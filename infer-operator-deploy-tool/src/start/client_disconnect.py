@@ -0,0 +1,85 @@
+import asyncio
+from typing import Any, Callable, Iterable, MutableMapping, Optional
+
+Scope = MutableMapping[str, Any]
+
+
+class DisconnectMiddleware:
+    """
+    ASGI middleware cancelling the handling of a request when its client disconnects.
+
+    The request body is read up front and replayed to the application, after which
+    the only message left for the request is http.disconnect. A watcher task waits
+    for it and cancels the server's task running the application, so a response
+    that is still streaming closes its upstream request as the cancellation unwinds.
+    The application sees ASGI spec 2.4 to stream responses in that task directly:
+    Starlette would otherwise run each streaming response in a task group next to a
+    disconnect listener of its own.
+
+    Only requests to paths are covered. on_disconnect(scope, response_started) is
+    called before the cancellation.
+    """
+
+    def __init__(self, app, paths: Iterable[str], on_disconnect: Optional[Callable[[Scope, bool], None]] = None):
+        self.app = app
+        self.paths = frozenset(paths)
+        self.on_disconnect = on_disconnect
+
+    async def __call__(self, scope: Scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        messages = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            messages.append(message)
+            if not message.get("more_body", False):
+                break
+        messages.reverse()
+
+        task = asyncio.current_task()
+        loop = asyncio.get_running_loop()
+        disconnected = loop.create_future()
+        response_started = False
+        response_complete = False
+
+        async def replay_receive():
+            if messages:
+                return messages.pop()
+            return await disconnected
+
+        async def tracking_send(message):
+            nonlocal response_started, response_complete
+            if message["type"] == "http.response.start":
+                response_started = True
+            elif not message.get("more_body", False):
+                response_complete = True
+            await send(message)
+
+        async def watch():
+            message = await receive()
+            while message["type"] != "http.disconnect":
+                message = await receive()
+            # Servers also report a disconnect once the response is complete
+            if response_complete:
+                return
+            disconnected.set_result(message)
+            if self.on_disconnect is not None:
+                self.on_disconnect(scope, response_started)
+            task.cancel()
+
+        scope["asgi"] = {**scope.get("asgi", {}), "spec_version": "2.4"}
+        watcher = loop.create_task(watch())
+        try:
+            await self.app(scope, replay_receive, tracking_send)
+        except asyncio.CancelledError:
+            if not disconnected.done():
+                raise
+            # Cancelled by the watcher, the request is over and the server has nobody to answer
+            if hasattr(task, "uncancel"):
+                task.uncancel()
+        finally:
+            watcher.cancel()
@@ -0,0 +1,266 @@
+import argparse
+import asyncio
+from collections import OrderedDict
+from dataclasses import dataclass, fields
+import hashlib
+import json
+import logging
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# refer to vLLM sampling_params: max_token default value
+DEFAULT_MAX_TOKENS = 16
+DEFAULT_MODEL_KEY = "default"
+
+
+@dataclass
+class CostCoefficients:
+    """
+    Linear cost coefficients of one model.
+
+    The prefill defaults are Omni_infer's calculate_input_scores, which used
+    request_length / 4 as its token estimate.
+    """
+
+    prefill_per_token: float = 0.0345
+    prefill_base: float = 120.0745
+    decode_per_prompt_token: float = 1.0
+    decode_per_output_token: float = 1.0
+    image_tokens: int = 576
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], base: Optional['CostCoefficients'] = None) -> 'CostCoefficients':
+        values = dict(base.__dict__) if base else {}
+        known = {f.name for f in fields(cls)}
+        for key, value in data.items():
+            if key not in known:
+                raise ValueError(f"Unknown cost coefficient '{key}', expected one of {sorted(known)}")
+            if not isinstance(value, (int, float)) or isinstance(value, bool):
+                raise TypeError(f"Cost coefficient '{key}' must be a number, got {type(value).__name__}")
+            values[key] = value
+        return cls(**values)
+
+
+class CostModel:
+    """
+    Estimate prefill and decode work of a request from its prompt token count.
+
+    The tokenizer is loaded by load_tokenizer, which the router calls at startup,
+    and count_prompt_tokens_async encodes texts in the default executor so that
+    tokenizing never stalls the event loop. Token counts are cached per text under
+    a digest of it, so repeated system prompts are tokenized once without the
+    cache holding the prompts themselves. Without a tokenizer (or when it fails to
+    load) tokens are estimated as bytes / 4, which is not cached. Prompts longer
+    than max_tokenize_chars are tokenized on their head and extrapolated.
+    """
+
+    def __init__(
+        self,
+        coefficients: Optional[Dict[str, CostCoefficients]] = None,
+        tokenizer_path: Optional[str] = None,
+        cache_size: int = 4096,
+        max_tokenize_chars: int = 32768,
+    ):
+        self.coefficients = coefficients or {}
+        self.default_coefficients = self.coefficients.get(DEFAULT_MODEL_KEY, CostCoefficients())
+        self.tokenizer_path = tokenizer_path
+        self.cache_size = cache_size
+        self.max_tokenize_chars = max_tokenize_chars
+        self._tokenizer = None
+        self._tokenizer_loaded = False
+        # Digest of a text to its token count, in LRU order
+        self._token_counts: OrderedDict = OrderedDict()
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict[str, Any]]) -> 'CostModel':
+        """
+        Build a cost model from the router's cost_model config:
+        {"tokenizer_path": str, "cache_size": int, "models": {model name or "default": coefficients}}
+        """
+        config = config or {}
+        default = CostCoefficients.from_dict(config.get("models", {}).get(DEFAULT_MODEL_KEY, {}))
+        coefficients = {DEFAULT_MODEL_KEY: default}
+        for model, model_config in config.get("models", {}).items():
+            if model != DEFAULT_MODEL_KEY:
+                coefficients[model] = CostCoefficients.from_dict(model_config, base=default)
+        return cls(
+            coefficients=coefficients,
+            tokenizer_path=config.get("tokenizer_path"),
+            cache_size=config.get("cache_size", 4096),
+            max_tokenize_chars=config.get("max_tokenize_chars", 32768),
+        )
+
+    def load_tokenizer(self):
+        """Load the tokenizer once, blocking; return None when there is none."""
+        if not self._tokenizer_loaded:
+            self._tokenizer_loaded = True
+            if self.tokenizer_path:
+                try:
+                    from transformers import AutoTokenizer
+
+                    self._tokenizer = AutoTokenizer.from_pretrained(self.tokenizer_path, trust_remote_code=True)
+                    logger.info(f"Loaded tokenizer from {self.tokenizer_path} for the cost model")
+                except Exception as e:
+                    logger.warning(f"Failed to load tokenizer from {self.tokenizer_path}, estimating tokens: {e}")
+        return self._tokenizer
+
+    def _encode_count(self, text: str) -> int:
+        tokenizer = self._tokenizer
+        if len(text) <= self.max_tokenize_chars:
+            return len(tokenizer.encode(text, add_special_tokens=False))
+        head_tokens = len(tokenizer.encode(text[: self.max_tokenize_chars], add_special_tokens=False))
+        return int(head_tokens * len(text) / self.max_tokenize_chars)
+
+    def _encode_counts(self, texts: List[str]) -> List[int]:
+        return [self._encode_count(text) for text in texts]
+
+    def _prompt_texts(self, req_data: Dict[str, Any]) -> Tuple[List[str], int]:
+        """Return the texts of a completion or chat completion prompt, and the tokens of its other parts."""
+        if "prompt" in req_data:
+            texts = []
+            return texts, self._collect_prompt(req_data["prompt"], texts)
+        coefficients = self.coefficients_for(req_data.get("model"))
+        texts = []
+        tokens = 0
+        for message in req_data.get("messages") or []:
+            content = message.get("content")
+            if isinstance(content, str):
+                texts.append(content)
+            elif isinstance(content, list):
+                for part in content:
+                    if part.get("type") == "text":
+                        texts.append(part.get("text", ""))
+                    else:
+                        tokens += coefficients.image_tokens
+        return texts, tokens
+
+    def _collect_prompt(self, prompt, texts: List[str]) -> int:
+        if isinstance(prompt, str):
+            texts.append(prompt)
+            return 0
+        if isinstance(prompt, list) and prompt:
+            if isinstance(prompt[0], int):
+                return len(prompt)
+            return sum(self._collect_prompt(item, texts) for item in prompt)
+        return 0
+
+    def _cached_counts(self, texts: List[str]) -> Tuple[int, List[Tuple[bytes, str]]]:
+        """Sum the cached token counts of texts, return it with the digest and text of each cache miss."""
+        tokens = 0
+        misses = []
+        for text in texts:
+            key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+            count = self._token_counts.get(key)
+            if count is None:
+                misses.append((key, text))
+            else:
+                self._token_counts.move_to_end(key)
+                tokens += count
+        return tokens, misses
+
+    def _store_counts(self, misses: List[Tuple[bytes, str]], counts: List[int]) -> int:
+        for (key, _), count in zip(misses, counts):
+            self._token_counts[key] = count
+        while len(self._token_counts) > self.cache_size:
+            self._token_counts.popitem(last=False)
+        return sum(counts)
+
+    def count_prompt_tokens(self, req_data: Dict[str, Any]) -> int:
+        """Count prompt tokens of a completion or chat completion request, tokenizing in the calling thread."""
+        texts, tokens = self._prompt_texts(req_data)
+        if self.load_tokenizer() is None:
+            return tokens + sum(len(text.encode("utf-8")) // 4 for text in texts)
+        cached, misses = self._cached_counts(texts)
+        return tokens + cached + self._store_counts(misses, self._encode_counts([text for _, text in misses]))
+
+    async def count_prompt_tokens_async(self, req_data: Dict[str, Any]) -> int:
+        """Count prompt tokens like count_prompt_tokens, tokenizing cache misses in the default executor."""
+        texts, tokens = self._prompt_texts(req_data)
+        loop = asyncio.get_running_loop()
+        if not self._tokenizer_loaded:
+            await loop.run_in_executor(None, self.load_tokenizer)
+        if self._tokenizer is None:
+            return tokens + sum(len(text.encode("utf-8")) // 4 for text in texts)
+        cached, misses = self._cached_counts(texts)
+        if not misses:
+            return tokens + cached
+        counts = await loop.run_in_executor(None, self._encode_counts, [text for _, text in misses])
+        return tokens + cached + self._store_counts(misses, counts)
+
+    def coefficients_for(self, model: Optional[str]) -> CostCoefficients:
+        return self.coefficients.get(model, self.default_coefficients)
+
+    def prefill_cost(self, prompt_tokens: int, model: Optional[str] = None) -> float:
+        coefficients = self.coefficients_for(model)
+        return prompt_tokens * coefficients.prefill_per_token + coefficients.prefill_base
+
+    def decode_cost(self, prompt_tokens: int, max_tokens: Optional[int], model: Optional[str] = None) -> float:
+        coefficients = self.coefficients_for(model)
+        if max_tokens is None:
+            max_tokens = DEFAULT_MAX_TOKENS
+        return prompt_tokens * coefficients.decode_per_prompt_token + max_tokens * coefficients.decode_per_output_token
+
+
+def _fit_linear(rows: Sequence[Sequence[float]], targets: Sequence[float]) -> List[float]:
+    """Least squares fit of targets ~ rows @ weights via the normal equations."""
+    size = len(rows[0])
+    matrix = [[sum(r[i] * r[j] for r in rows) for j in range(size)] for i in range(size)]
+    vector = [sum(r[i] * t for r, t in zip(rows, targets)) for i in range(size)]
+    # Gaussian elimination with partial pivoting
+    for col in range(size):
+        pivot = max(range(col, size), key=lambda r: abs(matrix[r][col]))
+        if abs(matrix[pivot][col]) < 1e-12:
+            raise ValueError("Recorded latencies are not enough to fit the cost model")
+        matrix[col], matrix[pivot] = matrix[pivot], matrix[col]
+        vector[col], vector[pivot] = vector[pivot], vector[col]
+        for row in range(col + 1, size):
+            factor = matrix[row][col] / matrix[col][col]
+            for k in range(col, size):
+                matrix[row][k] -= factor * matrix[col][k]
+            vector[row] -= factor * vector[col]
+    weights = [0.0] * size
+    for row in reversed(range(size)):
+        weights[row] = (vector[row] - sum(matrix[row][k] * weights[k] for k in range(row + 1, size))) / matrix[row][row]
+    return weights
+
+
+def calibrate(records: List[Dict[str, Any]]) -> Dict[str, float]:
+    """
+    Fit cost coefficients from recorded requests, each a dict with prompt_tokens,
+    output_tokens, prefill_latency and decode_latency. Costs are expressed in
+    milliseconds, decode latency is the whole decode phase of the request.
+    """
+    if len(records) < 3:
+        raise ValueError(f"At least 3 records are required to calibrate, got {len(records)}")
+    prefill_per_token, prefill_base = _fit_linear(
+        [(r["prompt_tokens"], 1.0) for r in records], [r["prefill_latency"] * 1000 for r in records]
+    )
+    decode_per_prompt_token, decode_per_output_token = _fit_linear(
+        [(r["prompt_tokens"], r["output_tokens"]) for r in records], [r["decode_latency"] * 1000 for r in records]
+    )
+    return {
+        "prefill_per_token": prefill_per_token,
+        "prefill_base": prefill_base,
+        "decode_per_prompt_token": decode_per_prompt_token,
+        "decode_per_output_token": decode_per_output_token,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Calibrate router cost model coefficients from recorded latencies')
+    parser.add_argument('--records', required=True, type=str,
+                        help='JSON lines file, one request per line with prompt_tokens, output_tokens, '
+                             'prefill_latency and decode_latency (seconds)')
+    parser.add_argument('--model', type=str, default=DEFAULT_MODEL_KEY,
+                        help='Model name the coefficients are written for')
+    args = parser.parse_args()
+
+    with open(args.records, 'r', encoding='utf-8') as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    coefficients = calibrate(records)
+    print(json.dumps({"cost_model": {"models": {args.model: coefficients}}}, indent=4))
+
+
+if __name__ == "__main__":
+    main()
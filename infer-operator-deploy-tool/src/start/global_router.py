@@ -0,0 +1,278 @@
+"""
+Global router in front of the PD routers of several InferServiceSet replicas.
+
+Each replica (infer_service_num) has its own router that only knows its own
+prefill and decode instances. This front tier forwards every request to the
+replica router with the lowest load per unit of capacity, as reported by the
+replica's /load endpoint and adjusted by the requests sent to it since. Replicas
+with queued requests are avoided while others are not saturated. With
+--spillover, a request a replica rejects with 429 is sent to the next best
+replica instead of failing, up to --max-spills times. Connection failures, and
+503s of a replica router that is draining or has no backend left, always move on
+to another replica.
+"""
+import argparse
+import asyncio
+from contextlib import asynccontextmanager
+import logging
+import time
+from typing import List, Optional
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+from proxy_metrics import CONTENT_TYPE_LATEST, MetricsRegistry
+
+logger = logging.getLogger(__name__)
+
+# Not forwarded between client and replica, the HTTP layers on each side set their own
+HOP_BY_HOP_HEADERS = frozenset(("host", "content-length", "transfer-encoding", "connection", "keep-alive"))
+
+
+class ReplicaState:
+    def __init__(self, url: str, capacity: float = 1.0):
+        self.url = url.rstrip("/")
+        self.client = httpx.AsyncClient(
+            timeout=None,
+            base_url=self.url,
+            limits=httpx.Limits(max_connections=100000, max_keepalive_connections=100000),
+        )
+        # Used until the replica reports the capacity of its decoders
+        self.capacity = capacity
+        self.reported_requests = 0
+        self.reported_capacity = 0.0
+        self.reported_queued = 0
+        self.last_report = 0.0
+        # Requests this router has in flight on the replica, and their number when it last reported
+        self.dispatched = 0
+        self.dispatched_at_report = 0
+        self.poll_failures = 0
+        self.healthy = True
+        self.requests = 0
+        self.spilled = 0
+
+    @property
+    def load(self) -> float:
+        # The last report already counts the requests in flight when it was taken
+        requests = max(0, self.reported_requests + self.dispatched - self.dispatched_at_report)
+        return requests / (self.reported_capacity or self.capacity)
+
+    @property
+    def saturated(self) -> bool:
+        return self.reported_queued > 0
+
+    def stats(self):
+        return {
+            "healthy": self.healthy,
+            "load": self.load,
+            "dispatched": self.dispatched,
+            "reported_requests": self.reported_requests,
+            "reported_queued": self.reported_queued,
+            "capacity": self.reported_capacity or self.capacity,
+            "requests": self.requests,
+            "spilled": self.spilled,
+        }
+
+
+class GlobalRouterState:
+    def __init__(self, replicas: List[ReplicaState], poll_interval: float = 0.2, poll_failures: int = 3):
+        self.replicas = replicas
+        self.poll_interval = poll_interval
+        self.poll_failures = poll_failures
+
+    def select(self, tried: List[ReplicaState]) -> Optional[ReplicaState]:
+        """Return the least loaded replica not tried yet, preferring healthy and unsaturated ones."""
+        candidates = [replica for replica in self.replicas if replica not in tried]
+        candidates = [replica for replica in candidates if replica.healthy] or candidates
+        candidates = [replica for replica in candidates if not replica.saturated] or candidates
+        if not candidates:
+            return None
+        return min(candidates, key=lambda replica: replica.load)
+
+    def mark_failed(self, replica: ReplicaState):
+        replica.poll_failures += 1
+        if replica.poll_failures >= self.poll_failures and replica.healthy:
+            logger.warning(f"Replica router {replica.url} is unreachable, routing around it")
+            replica.healthy = False
+
+    async def poll(self, replica: ReplicaState):
+        dispatched = replica.dispatched
+        try:
+            response = await replica.client.get("/load", timeout=max(self.poll_interval * 5, 1.0))
+            response.raise_for_status()
+            report = response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            logger.debug(f"Load poll of {replica.url} failed: {str(e)}")
+            self.mark_failed(replica)
+            return
+        if report.get("draining"):
+            # Restarting without a port handover, its requests in flight finish meanwhile
+            if replica.healthy:
+                logger.info(f"Replica router {replica.url} is draining, routing around it")
+            replica.healthy = False
+            return
+        replica.reported_requests = report.get("requests", 0)
+        replica.reported_capacity = report.get("capacity", 0.0)
+        replica.reported_queued = report.get("queued", 0)
+        replica.dispatched_at_report = dispatched
+        replica.last_report = time.monotonic()
+        replica.poll_failures = 0
+        if not replica.healthy:
+            logger.info(f"Replica router {replica.url} is reachable again")
+            replica.healthy = True
+
+    async def run_load_poll(self):
+        while True:
+            await asyncio.gather(*(self.poll(replica) for replica in self.replicas))
+            await asyncio.sleep(self.poll_interval)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Global router across the PD routers of several service replicas")
+    parser.add_argument("--host", type=str, default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--replicas", type=str, nargs="+", required=True, help="Base URLs of the replica routers")
+    parser.add_argument(
+        "--replica-capacities",
+        type=float,
+        nargs="+",
+        default=[1.0],
+        help="Capacity of each replica until it reports its own, or one value for all",
+    )
+    parser.add_argument("--poll-interval", type=float, default=0.2, help="Seconds between /load polls of replicas")
+    parser.add_argument(
+        "--poll-failures", type=int, default=3, help="Failed polls in a row after which a replica is routed around"
+    )
+    parser.add_argument(
+        "--spillover", action="store_true", help="Send requests a saturated replica rejects with 429 to another one"
+    )
+    parser.add_argument("--max-spills", type=int, default=1, help="Replicas a request may spill over to")
+    args = parser.parse_args()
+    if len(args.replica_capacities) == 1:
+        args.replica_capacities *= len(args.replicas)
+    elif len(args.replica_capacities) != len(args.replicas):
+        raise ValueError("Number of replica capacities must be 1 or match number of replicas")
+    if any(capacity <= 0 for capacity in args.replica_capacities):
+        raise ValueError(f"Replica capacities must be positive, got: {args.replica_capacities}")
+    return args
+
+
+global_args = None
+router_state = None
+metrics_registry = MetricsRegistry()
+requests_total = metrics_registry.counter(
+    "global_router_requests_total", "Requests forwarded, by replica router", ("replica",)
+)
+spills_total = metrics_registry.counter(
+    "global_router_spills_total", "Requests moved to another replica, by reason", ("reason",)
+)
+metrics_registry.gauge_callback(
+    "global_router_replica_load", "Requests per unit of capacity on a replica", ("replica",),
+    lambda: (((replica.url,), replica.load) for replica in router_state.replicas),
+)
+metrics_registry.gauge_callback(
+    "global_router_replica_healthy", "Whether a replica router answers its load polls", ("replica",),
+    lambda: (((replica.url,), int(replica.healthy)) for replica in router_state.replicas),
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global router_state
+    replicas = [
+        ReplicaState(url, capacity) for url, capacity in zip(global_args.replicas, global_args.replica_capacities)
+    ]
+    router_state = GlobalRouterState(replicas, global_args.poll_interval, global_args.poll_failures)
+    poll_task = asyncio.create_task(router_state.run_load_poll())
+    yield
+    poll_task.cancel()
+    for replica in replicas:
+        await replica.client.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+async def relay(response: httpx.Response, replica: ReplicaState):
+    try:
+        async for chunk in response.aiter_raw():
+            yield chunk
+    finally:
+        await response.aclose()
+        replica.dispatched -= 1
+
+
+async def forward(api: str, request: Request):
+    body = await request.body()
+    headers = {key: value for key, value in request.headers.items() if key not in HOP_BY_HOP_HEADERS}
+    tried = []
+    while True:
+        replica = router_state.select(tried)
+        if replica is None:
+            return JSONResponse(
+                {"error": {"message": "no replica router could take the request", "type": "unavailable", "code": 503}},
+                status_code=503,
+            )
+        tried.append(replica)
+        replica.dispatched += 1
+        try:
+            response = await replica.client.send(
+                replica.client.build_request("POST", api, content=body, headers=headers), stream=True
+            )
+        except httpx.RequestError as e:
+            replica.dispatched -= 1
+            logger.warning(f"Forwarding to replica router {replica.url} failed: {str(e)}")
+            router_state.mark_failed(replica)
+            spills_total.labels("error").inc()
+            continue
+        if response.status_code == 503 and router_state.select(tried) is not None:
+            await response.aclose()
+            replica.dispatched -= 1
+            spills_total.labels("unavailable").inc()
+            continue
+        if response.status_code == 429 and global_args.spillover and len(tried) <= global_args.max_spills:
+            if router_state.select(tried) is not None:
+                await response.aclose()
+                replica.dispatched -= 1
+                replica.spilled += 1
+                spills_total.labels("saturated").inc()
+                continue
+        replica.requests += 1
+        requests_total.labels(replica.url).inc()
+        response_headers = {
+            key: value for key, value in response.headers.items() if key not in HOP_BY_HOP_HEADERS
+        }
+        return StreamingResponse(relay(response, replica), status_code=response.status_code, headers=response_headers)
+
+
+@app.post("/v1/completions")
+async def handle_completions(request: Request):
+    return await forward("/v1/completions", request)
+
+
+@app.post("/v1/chat/completions")
+async def handle_chat_completions(request: Request):
+    return await forward("/v1/chat/completions", request)
+
+
+@app.get("/healthcheck")
+async def healthcheck():
+    return {
+        "status": "ok",
+        "spillover": global_args.spillover,
+        "replicas": {replica.url: replica.stats() for replica in router_state.replicas},
+    }
+
+
+@app.get("/metrics")
+async def metrics():
+    return Response(content=metrics_registry.render(), media_type=CONTENT_TYPE_LATEST)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    global_args = parse_args()
+    uvicorn.run(app, host=global_args.host, port=global_args.port)
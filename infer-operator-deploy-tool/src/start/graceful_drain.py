@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import signal
+import socket
+import time
+from typing import Any, Iterable, MutableMapping, Optional, Sequence, Set, Tuple
+
+import uvicorn
+
+# Drain progress is logged next to uvicorn's own shutdown messages
+logger = logging.getLogger("uvicorn.error")
+
+Scope = MutableMapping[str, Any]
+
+# Seconds between two log lines reporting the requests a draining server still has
+REPORT_INTERVAL = 5.0
+
+
+class RequestDrain:
+    """Client requests in flight, and whether new ones are refused because the server drains."""
+
+    def __init__(self, retry_after: int = 1):
+        self.retry_after = retry_after
+        self.draining = False
+        self.in_flight = 0
+        self.refused = 0
+        self.deadline: Optional[float] = None
+        # Client addresses of the connections open when the drain started
+        self.open_connections: Set[Tuple[str, int]] = set()
+
+    def start(self, timeout: float, open_connections: Iterable[Tuple[str, int]] = ()) -> bool:
+        """Start draining, return False if the server already drains."""
+        if self.draining:
+            return False
+        self.draining = True
+        self.deadline = time.monotonic() + timeout
+        self.open_connections = set(open_connections)
+        return True
+
+    def stats(self):
+        return {
+            "draining": self.draining,
+            "in_flight": self.in_flight,
+            "refused": self.refused,
+            "remaining_seconds": max(self.deadline - time.monotonic(), 0.0) if self.draining else None,
+        }
+
+
+class DrainMiddleware:
+    """
+    ASGI middleware counting the requests to paths in flight, and refusing new ones once draining.
+
+    A connection that was open when the drain started, possibly idle, has one more
+    request served, so that a client reusing it does not race the server closing
+    it; the response carries Connection: close. Requests on connections opened later
+    get a 503 with Retry-After and Connection: close, so that the client retries on
+    a new connection, which reaches the process that took over the port or another
+    router.
+    """
+
+    def __init__(self, app, drain: RequestDrain, paths: Iterable[str]):
+        self.app = app
+        self.drain = drain
+        self.paths = frozenset(paths)
+
+    async def __call__(self, scope: Scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        if self.drain.draining and scope.get("client") in self.drain.open_connections:
+            self.drain.open_connections.discard(scope["client"])
+            send = self._closing(send)
+        elif self.drain.draining:
+            self.drain.refused += 1
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": 503,
+                    "headers": [
+                        (b"content-type", b"application/json"),
+                        (b"retry-after", str(self.drain.retry_after).encode()),
+                        (b"connection", b"close"),
+                    ],
+                }
+            )
+            await send(
+                {
+                    "type": "http.response.body",
+                    "body": b'{"error": {"message": "router is draining", "type": "unavailable", "code": 503}}',
+                }
+            )
+            return
+        self.drain.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.drain.in_flight -= 1
+
+    @staticmethod
+    def _closing(send):
+        async def closing_send(message):
+            if message["type"] == "http.response.start":
+                headers = [(k, v) for k, v in message.get("headers", []) if k.lower() != b"connection"]
+                message = {**message, "headers": headers + [(b"connection", b"close")]}
+            await send(message)
+
+        return closing_send
+
+
+class DrainingServer(uvicorn.Server):
+    """
+    uvicorn server draining its requests on SIGTERM before it exits.
+
+    Draining closes the listeners of public_sockets, so that a new router bound to
+    the same port with SO_REUSEPORT gets every new connection, and lets
+    DrainMiddleware close the connections already open after their next request.
+    The other listeners stay open, they take the metaserver callbacks of requests in
+    flight. The server exits once no request is in flight, or cancels the requests
+    left after timeout seconds. Another SIGTERM, or SIGINT, ends the drain at once.
+    """
+
+    def __init__(
+        self,
+        config: uvicorn.Config,
+        drain: RequestDrain,
+        timeout: float,
+        public_sockets: Sequence[socket.socket] = (),
+    ):
+        super().__init__(config)
+        self.drain = drain
+        self.timeout = timeout
+        self.public_fds = {sock.fileno() for sock in public_sockets}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._drain_task: Optional[asyncio.Task] = None
+
+    async def startup(self, sockets: Optional[list] = None) -> None:
+        self._loop = asyncio.get_running_loop()
+        await super().startup(sockets=sockets)
+
+    def handle_exit(self, sig: int, frame) -> None:
+        if sig == signal.SIGTERM and self._loop is not None and not self.drain.draining and not self.should_exit:
+            # Runs in the signal handler, the drain starts from the event loop
+            self._loop.call_soon_threadsafe(self._start_drain)
+            return
+        super().handle_exit(sig, frame)
+
+    def _start_drain(self):
+        if self._drain_task is None:
+            self._drain_task = self._loop.create_task(self.run_drain())
+
+    async def run_drain(self):
+        if not self.drain.start(self.timeout, [connection.client for connection in self.server_state.connections]):
+            return
+        for server in self.servers:
+            if any(sock.fileno() in self.public_fds for sock in server.sockets):
+                server.close()
+        logger.info(f"Draining {self.drain.in_flight} requests in flight, for at most {self.timeout}s")
+        reported = time.monotonic()
+        while self.drain.in_flight and time.monotonic() < self.drain.deadline and not self.should_exit:
+            await asyncio.sleep(0.1)
+            if time.monotonic() - reported >= REPORT_INTERVAL:
+                reported = time.monotonic()
+                remaining = self.drain.deadline - reported
+                logger.info(f"Draining {self.drain.in_flight} requests in flight, {remaining:.0f}s left")
+        if self.drain.in_flight:
+            logger.warning(f"Cancelling {self.drain.in_flight} requests still in flight at the end of the drain")
+            for task in self.server_state.tasks:
+                task.cancel()
+        else:
+            logger.info("Drained every request in flight")
+        self.should_exit = True
@@ -0,0 +1,119 @@
+from typing import Dict, List, Optional, Tuple
+
+
+class IndexedHeap:
+    """
+    Binary min-heap keyed by server index that supports in-place priority updates.
+
+    Entries are ordered by (priority, server_idx), the same ordering the proxy used
+    with heapq tuples, so ties are still broken by the lower server index. A position
+    map makes increase/decrease-key and removal O(log n) without rebuilding the heap.
+    """
+
+    def __init__(self, priorities: Optional[Dict[int, float]] = None):
+        self._heap: List[Tuple[float, int]] = []
+        self._pos: Dict[int, int] = {}
+        self._total = 0
+        if priorities:
+            for server_idx, priority in priorities.items():
+                self._pos[server_idx] = len(self._heap)
+                self._heap.append((priority, server_idx))
+                self._total += priority
+            for i in reversed(range(len(self._heap) // 2)):
+                self._sift_down(i)
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def __bool__(self) -> bool:
+        return bool(self._heap)
+
+    def __contains__(self, server_idx: int) -> bool:
+        return server_idx in self._pos
+
+    def __iter__(self):
+        return iter(self._heap)
+
+    def peek(self) -> Tuple[float, int]:
+        """Return (priority, server_idx) of the least loaded entry without removing it."""
+        if not self._heap:
+            raise IndexError("peek from an empty heap")
+        return self._heap[0]
+
+    @property
+    def total(self) -> float:
+        """Sum of all priorities, kept up to date on every change."""
+        return self._total
+
+    def priority(self, server_idx: int) -> float:
+        return self._heap[self._pos[server_idx]][0]
+
+    def push(self, server_idx: int, priority: float):
+        """Insert a new entry, or update it if the server is already in the heap."""
+        if server_idx in self._pos:
+            self.update(server_idx, priority)
+            return
+        self._pos[server_idx] = len(self._heap)
+        self._heap.append((priority, server_idx))
+        self._total += priority
+        self._sift_up(len(self._heap) - 1)
+
+    def update(self, server_idx: int, priority: float):
+        """Change the priority of an existing entry in place."""
+        pos = self._pos[server_idx]
+        old_priority = self._heap[pos][0]
+        self._heap[pos] = (priority, server_idx)
+        self._total += priority - old_priority
+        if priority < old_priority:
+            self._sift_up(pos)
+        elif priority > old_priority:
+            self._sift_down(pos)
+
+    def remove(self, server_idx: int):
+        """Remove an entry; a no-op if the server is not in the heap."""
+        pos = self._pos.pop(server_idx, None)
+        if pos is None:
+            return
+        self._total -= self._heap[pos][0]
+        last = self._heap.pop()
+        if pos == len(self._heap):
+            return
+        self._heap[pos] = last
+        self._pos[last[1]] = pos
+        self._sift_down(pos)
+        self._sift_up(self._pos[last[1]])
+
+    def _sift_up(self, pos: int):
+        heap = self._heap
+        item = heap[pos]
+        while pos > 0:
+            parent = (pos - 1) >> 1
+            parent_item = heap[parent]
+            if item < parent_item:
+                heap[pos] = parent_item
+                self._pos[parent_item[1]] = pos
+                pos = parent
+                continue
+            break
+        heap[pos] = item
+        self._pos[item[1]] = pos
+
+    def _sift_down(self, pos: int):
+        heap = self._heap
+        size = len(heap)
+        item = heap[pos]
+        child = 2 * pos + 1
+        while child < size:
+            right = child + 1
+            if right < size and heap[right] < heap[child]:
+                child = right
+            child_item = heap[child]
+            if child_item < item:
+                heap[pos] = child_item
+                self._pos[child_item[1]] = pos
+                pos = child
+                child = 2 * pos + 1
+                continue
+            break
+        heap[pos] = item
+        self._pos[item[1]] = pos
@@ -0,0 +1,88 @@
+from collections import OrderedDict
+import time
+from typing import Any, Dict, Optional
+
+
+class InflightRegistry:
+    """
+    Bounded store for requests that are waiting on a metaserver callback.
+
+    Entries are kept in insertion order together with their registration time, so
+    TTL and capacity eviction only ever look at the oldest entries. Callers are
+    expected to pop an entry once its stream ends or its callback completes; the
+    TTL and the capacity bound are a backstop for entries that are never popped.
+    """
+
+    def __init__(self, ttl: float = 300.0, max_entries: int = 100000):
+        if ttl <= 0:
+            raise ValueError(f"ttl must be positive, got: {ttl}")
+        if max_entries <= 0:
+            raise ValueError(f"max_entries must be positive, got: {max_entries}")
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+        self.registered = 0
+        self.completed = 0
+        self.evicted_expired = 0
+        self.evicted_overflow = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, request_id: str) -> bool:
+        return request_id in self._entries
+
+    def add(self, request_id: str, entry: Any):
+        """Register (or re-register) a request; re-registering refreshes its TTL."""
+        now = time.monotonic()
+        self.evict_expired(now)
+        if request_id in self._entries:
+            self._entries.move_to_end(request_id)
+        else:
+            self.registered += 1
+        self._entries[request_id] = (now, entry)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evicted_overflow += 1
+
+    def get(self, request_id: str) -> Optional[Any]:
+        item = self._entries.get(request_id)
+        if item is None:
+            return None
+        registered_at, entry = item
+        if time.monotonic() - registered_at > self.ttl:
+            del self._entries[request_id]
+            self.evicted_expired += 1
+            return None
+        return entry
+
+    def pop(self, request_id: str) -> Optional[Any]:
+        """Remove a request and return its entry, or None if it is already gone."""
+        item = self._entries.pop(request_id, None)
+        if item is None:
+            return None
+        self.completed += 1
+        return item[1]
+
+    def evict_expired(self, now: Optional[float] = None) -> int:
+        if now is None:
+            now = time.monotonic()
+        deadline = now - self.ttl
+        evicted = 0
+        while self._entries:
+            registered_at, _ = next(iter(self._entries.values()))
+            if registered_at > deadline:
+                break
+            self._entries.popitem(last=False)
+            evicted += 1
+        self.evicted_expired += evicted
+        return evicted
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "registered": self.registered,
+            "completed": self.completed,
+            "evicted_expired": self.evicted_expired,
+            "evicted_overflow": self.evicted_overflow,
+        }
@@ -89,21 +89,52 @@
 
 import argparse
 import asyncio
-import copy
+import errno
 import functools
-import heapq
 import ipaddress
 import json
+import multiprocessing
+import multiprocessing.connection
 import os
+import signal
+import socket
 import sys
+import time
 import uuid
 from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
 
 import httpx
 from fastapi import FastAPI, Request
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from vllm.logger import init_logger
 
+from admission_control import SCHEDULING_POLICIES, AdmissionController, AdmissionRejected
+from client_disconnect import DisconnectMiddleware
+from cost_model import CostModel
+from graceful_drain import DrainingServer, DrainMiddleware, RequestDrain
+from indexed_heap import IndexedHeap
+from inflight_registry import InflightRegistry
+from outlier_detection import STATE_CODES, BackendHealth, OutlierDetectionConfig, OutlierDetector
+from prefill_coalescing import PrefillCoalescer
+from priority_classes import PriorityClass, PriorityClassifier
+from proxy_metrics import CONTENT_TYPE_LATEST, ProxyMetrics
+from response_cache import ResponseCache, ResponseCacheConfig
+from retry_budget import LatencyWindow, RetryBudget, RetryConfig
+from routing_policy import (
+    ROUTING_POLICIES,
+    LeastLoadPolicy,
+    create_routing_policy,
+    least_loaded,
+    prefix_block_hashes,
+    request_prefix_text,
+    within_bounded_load,
+)
+from shared_load_table import SharedLoadTable
+from sse_framer import aiter_sse_events
+from topology import LOCAL, REMOTE, UNKNOWN, KubernetesGroupResolver, TopologyConfig
+
 logger = init_logger(__name__)
 
 # Add uvloop for faster event loop if available
@@ -114,11 +145,17 @@ try:
 except ImportError:
     pass
 
+# Weight of a prefiller's KV cache in its load, next to the tokens it is prefilling
+KV_CACHE_WEIGHT = 0.3
+
 
 class ServerState:
-    def __init__(self, host, port):
+    def __init__(self, host, port, source="static", capacity=1.0):
         self.host = host
         self.port = port
+        # Relative throughput of the backend, heap priorities are load divided by capacity
+        self.capacity = capacity
+        self.group = None  # Topology group, see TopologyConfig
         self.url = f"http://{host}:{port}/v1"
         try:
             ip = ipaddress.ip_address(self.host)
@@ -135,43 +172,241 @@ class ServerState:
         self.active_kv_cache = 0  # Only for prefiller
         self.active_requests = 0  # Number of active requests
         self.aborted_requests = set()  # Track aborted requests
+        self.health = BackendHealth()  # Circuit breaker state, see outlier_detection
+        self.source = source  # "static" backends follow DNS, "admin" ones only change through the admin API
+        self.draining = False  # Draining backends take no new requests and leave once idle
+        self.drain_started = 0.0
+        # Load other proxy workers put on this backend, see SharedLoadTable
+        self.load_slot = None
+        self.remote_tokens = 0
+        self.remote_kv_cache = 0
+        self.remote_requests = 0
         # Removed individual server lock - will use global locks instead
 
+    @property
+    def circuit_state(self) -> int:
+        return STATE_CODES[self.health.state]
+
+
+@dataclass
+class InflightRequest:
+    req_data: dict
+    req_body: bytes
+    api: str
+    prompt_tokens: int
+    prefix_hashes: Optional[List[int]] = None
+    priority_class: Optional[PriorityClass] = None
+    # time.monotonic() deadline of the first token, orders the prefill admission queue
+    deadline: Optional[float] = None
+    # Topology group of the request's decoder, the prefiller is preferably picked in it
+    decoder_group: Optional[str] = None
+    # Set with --eager-prefill, the metaserver callback resolves it with the decoder's kv_transfer_params
+    kv_transfer_future: Optional[asyncio.Future] = None
+
 
 class ProxyState:
-    def __init__(self, prefiller_instances, decoder_instances):
-        self.prefillers: list[ServerState] = [ServerState(h, p) for h, p in prefiller_instances]
-        self.decoders: list[ServerState] = [ServerState(h, p) for h, p in decoder_instances]
-        self.req_to_prefiller = {}
+    def __init__(
+        self,
+        prefiller_instances,
+        decoder_instances,
+        inflight_ttl=300.0,
+        max_inflight_requests=100000,
+        prefiller_policy=None,
+        decoder_policy=None,
+        prefix_block_size=0,
+        prefix_max_blocks=64,
+        cost_model=None,
+        max_requests_per_backend=0,
+        max_tokens_per_backend=0,
+        decoder_admission=None,
+        max_requests_per_prefiller=0,
+        max_tokens_per_prefiller=0,
+        prefiller_admission=None,
+        priority_classifier=None,
+        outlier_detection=None,
+        load_table=None,
+        worker_id=0,
+        prefiller_capacities=None,
+        decoder_capacities=None,
+        topology=None,
+        abort_api="",
+        retry_budget=None,
+        response_cache=None,
+        prefill_coalescer=None,
+    ):
+        # With several proxy workers, backend load counters are shared through this table
+        self.load_table: Optional[SharedLoadTable] = load_table
+        self.worker_id = worker_id
+        # Backends are keyed by a server index that is never reused, so indices held by
+        # in-flight requests stay valid while backends join and leave
+        self._next_server_idx = 0
+        self.prefillers: Dict[int, ServerState] = {}
+        self.decoders: Dict[int, ServerState] = {}
+        self.topology = topology or TopologyConfig()
+        # Prefillers of each topology group, with the same priorities as in prefiller_heap
+        self.prefiller_group_heaps: Dict[str, IndexedHeap] = {}
+        # Prefill/decode pairs made by select_prefiller, and local pairs given up for load balance
+        self.pairings = {LOCAL: 0, REMOTE: 0, UNKNOWN: 0}
+        self.locality_fallbacks = 0
+        # Capacity of each static backend, backends added at runtime get the role's first one
+        prefiller_capacities = prefiller_capacities or [1.0] * len(prefiller_instances)
+        decoder_capacities = decoder_capacities or [1.0] * len(decoder_instances)
+        self.default_capacity = {
+            "prefill": prefiller_capacities[0] if prefiller_capacities else 1.0,
+            "decode": decoder_capacities[0] if decoder_capacities else 1.0,
+        }
+        for (h, p), capacity in zip(prefiller_instances, prefiller_capacities):
+            self.prefillers[self._allocate_server_idx()] = self._new_server("prefill", h, p, capacity=capacity)
+        for (h, p), capacity in zip(decoder_instances, decoder_capacities):
+            self.decoders[self._allocate_server_idx()] = self._new_server("decode", h, p, capacity=capacity)
+        # Prefills being sent or waiting for a prefiller, by request id, and the prefiller
+        # of those that have one, so that a request whose client went away can cancel them
+        self.prefill_tasks: Dict[str, asyncio.Task] = {}
+        self.req_to_prefiller: Dict[str, int] = {}
+        # Prefiller endpoint taking batches of aborted request ids, empty to only close their connections
+        self.abort_api = abort_api
+        self._abort_flushes = set()
+        # Shared by the retries of all backends, and by prefill hedges timed from recent prefill latencies
+        self.retry_budget = retry_budget or RetryBudget()
+        retry_config = self.retry_budget.config
+        self.prefill_latencies = LatencyWindow(
+            retry_config.hedge_window, retry_config.hedge_quantile, retry_config.hedge_min_samples
+        )
+        # Complete responses to temperature 0 requests, off unless configured
+        self.response_cache = response_cache or ResponseCache()
+        # Single-flight prefills of identical prompts requested at the same time
+        self.prefill_coalescer = prefill_coalescer or PrefillCoalescer()
         self.req_id_lock = asyncio.Lock()
         # Removed selection locks - no longer needed for synchronous methods
 
         # Initialize priority queues for efficient server selection
-        # Each entry is (priority_score, server_index, server_reference)
+        # Each entry is (priority_score, server_index), indexed by server_index
+        # so priorities are updated in place in O(log n).
         # Lower priority score = higher priority (less loaded)
-        self.prefiller_heap = [(0, i, server) for i, server in enumerate(self.prefillers)]
-        self.decoder_heap = [(0, i, server) for i, server in enumerate(self.decoders)]
-        heapq.heapify(self.prefiller_heap)
-        heapq.heapify(self.decoder_heap)
-        self.req_id_future = {}
-        self.req_data_dict = {}
+        self.prefiller_heap = IndexedHeap({i: 0 for i in self.prefillers})
+        self.decoder_heap = IndexedHeap({i: 0 for i in self.decoders})
+        for idx, server in self.prefillers.items():
+            if server.group is not None:
+                self._group_heap(server.group).push(idx, 0)
+        # Requests waiting for the decoder's metaserver callback, keyed by api request id
+        self.inflight_requests = InflightRegistry(ttl=inflight_ttl, max_entries=max_inflight_requests)
+        # Routing policies pick a backend out of the heaps, prefix hashing is off when block size is 0
+        self.prefiller_policy = prefiller_policy or LeastLoadPolicy()
+        self.decoder_policy = decoder_policy or LeastLoadPolicy()
+        self.prefix_block_size = prefix_block_size
+        self.prefix_max_blocks = prefix_max_blocks
+        self.cost_model = cost_model or CostModel()
+        # Per-decoder concurrency caps, 0 means unlimited; requests beyond them wait in the admission queue
+        self.max_requests_per_backend = max_requests_per_backend
+        self.max_tokens_per_backend = max_tokens_per_backend
+        self.decoder_admission = decoder_admission or AdmissionController()
+        # Prefill caps are checked when the decoder's callback asks for a prefiller
+        self.max_requests_per_prefiller = max_requests_per_prefiller
+        self.max_tokens_per_prefiller = max_tokens_per_prefiller
+        self.prefiller_admission = prefiller_admission or AdmissionController()
+        self.priority_classifier = priority_classifier or PriorityClassifier()
+        # Ejected backends are kept out of the heaps, so selection never checks their health
+        self.outlier_detection = outlier_detection or OutlierDetectionConfig()
+        self.prefiller_outliers = OutlierDetector(self.outlier_detection)
+        self.decoder_outliers = OutlierDetector(self.outlier_detection)
+        self._closing_clients = set()
+        # (role, hostname, port) -> (last resolved addresses, consecutive resolution failures)
+        self._dns_addresses = {}
+        # Request bodies received from clients vs. bytes the proxy built to forward them
+        self.request_count = 0
+        self.request_bytes_received = 0
+        self.request_bytes_copied = 0
+
+    def _allocate_server_idx(self) -> int:
+        server_idx = self._next_server_idx
+        self._next_server_idx += 1
+        return server_idx
+
+    def _new_server(self, role: str, host, port, source="static", capacity=None) -> ServerState:
+        server = ServerState(host, port, source, capacity or self.default_capacity[role])
+        server.group = self.topology.static_group(host, port)
+        if self.load_table is not None:
+            server.load_slot = self.load_table.slot(f"{role}|{server.url}")
+        return server
 
     def _update_prefiller_priority(self, server_idx: int):
         """Update the priority of a prefiller server in the heap."""
         server = self.prefillers[server_idx]
-        # Priority based on active_tokens and active_kv_cache
-        priority = server.active_tokens + server.active_kv_cache * 0.3
-        # Remove old entry and add new one
-        self.prefiller_heap = [(p, i, s) for p, i, s in self.prefiller_heap if i != server_idx]
-        heapq.heappush(self.prefiller_heap, (priority, server_idx, server))  # type: ignore
+        if self.load_table is not None:
+            self.load_table.publish(
+                server.load_slot, self.worker_id, server.active_tokens, server.active_kv_cache, server.active_requests
+            )
+        # Priority based on active_tokens and active_kv_cache, per unit of capacity
+        priority = (
+            server.active_tokens
+            + server.remote_tokens
+            + (server.active_kv_cache + server.remote_kv_cache) * KV_CACHE_WEIGHT
+        ) / server.capacity
+        if not server.draining and server.health.routable(server.active_requests):
+            self.prefiller_heap.push(server_idx, priority)
+            if server.group is not None:
+                self._group_heap(server.group).push(server_idx, priority)
+        else:
+            self.prefiller_heap.remove(server_idx)
+            if server.group is not None:
+                self._group_heap(server.group).remove(server_idx)
+
+    def prefiller_added_load(self, idx, token_count) -> float:
+        """Priority a prefiller gains from a prefill, which counts as active tokens and KV cache."""
+        return token_count * (1 + KV_CACHE_WEIGHT) / self.prefillers[idx].capacity
+
+    def decoder_added_load(self, idx, token_count) -> float:
+        return token_count / self.decoders[idx].capacity
+
+    def _group_heap(self, group: str) -> IndexedHeap:
+        heap = self.prefiller_group_heaps.get(group)
+        if heap is None:
+            heap = self.prefiller_group_heaps[group] = IndexedHeap()
+        return heap
+
+    def set_backend_group(self, role: str, idx: int, group: Optional[str]):
+        """Move a backend into a topology group, None for unknown."""
+        server = self.backends(role).get(idx)
+        if server is None or server.group == group:
+            return
+        if role == "prefill" and server.group is not None:
+            self._group_heap(server.group).remove(idx)
+        server.group = group
+        if role == "prefill":
+            self._update_prefiller_priority(idx)
+
+    def _prefiller_candidates(self, token_count, group: Optional[str], eligible=None) -> IndexedHeap:
+        """Return the prefillers of the decoder's group while an eligible one is not overloaded, otherwise all."""
+        local = self.prefiller_group_heaps.get(group) if group is not None else None
+        if not local:
+            return self.prefiller_heap
+        idx = least_loaded(local, eligible)
+        heap = self.prefiller_heap
+        if idx is not None and within_bounded_load(
+            heap, idx, self.prefiller_added_load(idx, token_count), self.topology.load_factor
+        ):
+            return local
+        self.locality_fallbacks += 1
+        return heap
+
+    def pairing_locality(self, prefiller_idx: int, decoder_group: Optional[str]) -> str:
+        prefiller = self.prefillers.get(prefiller_idx)
+        if decoder_group is None or prefiller is None or prefiller.group is None:
+            return UNKNOWN
+        return LOCAL if prefiller.group == decoder_group else REMOTE
 
     def _update_decoder_priority(self, server_idx: int):
         """Update the priority of a decoder server in the heap."""
         server = self.decoders[server_idx]
-        priority = server.active_tokens
-        # Remove old entry and add new one
-        self.decoder_heap = [(p, i, s) for p, i, s in self.decoder_heap if i != server_idx]
-        heapq.heappush(self.decoder_heap, (priority, server_idx, server))  # type: ignore
+        if self.load_table is not None:
+            self.load_table.publish(
+                server.load_slot, self.worker_id, server.active_tokens, server.active_kv_cache, server.active_requests
+            )
+        priority = (server.active_tokens + server.remote_tokens) / server.capacity
+        if not server.draining and server.health.routable(server.active_requests):
+            self.decoder_heap.push(server_idx, priority)
+        else:
+            self.decoder_heap.remove(server_idx)
 
     def abort_prefiller_request(self, server_idx: int, request_id):  # Changed to synchronous
         """
@@ -191,71 +426,580 @@ class ProxyState:
         self.prefillers[server_idx].aborted_requests.clear()
         return aborted_requests
 
+    def abort_request(self, request_id: str, api_request_id: str) -> bool:
+        """
+        Give up the prefill of a request whose client disconnected, return whether one was cancelled.
+
+        A prefill the decoder has not asked for yet is skipped. A running one is
+        cancelled, which closes its connection: vLLM aborts a request whose connection
+        closes and frees its KV blocks. With abort_api, the id is also queued for the
+        prefiller's abort endpoint, see flush_aborted_requests.
+        """
+        self.inflight_requests.pop(api_request_id)
+        task = self.prefill_tasks.pop(request_id, None)
+        prefiller_idx = self.req_to_prefiller.pop(request_id, None)
+        if task is None:
+            return False
+        task.cancel()
+        if self.abort_api and prefiller_idx in self.prefillers:
+            self.abort_prefiller_request(prefiller_idx, request_id)
+        return True
+
+    def flush_aborted_requests(self, server_idx: int):
+        """
+        Send the requests aborted on a prefiller since the last flush to its abort
+        endpoint in one request, in the background. Called before every prefill sent to
+        the prefiller, and by run_abort_flush for prefillers that get none.
+        """
+        aborted_requests = self.acquire_aborted_prefiller_requests(server_idx)
+        if not aborted_requests or not self.abort_api:
+            return
+        task = asyncio.get_running_loop().create_task(
+            self._send_aborted_requests(self.prefillers[server_idx], sorted(aborted_requests))
+        )
+        self._abort_flushes.add(task)
+        task.add_done_callback(self._abort_flushes.discard)
+
+    async def _send_aborted_requests(self, server: ServerState, request_ids: List[str]):
+        try:
+            response = await server.client.post(
+                self.abort_api,
+                json={"request_ids": request_ids},
+                headers={"Authorization": f"Bearer {os.environ.get('OPENAI_API_KEY')}"},
+            )
+            response.raise_for_status()
+            proxy_metrics.prefiller_abort_ids.labels("sent").inc(len(request_ids))
+        except httpx.HTTPError as e:
+            # The prefiller frees them when they time out
+            logger.warning(f"Sending {len(request_ids)} aborted requests to {server.url} failed: {str(e)}")
+            proxy_metrics.prefiller_abort_ids.labels("failed").inc(len(request_ids))
+
+    async def run_abort_flush(self, interval: float):
+        """Scheduled periodic task sending aborted requests that no prefill to their prefiller carried along."""
+        while True:
+            await asyncio.sleep(interval)
+            for idx, server in list(self.prefillers.items()):
+                if server.aborted_requests:
+                    self.flush_aborted_requests(idx)
+
     async def next_req_id(self):
         async with self.req_id_lock:
             return str(uuid.uuid4())
 
-    def select_prefiller(self, token_count):  # Changed to synchronous
+    def request_prefix_hashes(self, req_data: dict) -> Optional[List[int]]:
+        if self.prefix_block_size <= 0:
+            return None
+        return prefix_block_hashes(request_prefix_text(req_data), self.prefix_block_size, self.prefix_max_blocks)
+
+    def select_prefiller(self, token_count, prefix_hashes=None, group=None, eligible=None):  # Changed to synchronous
+        """Select a prefiller among the eligible ones, or return None when no prefiller is eligible."""
         # No lock needed - entire function is atomic
         if not self.prefiller_heap:
             raise RuntimeError("No prefiller servers available")
 
-        priority, chosen, server = heapq.heappop(self.prefiller_heap)
+        start = time.perf_counter()
+        added_load = functools.partial(self.prefiller_added_load, token_count=token_count)
+        if self.topology.enabled:
+            heap = self._prefiller_candidates(token_count, group, eligible)
+            chosen = self.prefiller_policy.select(heap, token_count, prefix_hashes, added_load, eligible)
+            if chosen is None:
+                return None
+            self.pairings[self.pairing_locality(chosen, group)] += 1
+        else:
+            chosen = self.prefiller_policy.select(
+                self.prefiller_heap, token_count, prefix_hashes, added_load, eligible
+            )
+            if chosen is None:
+                return None
 
         # Update the chosen server atomically
         self.prefillers[chosen].active_tokens += token_count
         self.prefillers[chosen].active_kv_cache += token_count
+        self.prefillers[chosen].active_requests += 1
 
-        # Update priority and re-add to heap
+        # Update priority in place
         self._update_prefiller_priority(chosen)
+        proxy_metrics.prefiller_selection.observe(time.perf_counter() - start)
 
         return chosen
 
     def release_prefiller(self, idx, token_count):  # Changed to synchronous
         # No lock needed - atomic operation
-        self.prefillers[idx].active_tokens -= token_count
+        server = self.prefillers.get(idx)
+        if server is None:
+            # Removed while the request was in flight
+            return
+        server.active_tokens -= token_count
+        server.active_requests -= 1
+        if server.draining and server.active_requests == 0:
+            self.remove_backend("prefill", idx)
+            return
         # Update priority queue after releasing
         self._update_prefiller_priority(idx)
+        if self.prefiller_admission.queue_depth:
+            self.prefiller_admission.wake()
 
     def release_prefiller_kv(self, idx, token_count):  # Changed to synchronous
         # No lock needed - atomic operation
-        if self.prefillers[idx].active_kv_cache > 0:
-            self.prefillers[idx].active_kv_cache -= token_count
+        server = self.prefillers.get(idx)
+        if server is None:
+            return
+        if server.active_kv_cache > 0:
+            server.active_kv_cache -= token_count
         # Update priority queue after releasing
         self._update_prefiller_priority(idx)
 
-    def select_decoder(self, token_count):  # Changed to synchronous
+    def select_decoder(self, token_count, prefix_hashes=None, eligible=None):  # Changed to synchronous
+        """Select a decoder among the eligible ones, or return None when no decoder is eligible."""
         # No lock needed - entire function is atomic
         if not self.decoder_heap:
             raise RuntimeError("No decoder servers available")
 
-        priority, chosen, server = heapq.heappop(self.decoder_heap)
+        start = time.perf_counter()
+        added_load = functools.partial(self.decoder_added_load, token_count=token_count)
+        chosen = self.decoder_policy.select(self.decoder_heap, token_count, prefix_hashes, added_load, eligible)
+        if chosen is None:
+            return None
 
         # Update the chosen server atomically
         self.decoders[chosen].active_tokens += token_count
+        self.decoders[chosen].active_requests += 1
 
-        # Update priority and re-add to heap
+        # Update priority in place
         self._update_decoder_priority(chosen)
+        proxy_metrics.decoder_selection.observe(time.perf_counter() - start)
 
         return chosen
 
     def release_decoder(self, idx, token_count):  # Changed to synchronous
         # No lock needed - atomic operation
-        self.decoders[idx].active_tokens -= token_count
+        server = self.decoders.get(idx)
+        if server is None:
+            # Removed while the request was in flight
+            return
+        server.active_tokens -= token_count
+        server.active_requests -= 1
+        if server.draining and server.active_requests == 0:
+            self.remove_backend("decode", idx)
+            return
         # Update priority queue after releasing
         self._update_decoder_priority(idx)
+        if self.decoder_admission.queue_depth:
+            self.decoder_admission.wake()
+
+    @staticmethod
+    def _has_capacity(server: ServerState, token_count, max_requests, max_tokens) -> bool:
+        active_requests = server.active_requests + server.remote_requests
+        if max_requests and active_requests >= max_requests:
+            return False
+        # An idle backend always takes a request, even one larger than the token cap
+        if max_tokens and active_requests and server.active_tokens + server.remote_tokens + token_count > max_tokens:
+            return False
+        return True
+
+    def decoder_has_capacity(self, idx, token_count) -> bool:
+        return self._has_capacity(
+            self.decoders[idx], token_count, self.max_requests_per_backend, self.max_tokens_per_backend
+        )
 
-    # Omni_infer's calculate_input_scores function
-    def calculate_prefill_scores(self, request_length: int) -> float:
-        length_score = request_length / 4.0
-        input_score = length_score * 0.0345 + 120.0745
-        return input_score
+    def prefiller_has_capacity(self, idx, token_count) -> bool:
+        return self._has_capacity(
+            self.prefillers[idx], token_count, self.max_requests_per_prefiller, self.max_tokens_per_prefiller
+        )
 
-    def calculate_decode_scores(self, request_length: int) -> float:
-        return request_length
+    def try_select_decoder(self, token_count, prefix_hashes=None):
+        """Select a decoder like select_decoder among those with capacity, or return None while none has."""
+        eligible = None
+        if self.max_requests_per_backend or self.max_tokens_per_backend:
+            eligible = functools.partial(self.decoder_has_capacity, token_count=token_count)
+        return self.select_decoder(token_count, prefix_hashes, eligible)
+
+    def try_select_prefiller(self, token_count, prefix_hashes=None, group=None):
+        """Select a prefiller like select_prefiller among those with capacity, or return None while none has."""
+        eligible = None
+        if self.max_requests_per_prefiller or self.max_tokens_per_prefiller:
+            eligible = functools.partial(self.prefiller_has_capacity, token_count=token_count)
+        return self.select_prefiller(token_count, prefix_hashes, group, eligible)
+
+    async def admit_decoder(self, token_count, prefix_hashes=None, deadline=None, weight=1.0):
+        """Select a decoder, waiting in the admission queue while all of them are saturated."""
+        return await self.decoder_admission.admit(
+            functools.partial(self.try_select_decoder, prefix_hashes=prefix_hashes),
+            functools.partial(self.release_decoder, token_count=token_count),
+            token_count,
+            deadline,
+            weight,
+        )
+
+    async def admit_prefiller(self, token_count, prefix_hashes=None, deadline=None, weight=1.0, group=None):
+        """Select a prefiller, waiting in the prefill admission queue while all of them are saturated."""
+        return await self.prefiller_admission.admit(
+            functools.partial(self.try_select_prefiller, prefix_hashes=prefix_hashes, group=group),
+            functools.partial(self._release_admitted_prefiller, token_count=token_count),
+            token_count,
+            deadline,
+            weight,
+        )
+
+    def prefill_hedge_delay(self) -> Optional[float]:
+        """Seconds after which a running prefill is hedged, None while hedging is off or lacks latency samples."""
+        config = self.retry_budget.config
+        if not config.hedge_prefill:
+            return None
+        quantile = self.prefill_latencies.value()
+        if quantile is None:
+            return None
+        return max(quantile, config.hedge_min_delay)
+
+    def try_select_hedge_prefiller(self, token_count, exclude: int, prefix_hashes=None, group=None):
+        """Select a prefiller with capacity other than exclude for a hedged prefill, or return None."""
+        server = self.prefillers.get(exclude)
+        # Taken out of the heaps for the selection, its priority is restored right after
+        self.prefiller_heap.remove(exclude)
+        if server is not None and server.group is not None:
+            self._group_heap(server.group).remove(exclude)
+        try:
+            if not self.prefiller_heap:
+                return None
+            return self.try_select_prefiller(token_count, prefix_hashes, group)
+        finally:
+            if server is not None:
+                self._update_prefiller_priority(exclude)
+
+    def pin_prefiller(self, idx, token_count, kv_cache=None) -> bool:
+        """
+        Account a prefill on a given prefiller like select_prefiller, return False if it is not
+        routable or at capacity. kv_cache is the KV cache the prefill holds, token_count when None.
+        """
+        if idx not in self.prefiller_heap or not self.prefiller_has_capacity(idx, token_count):
+            return False
+        server = self.prefillers[idx]
+        server.active_tokens += token_count
+        server.active_kv_cache += token_count if kv_cache is None else kv_cache
+        server.active_requests += 1
+        self._update_prefiller_priority(idx)
+        return True
+
+    def _release_admitted_prefiller(self, idx, token_count):
+        self.release_prefiller(idx, token_count)
+        self.release_prefiller_kv(idx, token_count)
+
+    def record_prefiller_result(self, idx, latency=None, failed=False):
+        server = self.prefillers.get(idx)
+        if server is None or not self.outlier_detection.enabled:
+            return
+        health = server.health
+        if failed:
+            changed = self.prefiller_outliers.record_failure(health, len(self.prefillers))
+        else:
+            changed = self.prefiller_outliers.record_success(health, latency)
+        if changed:
+            self._update_prefiller_priority(idx)
+            if self.prefiller_admission.queue_depth:
+                self.prefiller_admission.wake()
+
+    def record_decoder_result(self, idx, latency=None, failed=False):
+        server = self.decoders.get(idx)
+        if server is None or not self.outlier_detection.enabled:
+            return
+        health = server.health
+        if failed:
+            changed = self.decoder_outliers.record_failure(health, len(self.decoders))
+        else:
+            changed = self.decoder_outliers.record_success(health, latency)
+        if changed:
+            self._update_decoder_priority(idx)
+            if self.decoder_admission.queue_depth:
+                self.decoder_admission.wake()
+
+    def sweep_outliers(self):
+        for idx in self.prefiller_outliers.sweep({i: server.health for i, server in self.prefillers.items()}):
+            logger.info(f"Prefiller {self.prefillers[idx].url} is now {self.prefillers[idx].health.state}")
+            self._update_prefiller_priority(idx)
+        for idx in self.decoder_outliers.sweep({i: server.health for i, server in self.decoders.items()}):
+            logger.info(f"Decoder {self.decoders[idx].url} is now {self.decoders[idx].health.state}")
+            self._update_decoder_priority(idx)
+        self.wake_admission_queues()
+
+    def wake_admission_queues(self):
+        """Admit queued requests after backends became routable or less loaded."""
+        if self.prefiller_admission.queue_depth:
+            self.prefiller_admission.wake()
+        if self.decoder_admission.queue_depth:
+            self.decoder_admission.wake()
+
+    async def run_outlier_detection(self):
+        """Scheduled periodic outlier sweep task."""
+        while True:
+            await asyncio.sleep(self.outlier_detection.interval)
+            try:
+                self.sweep_outliers()
+            except Exception as e:
+                logger.error(f"Outlier detection sweep failed: {e}")
+
+    def outlier_stats(self):
+        return {
+            "prefiller": self.prefiller_outliers.stats(
+                {server.url: server.health for server in self.prefillers.values()}
+            ),
+            "decoder": self.decoder_outliers.stats({server.url: server.health for server in self.decoders.values()}),
+        }
+
+    def _role(self, role: str):
+        if role == "prefill":
+            return self.prefillers, self.prefiller_heap, self.prefiller_policy, self.prefiller_outliers
+        if role == "decode":
+            return self.decoders, self.decoder_heap, self.decoder_policy, self.decoder_outliers
+        raise ValueError(f"Unsupported role: {role}, expected prefill or decode")
+
+    def backends(self, role: str) -> Dict[int, ServerState]:
+        return self._role(role)[0]
+
+    def find_backend(self, role: str, host: str, port: int) -> Optional[int]:
+        servers = self.backends(role)
+        for idx, server in servers.items():
+            if server.host == host and server.port == port:
+                return idx
+        return None
+
+    def add_backend(self, role: str, host: str, port: int, source: str = "static", capacity=None) -> int:
+        """Add a backend to a role, or take a draining one with the same address back into service."""
+        servers = self.backends(role)
+        idx = self.find_backend(role, host, port)
+        if idx is not None:
+            servers[idx].draining = False
+            if capacity:
+                servers[idx].capacity = capacity
+        else:
+            idx = self._allocate_server_idx()
+            servers[idx] = self._new_server(role, host, port, source, capacity)
+            logger.info(f"Added {role} backend {servers[idx].url}")
+        if role == "prefill":
+            self._update_prefiller_priority(idx)
+        else:
+            self._update_decoder_priority(idx)
+        self.wake_admission_queues()
+        return idx
+
+    def drain_backend(self, role: str, idx: int):
+        """Stop routing new requests to a backend, it is removed once its in-flight requests finish."""
+        servers, heap, _, _ = self._role(role)
+        server = servers[idx]
+        if not server.draining:
+            server.draining = True
+            server.drain_started = time.monotonic()
+            logger.info(f"Draining {role} backend {server.url} with {server.active_requests} requests in flight")
+        heap.remove(idx)
+        if role == "prefill" and server.group is not None:
+            self._group_heap(server.group).remove(idx)
+        if server.active_requests == 0:
+            self.remove_backend(role, idx)
+
+    def remove_backend(self, role: str, idx: int):
+        """Remove a backend right away, requests still running on it are not interrupted but not tracked."""
+        servers, heap, policy, detector = self._role(role)
+        server = servers.pop(idx, None)
+        if server is None:
+            return
+        heap.remove(idx)
+        if role == "prefill" and server.group is not None:
+            self._group_heap(server.group).remove(idx)
+        policy.forget(idx)
+        detector.forget(server.health)
+        if self.load_table is not None:
+            self.load_table.publish(server.load_slot, self.worker_id, 0, 0, 0)
+        logger.info(f"Removed {role} backend {server.url}")
+        task = asyncio.get_running_loop().create_task(server.client.aclose())
+        self._closing_clients.add(task)
+        task.add_done_callback(self._closing_clients.discard)
+
+    def expire_drains(self, drain_timeout: float):
+        """Remove backends that have been draining for longer than drain_timeout."""
+        now = time.monotonic()
+        for role in ("prefill", "decode"):
+            servers = self.backends(role)
+            for idx in [i for i, s in servers.items() if s.draining and now - s.drain_started > drain_timeout]:
+                logger.warning(f"{role} backend {servers[idx].url} did not drain in {drain_timeout}s, removing it")
+                self.remove_backend(role, idx)
+
+    def reconcile_backends(self, role: str, addresses):
+        """Make the non-admin backends of a role match a set of (host, port) addresses."""
+        servers = self.backends(role)
+        current = set()
+        for idx, server in list(servers.items()):
+            if server.source == "admin":
+                continue
+            if (server.host, server.port) in addresses:
+                if not server.draining:
+                    current.add((server.host, server.port))
+            elif not server.draining:
+                self.drain_backend(role, idx)
+        for host, port in addresses - current:
+            self.add_backend(role, host, port)
+
+    async def _resolve_watch_hosts(self, role: str, watch_hosts, failure_threshold: int):
+        """Resolve every watched (hostname, port) of a role into the set of backend addresses."""
+        loop = asyncio.get_running_loop()
+        addresses = set()
+        for host, port in watch_hosts:
+            known, failures = self._dns_addresses.get((role, host, port), (set(), 0))
+            try:
+                infos = await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+                known, failures = {(info[4][0], port) for info in infos}, 0
+            except socket.gaierror as e:
+                failures += 1
+                logger.debug(f"Failed to resolve {host}: {e}")
+                # A pod that went away stops resolving, keep its last addresses for a few rounds
+                # so that a DNS hiccup does not drain it
+                if failures >= failure_threshold:
+                    known = set()
+            self._dns_addresses[(role, host, port)] = (known, failures)
+            addresses |= known
+        return addresses
+
+    async def run_membership_watch(self, watch_hosts, interval: float, failure_threshold: int, drain_timeout: float):
+        """
+        Scheduled periodic membership task: re-resolve the watched hostnames of each
+        role, add and drain backends to match them, and remove stuck drains.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                for role, hosts in watch_hosts.items():
+                    if not hosts:
+                        continue
+                    addresses = await self._resolve_watch_hosts(role, hosts, failure_threshold)
+                    # Never drain a whole role because DNS is unavailable
+                    if addresses:
+                        self.reconcile_backends(role, addresses)
+                self.expire_drains(drain_timeout)
+            except Exception as e:
+                logger.error(f"Backend membership watch failed: {e}")
+
+    def sync_remote_load(self):
+        """Pull the load other workers put on each backend and re-rank backends whose load changed."""
+        table = self.load_table
+        for idx, server in self.prefillers.items():
+            remote = table.remote(server.load_slot, self.worker_id)
+            if remote != (server.remote_tokens, server.remote_kv_cache, server.remote_requests):
+                server.remote_tokens, server.remote_kv_cache, server.remote_requests = remote
+                self._update_prefiller_priority(idx)
+        for idx, server in self.decoders.items():
+            remote = table.remote(server.load_slot, self.worker_id)
+            if remote != (server.remote_tokens, server.remote_kv_cache, server.remote_requests):
+                server.remote_tokens, server.remote_kv_cache, server.remote_requests = remote
+                self._update_decoder_priority(idx)
+        self.wake_admission_queues()
+
+    async def run_load_sync(self, interval: float):
+        """Scheduled periodic task refreshing the load of other workers, only used with several workers."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.sync_remote_load()
+            except Exception as e:
+                logger.error(f"Shared load sync failed: {e}")
+
+    async def run_topology_watch(self, resolver: KubernetesGroupResolver):
+        """Look up the topology group of backends that have none, e.g. ones that joined since the last pass."""
+        while True:
+            missing = {
+                (role, idx): server.host
+                for role in ("prefill", "decode")
+                for idx, server in self.backends(role).items()
+                if server.group is None
+            }
+            if missing:
+                try:
+                    groups = await resolver.resolve(missing.values())
+                except (httpx.HTTPError, ValueError) as e:
+                    logger.warning(f"Topology group lookup failed: {str(e)}")
+                    groups = {}
+                for (role, idx), host in missing.items():
+                    if host in groups:
+                        self.set_backend_group(role, idx, groups[host])
+            await asyncio.sleep(self.topology.refresh_interval)
+
+    def topology_stats(self):
+        pairs = sum(self.pairings.values())
+        return {
+            "enabled": self.topology.enabled,
+            "pairings": self.pairings,
+            "locality_fallbacks": self.locality_fallbacks,
+            "local_rate": self.pairings[LOCAL] / pairs if pairs else 0.0,
+            "groups": {
+                role: {server.url: server.group for server in self.backends(role).values()}
+                for role in ("prefill", "decode")
+            },
+        }
+
+    def backend_stats(self):
+        return {
+            role: [
+                {
+                    "index": idx,
+                    "url": server.url,
+                    "source": server.source,
+                    "draining": server.draining,
+                    "capacity": server.capacity,
+                    "group": server.group,
+                    "state": server.health.state,
+                    "active_requests": server.active_requests,
+                    "active_tokens": server.active_tokens,
+                }
+                for idx, server in self.backends(role).items()
+            ]
+            for role in ("prefill", "decode")
+        }
+
+    def record_request_bytes(self, received: int = 0, copied: int = 0, new_request: bool = False):
+        if new_request:
+            self.request_count += 1
+        self.request_bytes_received += received
+        self.request_bytes_copied += copied
+
+    def request_bytes_stats(self):
+        return {
+            "requests": self.request_count,
+            "received": self.request_bytes_received,
+            "copied": self.request_bytes_copied,
+            "copied_per_request": self.request_bytes_copied / self.request_count if self.request_count else 0,
+        }
+
+    def calculate_prefill_scores(self, prompt_tokens: int, model: Optional[str] = None) -> float:
+        return self.cost_model.prefill_cost(prompt_tokens, model)
+
+    def calculate_decode_scores(
+        self, prompt_tokens: int, max_tokens: Optional[int], model: Optional[str] = None
+    ) -> float:
+        return self.cost_model.decode_cost(prompt_tokens, max_tokens, model)
 
 
 proxy_state = None
+proxy_metrics = ProxyMetrics()
+request_drain = RequestDrain()
+# Created before the workers are forked, None without run_workers
+shared_load_table = None
+
+
+def _collect_backend_states():
+    if proxy_state is None:
+        return
+    for server in proxy_state.prefillers.values():
+        yield "prefill", server.url, server
+    for server in proxy_state.decoders.values():
+        yield "decode", server.url, server
+
+
+def _collect_admission_queues():
+    if proxy_state is None:
+        return
+    yield "prefill", proxy_state.prefiller_admission.queue_depth
+    yield "decode", proxy_state.decoder_admission.queue_depth
+
+
+proxy_metrics.add_backend_collector(_collect_backend_states)
+proxy_metrics.add_queue_collector(_collect_admission_queues)
 
 
 def parse_args():
@@ -266,10 +1010,264 @@ def parse_args():
     parser.add_argument("--prefiller-ports", type=int, nargs="+", default=[8001])
     parser.add_argument("--decoder-hosts", type=str, nargs="+", default=["localhost"])
     parser.add_argument("--decoder-ports", type=int, nargs="+", default=[8002])
+    parser.add_argument(
+        "--prefiller-capacities",
+        type=float,
+        nargs="+",
+        default=[1.0],
+        help="Relative capacity of each prefiller, or one value for all; load is balanced in proportion to it, "
+        "so equal values, including a single one, balance like no capacities",
+    )
+    parser.add_argument(
+        "--decoder-capacities",
+        type=float,
+        nargs="+",
+        default=[1.0],
+        help="Relative capacity of each decoder, or one value for all; load is balanced in proportion to it, "
+        "so equal values, including a single one, balance like no capacities",
+    )
     parser.add_argument("--max-retries", type=int, default=3, help="Maximum number of retries for HTTP requests")
     parser.add_argument(
         "--retry-delay", type=float, default=0.001, help="Base delay (seconds) for exponential backoff retries"
     )
+    parser.add_argument(
+        "--retry-config",
+        type=json.loads,
+        default=None,
+        help="JSON retry budget and prefill hedging settings, see RetryConfig",
+    )
+    parser.add_argument(
+        "--response-cache-config",
+        type=json.loads,
+        default=None,
+        help="JSON cache of responses to temperature 0 requests, see ResponseCacheConfig",
+    )
+    parser.add_argument(
+        "--abort-api",
+        type=str,
+        default="",
+        help="Prefiller endpoint under /v1 taking {\"request_ids\": [...]} of requests whose client disconnected, "
+        "e.g. /abort_requests; by default aborted prefills only have their connection closed",
+    )
+    parser.add_argument(
+        "--abort-flush-interval",
+        type=float,
+        default=0.5,
+        help="Seconds after which aborted request ids are sent to a prefiller that got no prefill to carry them",
+    )
+    parser.add_argument(
+        "--inflight-ttl",
+        type=float,
+        default=300.0,
+        help="Seconds after which an unfinished in-flight request entry is evicted",
+    )
+    parser.add_argument(
+        "--max-inflight-requests", type=int, default=100000, help="Maximum number of in-flight request entries kept"
+    )
+    parser.add_argument(
+        "--routing-policy",
+        type=str,
+        default="least_load",
+        choices=list(ROUTING_POLICIES),
+        help="Policy used to pick prefillers and decoders",
+    )
+    parser.add_argument(
+        "--prefix-block-size", type=int, default=512, help="Prompt bytes per hashed block for prefix affinity"
+    )
+    parser.add_argument(
+        "--prefix-max-blocks", type=int, default=64, help="Maximum number of leading prompt blocks hashed"
+    )
+    parser.add_argument(
+        "--prefix-load-factor",
+        type=float,
+        default=1.25,
+        help="Prefix affinity is ignored once the preferred backend exceeds this multiple of the mean load "
+        "and the mean load plus the request",
+    )
+    parser.add_argument(
+        "--prefix-index-size", type=int, default=100000, help="Maximum number of prefix blocks remembered per role"
+    )
+    parser.add_argument(
+        "--max-requests-per-backend",
+        type=int,
+        default=0,
+        help="Maximum concurrent requests per decoder before requests are queued, 0 means unlimited",
+    )
+    parser.add_argument(
+        "--max-tokens-per-backend",
+        type=int,
+        default=0,
+        help="Maximum scheduled token load per decoder before requests are queued, 0 means unlimited",
+    )
+    parser.add_argument(
+        "--admission-queue-size",
+        type=int,
+        default=1024,
+        help="Maximum number of requests waiting for decoder capacity, further requests get 429",
+    )
+    parser.add_argument(
+        "--admission-queue-timeout",
+        type=float,
+        default=5.0,
+        help="Seconds a request waits for decoder capacity before it gets 429",
+    )
+    parser.add_argument(
+        "--max-requests-per-prefiller",
+        type=int,
+        default=0,
+        help="Maximum concurrent requests per prefiller before prefills are queued, 0 means unlimited",
+    )
+    parser.add_argument(
+        "--max-tokens-per-prefiller",
+        type=int,
+        default=0,
+        help="Maximum scheduled token load per prefiller before prefills are queued, 0 means unlimited",
+    )
+    parser.add_argument(
+        "--prefill-queue-timeout",
+        type=float,
+        default=60.0,
+        help="Seconds a prefill waits for prefiller capacity before it is rejected",
+    )
+    parser.add_argument(
+        "--scheduling-policy",
+        type=str,
+        default="fifo",
+        choices=SCHEDULING_POLICIES,
+        help="Order of the admission queues: arrival, earliest deadline first or shortest job first",
+    )
+    parser.add_argument(
+        "--sjf-aging",
+        type=float,
+        default=1000.0,
+        help="With sjf, tokens of request size worth one second of waiting, larger values starve long requests less",
+    )
+    parser.add_argument(
+        "--priority-classes",
+        type=json.loads,
+        default=None,
+        help="JSON priority classes with TTFT deadlines and sjf weights, see PriorityClassifier.from_config",
+    )
+    parser.add_argument(
+        "--retry-after", type=int, default=1, help="Retry-After seconds returned with 429 responses"
+    )
+    parser.add_argument(
+        "--outlier-detection-config",
+        type=json.loads,
+        default=None,
+        help="JSON outlier detection and circuit breaker settings, see OutlierDetectionConfig",
+    )
+    parser.add_argument(
+        "--topology-config",
+        type=json.loads,
+        default=None,
+        help="JSON topology-aware prefill/decode pairing settings, see TopologyConfig",
+    )
+    parser.add_argument(
+        "--cost-model-config",
+        type=json.loads,
+        default=None,
+        help="JSON cost model config: tokenizer_path, cache_size and per-model coefficients under models",
+    )
+    parser.add_argument(
+        "--prefiller-watch-hosts",
+        type=str,
+        nargs="*",
+        default=[],
+        help="Prefiller hostnames re-resolved periodically, backends follow their addresses",
+    )
+    parser.add_argument(
+        "--decoder-watch-hosts",
+        type=str,
+        nargs="*",
+        default=[],
+        help="Decoder hostnames re-resolved periodically, backends follow their addresses",
+    )
+    parser.add_argument(
+        "--prefiller-watch-port",
+        type=int,
+        default=None,
+        help="Port of watched prefillers, the first prefiller port by default",
+    )
+    parser.add_argument(
+        "--decoder-watch-port", type=int, default=None, help="Port of watched decoders, first decoder port by default"
+    )
+    parser.add_argument(
+        "--dns-watch-interval", type=float, default=5.0, help="Seconds between re-resolutions of watched hostnames"
+    )
+    parser.add_argument(
+        "--dns-watch-failures",
+        type=int,
+        default=3,
+        help="Consecutive resolution failures after which a watched hostname's backends are drained",
+    )
+    parser.add_argument(
+        "--drain-timeout",
+        type=float,
+        default=600.0,
+        help="Seconds a draining backend may keep in-flight requests before it is removed anyway",
+    )
+    parser.add_argument(
+        "--enable-admin-api", action="store_true", help="Serve /admin/backends to add and drain backends at runtime"
+    )
+    parser.add_argument(
+        "--eager-prefill",
+        action="store_true",
+        help="Pick the prefiller on request arrival and send its request alongside the decoder's, "
+        "completing it when the decoder's metaserver callback provides the kv_transfer_params",
+    )
+    parser.add_argument(
+        "--eager-prefill-timeout",
+        type=float,
+        default=60.0,
+        help="Seconds an eagerly dispatched prefill waits for the decoder's callback before it is abandoned",
+    )
+    parser.add_argument(
+        "--coalesce-prefills",
+        action="store_true",
+        help="Let prefills of a prompt that is being prefilled wait for it and reuse its prefiller's prefix cache",
+    )
+    parser.add_argument(
+        "--coalesce-max-wait",
+        type=float,
+        default=5.0,
+        help="Seconds a coalesced prefill waits for the identical one beyond the prompt's expected prefill time "
+        "(the cost model's prefill cost, in milliseconds) before it is prefilled on its own",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Number of proxy worker processes sharing the listening port"
+    )
+    parser.add_argument(
+        "--reuse-port",
+        action="store_true",
+        help="Bind the listening port with SO_REUSEPORT and metaserver callbacks to the worker ports even with "
+        "one worker, so that a new router can take the port over while this one drains",
+    )
+    parser.add_argument(
+        "--shutdown-timeout",
+        type=float,
+        default=60.0,
+        help="Seconds a router draining on SIGTERM keeps serving its requests in flight before it cancels them",
+    )
+    parser.add_argument(
+        "--worker-port-base",
+        type=int,
+        default=None,
+        help="With several workers, worker i also listens on this port + i for its metaserver callbacks, "
+        "port + 1 by default",
+    )
+    parser.add_argument(
+        "--load-sync-interval",
+        type=float,
+        default=0.01,
+        help="Seconds between refreshes of the backend load other workers report",
+    )
+    parser.add_argument(
+        "--load-table-capacity",
+        type=int,
+        default=4096,
+        help="Maximum number of distinct backends tracked in the shared load table",
+    )
     args = parser.parse_args()
     if len(args.prefiller_hosts) != len(args.prefiller_ports):
         raise ValueError("Number of prefiller hosts must match number of prefiller ports")
@@ -277,98 +1275,202 @@ def parse_args():
         raise ValueError("Number of decoder hosts must match number of decoder ports")
     args.prefiller_instances = list(zip(args.prefiller_hosts, args.prefiller_ports))
     args.decoder_instances = list(zip(args.decoder_hosts, args.decoder_ports))
+    for role, capacities, instances in (
+        ("prefiller", args.prefiller_capacities, args.prefiller_instances),
+        ("decoder", args.decoder_capacities, args.decoder_instances),
+    ):
+        if any(capacity <= 0 for capacity in capacities):
+            raise ValueError(f"{role} capacities must be positive, got: {capacities}")
+        if len(capacities) == 1:
+            capacities *= len(instances)
+        elif len(capacities) != len(instances):
+            raise ValueError(f"Number of {role} capacities must be 1 or match number of {role} hosts")
+    if args.workers <= 0:
+        raise ValueError(f"workers must be positive, got: {args.workers}")
+    if args.shutdown_timeout <= 0:
+        raise ValueError(f"shutdown_timeout must be positive, got: {args.shutdown_timeout}")
+    if args.abort_flush_interval <= 0:
+        raise ValueError(f"abort_flush_interval must be positive, got: {args.abort_flush_interval}")
+    if args.worker_port_base is None:
+        args.worker_port_base = args.port + 1
+    # Decoders call back into the worker that owns the request, see run_workers
+    args.worker_id = 0
+    args.metaserver_port = args.port
+    prefiller_watch_port = args.prefiller_watch_port or args.prefiller_ports[0]
+    decoder_watch_port = args.decoder_watch_port or args.decoder_ports[0]
+    args.watch_hosts = {
+        "prefill": [(host, prefiller_watch_port) for host in args.prefiller_watch_hosts],
+        "decode": [(host, decoder_watch_port) for host in args.decoder_watch_hosts],
+    }
     return args
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     global proxy_state
-    proxy_state = ProxyState(global_args.prefiller_instances, global_args.decoder_instances)
+    request_drain.retry_after = global_args.retry_after
+    policy_kwargs = {}
+    prefix_block_size = 0
+    if global_args.routing_policy != LeastLoadPolicy.name:
+        policy_kwargs = {"load_factor": global_args.prefix_load_factor, "max_entries": global_args.prefix_index_size}
+        prefix_block_size = global_args.prefix_block_size
+    proxy_state = ProxyState(
+        global_args.prefiller_instances,
+        global_args.decoder_instances,
+        inflight_ttl=global_args.inflight_ttl,
+        max_inflight_requests=global_args.max_inflight_requests,
+        prefiller_policy=create_routing_policy(global_args.routing_policy, **policy_kwargs),
+        decoder_policy=create_routing_policy(global_args.routing_policy, **policy_kwargs),
+        prefix_block_size=prefix_block_size,
+        prefix_max_blocks=global_args.prefix_max_blocks,
+        cost_model=CostModel.from_config(global_args.cost_model_config),
+        max_requests_per_backend=global_args.max_requests_per_backend,
+        max_tokens_per_backend=global_args.max_tokens_per_backend,
+        decoder_admission=AdmissionController(
+            max_queue_size=global_args.admission_queue_size,
+            queue_timeout=global_args.admission_queue_timeout,
+            retry_after=global_args.retry_after,
+            scheduling=global_args.scheduling_policy,
+            sjf_aging=global_args.sjf_aging,
+        ),
+        max_requests_per_prefiller=global_args.max_requests_per_prefiller,
+        max_tokens_per_prefiller=global_args.max_tokens_per_prefiller,
+        prefiller_admission=AdmissionController(
+            max_queue_size=global_args.admission_queue_size,
+            queue_timeout=global_args.prefill_queue_timeout,
+            retry_after=global_args.retry_after,
+            scheduling=global_args.scheduling_policy,
+            sjf_aging=global_args.sjf_aging,
+        ),
+        priority_classifier=PriorityClassifier.from_config(global_args.priority_classes),
+        outlier_detection=OutlierDetectionConfig.from_dict(global_args.outlier_detection_config),
+        load_table=shared_load_table,
+        worker_id=global_args.worker_id,
+        prefiller_capacities=global_args.prefiller_capacities,
+        decoder_capacities=global_args.decoder_capacities,
+        topology=TopologyConfig.from_dict(global_args.topology_config),
+        abort_api=global_args.abort_api,
+        # Each worker gets its share of the traffic, and of the time-based retries
+        retry_budget=RetryBudget(RetryConfig.from_dict(global_args.retry_config), share=1 / global_args.workers),
+        response_cache=ResponseCache(ResponseCacheConfig.from_dict(global_args.response_cache_config)),
+        prefill_coalescer=PrefillCoalescer(global_args.coalesce_prefills, global_args.coalesce_max_wait),
+    )
     print(f"Initialized {len(proxy_state.prefillers)} prefill clients and {len(proxy_state.decoders)} decode clients.")
+    # Loaded before serving, so that no request waits for it
+    await asyncio.get_running_loop().run_in_executor(None, proxy_state.cost_model.load_tokenizer)
+    background_tasks = [
+        asyncio.create_task(
+            proxy_state.run_membership_watch(
+                global_args.watch_hosts,
+                global_args.dns_watch_interval,
+                global_args.dns_watch_failures,
+                global_args.drain_timeout,
+            )
+        )
+    ]
+    if proxy_state.outlier_detection.enabled:
+        background_tasks.append(asyncio.create_task(proxy_state.run_outlier_detection()))
+    if shared_load_table is not None:
+        background_tasks.append(asyncio.create_task(proxy_state.run_load_sync(global_args.load_sync_interval)))
+    if proxy_state.abort_api:
+        background_tasks.append(asyncio.create_task(proxy_state.run_abort_flush(global_args.abort_flush_interval)))
+    topology_resolver = None
+    if proxy_state.topology.enabled and proxy_state.topology.kubernetes:
+        try:
+            topology_resolver = KubernetesGroupResolver(proxy_state.topology.label, proxy_state.topology.namespace)
+        except RuntimeError as e:
+            logger.warning(f"Topology groups are not looked up in Kubernetes: {str(e)}")
+        else:
+            background_tasks.append(asyncio.create_task(proxy_state.run_topology_watch(topology_resolver)))
     yield
-    for p in proxy_state.prefillers:
+    for task in background_tasks:
+        task.cancel()
+    if topology_resolver is not None:
+        await topology_resolver.aclose()
+    for p in proxy_state.prefillers.values():
         await p.client.aclose()
-    for d in proxy_state.decoders:
+    for d in proxy_state.decoders.values():
         await d.client.aclose()
 
 
-async def listen_for_disconnect(request: Request) -> None:
-    """Return if a disconnect message is received"""
-    while True:
-        message = await request.receive()
-        if message["type"] == "http.disconnect":
-            break
-
-
-def with_cancellation(handler_func):
-    @functools.wraps(handler_func)
-    async def wrapper(*args, **kwargs):
-        request = kwargs["request"]
-        handler_task = asyncio.create_task(handler_func(*args, **kwargs))
-        cancellation_task = asyncio.create_task(listen_for_disconnect(request))
-        done, pending = await asyncio.wait([handler_task, cancellation_task], return_when=asyncio.FIRST_COMPLETED)
-        for task in pending:
-            task.cancel()
-        if handler_task in done:
-            return handler_task.result()
-        return None
-
-    return wrapper
+def count_client_abort(scope, response_started: bool):
+    proxy_metrics.client_aborts.labels("stream" if response_started else "admission").inc()
 
 
 app = FastAPI(lifespan=lifespan)
+# Cancels a request whose client went away, before or while its response streams
+app.add_middleware(
+    DisconnectMiddleware, paths=("/v1/completions", "/v1/chat/completions"), on_disconnect=count_client_abort
+)
+# Outermost, so that a request counts as in flight until its response has streamed
+app.add_middleware(DrainMiddleware, drain=request_drain, paths=("/v1/completions", "/v1/chat/completions"))
+
+# vLLM only reports this stop reason when the decoder drops a request for recompute,
+# so chunks without it can be forwarded without being decoded.
+RECOMPUTE_MARKER = b'"recomputed"'
+# Events forwarded without being decoded before they are folded into the generated text,
+# so that a long response keeps its text for a recompute rather than every raw event.
+PENDING_CHUNK_LIMIT = 64
+
+
+def service_headers(request_id: str) -> dict:
+    return {
+        "Authorization": f"Bearer {os.environ.get('OPENAI_API_KEY')}",
+        "X-Request-Id": request_id,
+        "Content-Type": "application/json",
+    }
+
+
+def retry_budget_allows(denied_counter, endpoint: str) -> bool:
+    """Take a retry out of the retry budget, count and log it when there is none left."""
+    if proxy_state.retry_budget.try_acquire():
+        return True
+    denied_counter.inc()
+    logger.warning(f"Retry budget exhausted, not retrying {endpoint}")
+    return False
 
 
 async def send_request_to_service(
     client: httpx.AsyncClient,
     prefiller_id: int,
     endpoint: str,
-    req_data: dict,
+    req_body: bytes,
     request_id: str,
     max_retries: int = 3,
     base_delay: float = 0.2,
 ):
-    proxy_state.acquire_aborted_prefiller_requests(prefiller_id)
-    req_data = req_data.copy()
-    req_data["stream"] = False
-    req_data["max_tokens"] = 1
-    req_data["min_tokens"] = 1
-    if "max_completion_tokens" in req_data:
-        req_data["max_completion_tokens"] = 1
-    if "stream_options" in req_data:
-        del req_data["stream_options"]
-    headers = {"Authorization": f"Bearer {os.environ.get('OPENAI_API_KEY')}", "X-Request-Id": request_id}
+    # Aborted requests ride along with the next prefill to their prefiller
+    proxy_state.flush_aborted_requests(prefiller_id)
+    headers = service_headers(request_id)
     last_exc = None
     for attempt in range(1, max_retries + 1):
         try:
-            response = await client.post(endpoint, json=req_data, headers=headers)
+            response = await client.post(endpoint, content=req_body, headers=headers)
             response.raise_for_status()
-            if request_id in proxy_state.req_id_future:
-                result_future = proxy_state.req_id_future[request_id]
-                result_future.set_result(response.json()["kv_transfer_params"])
             return
         except (httpx.RequestError, httpx.HTTPStatusError) as e:
             logger.warning(f"Attempt {attempt} failed for {endpoint}: {str(e)}")
             last_exc = e
-            if attempt < max_retries:
+            if attempt < max_retries and retry_budget_allows(proxy_metrics.prefill_retries_denied, endpoint):
+                proxy_metrics.prefill_retries.inc()
                 await asyncio.sleep(base_delay * (2 ** (attempt - 1)))
             else:
-                logger.error(f"All {max_retries} attempts failed for {endpoint}.")
+                logger.error(f"Giving up on {endpoint} after {attempt} attempts.")
                 raise last_exc
 
 
 async def stream_service_response_with_retry(
     client: httpx.AsyncClient,
     endpoint: str,
-    req_data: dict,
+    req_body: bytes,
     request_id: str,
     max_retries: int = 3,
     base_delay: float = 0.2,
 ):
-    headers = {"Authorization": f"Bearer {os.environ.get('OPENAI_API_KEY')}", "X-Request-Id": request_id}
+    headers = service_headers(request_id)
     for attempt in range(1, max_retries + 1):
         try:
-            async with client.stream("POST", endpoint, json=req_data, headers=headers) as response:
+            async with client.stream("POST", endpoint, content=req_body, headers=headers) as response:
                 response.raise_for_status()
                 first_chunk_sent = False
                 async for chunk in response.aiter_bytes():
@@ -376,11 +1478,12 @@ async def stream_service_response_with_retry(
                     yield chunk
                 return  # Success, exit after streaming
         except (httpx.RequestError, httpx.HTTPStatusError) as e:
-            if attempt < max_retries:
+            if attempt < max_retries and retry_budget_allows(proxy_metrics.decode_retries_denied, endpoint):
                 logger.warning(f"Attempt {attempt} failed for streaming {endpoint}: {str(e)}")
+                proxy_metrics.decode_retries.inc()
                 await asyncio.sleep(base_delay * (2 ** (attempt - 1)))
             else:
-                logger.error(f"All {max_retries} attempts failed for streaming {endpoint}.")
+                logger.error(f"Giving up on streaming {endpoint} after {attempt} attempts.")
                 raise e
         except Exception as e:
             # If any chunk has been sent, do not retry, just log and drop
@@ -388,14 +1491,82 @@ async def stream_service_response_with_retry(
                 logger.error(f"Streaming to client interrupted after response started: {str(e)}")
                 return
             else:
-                if attempt < max_retries:
+                if attempt < max_retries and retry_budget_allows(proxy_metrics.decode_retries_denied, endpoint):
                     logger.warning(f"Attempt {attempt} failed for streaming {endpoint}: {str(e)}")
+                    proxy_metrics.decode_retries.inc()
                     await asyncio.sleep(base_delay * (2 ** (attempt - 1)))
                 else:
-                    logger.error(f"All {max_retries} attempts failed for streaming {endpoint}.")
+                    logger.error(f"Giving up on streaming {endpoint} after {attempt} attempts.")
                     raise e
 
 
+def patch_json_body(body: bytes, overrides: dict) -> bytes:
+    """
+    Override top-level fields of a JSON object body without re-encoding the rest of it.
+
+    The overrides are appended as duplicate keys, the JSON parsers behind vLLM's
+    OpenAI server keep the last occurrence of a key.
+    """
+    patch = json.dumps(overrides, separators=(",", ":")).encode("utf-8")[1:-1]
+    if not patch:
+        return body
+    end = body.rindex(b"}")
+    last = end - 1
+    while last >= 0 and body[last] in b" \t\r\n":
+        last -= 1
+    separator = b"" if body[last : last + 1] == b"{" else b","
+    view = memoryview(body)
+    return b"".join((view[:end], separator, patch, view[end:]))
+
+
+def prefill_overrides(req_data: dict) -> dict:
+    overrides = {"stream": False, "max_tokens": 1, "min_tokens": 1}
+    if "max_completion_tokens" in req_data:
+        overrides["max_completion_tokens"] = 1
+    if "stream_options" in req_data:
+        overrides["stream_options"] = None
+    return overrides
+
+
+def build_prefill_body(req_data: dict, req_body: bytes, kv_transfer_params: dict) -> bytes:
+    """Turn the client's request into a prefill-only request for the prefiller."""
+    return patch_json_body(req_body, {**prefill_overrides(req_data), "kv_transfer_params": kv_transfer_params})
+
+
+def split_prefill_body(req_data: dict, req_body: bytes) -> Tuple[bytes, bytes]:
+    """
+    Split the prefill-only request where the kv_transfer_params go, for a prefill
+    whose body is sent before the decoder provided them.
+    """
+    body = patch_json_body(req_body, prefill_overrides(req_data))
+    end = body.rindex(b"}")
+    return body[:end], body[end:]
+
+
+def kv_transfer_params_field(kv_transfer_params: dict) -> bytes:
+    # The head of split_prefill_body always ends with the prefill overrides, hence the comma
+    return b',"kv_transfer_params":' + json.dumps(kv_transfer_params, separators=(",", ":")).encode("utf-8")
+
+
+def decode_stream_chunk(chunk: bytes):
+    """Decode a decoder response chunk into json, return None if it carries no json payload."""
+    try:
+        chunk_str = chunk.decode("utf-8").strip()
+    except UnicodeDecodeError:
+        logger.debug(f"Skipping chunk: {chunk}")
+        return None
+    if chunk_str.startswith("data: "):
+        chunk_str = chunk_str[len("data: ") :]
+    if not chunk_str:
+        return None
+    try:
+        return json.loads(chunk_str)
+    except json.JSONDecodeError:
+        # if chunk is [done], skip it.
+        logger.debug(f"Skipping chunk: {chunk_str}")
+        return None
+
+
 def get_api_request_id(api, req_id):
     if api == "/completions":
         return "cmpl-" + req_id + "-0"
@@ -410,25 +1581,183 @@ def get_origin_request_id(api, req_id):
         return req_id.replace("chatcmpl-", "")
 
 
+async def eager_prefill(prefiller_idx: int, prefiller_score: float, request_id: str, inflight_entry: InflightRequest):
+    """
+    Prefill dispatched on request arrival, concurrently with the decode request.
+
+    The request to the prefiller is opened right away and its body streamed up to
+    the kv_transfer_params, which only the decoder's metaserver callback provides.
+    The callback resolves inflight_entry.kv_transfer_future and returns at once, the
+    end of the body follows from here. Prefiller selection, connection setup and the
+    upload of the prompt thereby overlap with the decoder's scheduling instead of
+    following its callback.
+    """
+    prefiller = proxy_state.prefillers[prefiller_idx]
+    api = inflight_entry.api
+    kv_future = inflight_entry.kv_transfer_future
+    head, tail = split_prefill_body(inflight_entry.req_data, inflight_entry.req_body)
+    handshake_time = None
+
+    async def handshake():
+        nonlocal handshake_time
+        kv_transfer_params = await asyncio.wait_for(asyncio.shield(kv_future), global_args.eager_prefill_timeout)
+        handshake_time = handshake_time or time.perf_counter()
+        return kv_transfer_params
+
+    async def stream_body():
+        yield head
+        yield kv_transfer_params_field(await handshake()) + tail
+
+    proxy_state.record_request_bytes(copied=len(head) + len(tail))
+    try:
+        proxy_state.flush_aborted_requests(prefiller_idx)
+        try:
+            response = await prefiller.client.post(api, content=stream_body(), headers=service_headers(request_id))
+            response.raise_for_status()
+        except (httpx.RequestError, httpx.HTTPStatusError) as e:
+            if global_args.max_retries <= 1 or not retry_budget_allows(proxy_metrics.prefill_retries_denied, api):
+                raise
+            # A streamed body cannot be replayed, the remaining attempts send it whole
+            logger.warning(f"Eager prefill failed for {prefiller.url}: {str(e)}")
+            proxy_metrics.prefill_retries.inc()
+            prefill_body = build_prefill_body(inflight_entry.req_data, inflight_entry.req_body, await handshake())
+            proxy_state.record_request_bytes(copied=len(prefill_body))
+            await send_request_to_service(
+                prefiller.client,
+                prefiller_idx,
+                api,
+                prefill_body,
+                request_id,
+                max_retries=global_args.max_retries - 1,
+                base_delay=global_args.retry_delay,
+            )
+        prefill_latency = time.perf_counter() - handshake_time
+        locality = proxy_state.pairing_locality(prefiller_idx, inflight_entry.decoder_group)
+        proxy_metrics.prefill_latency.labels(locality).observe(prefill_latency)
+        proxy_metrics.eager_prefill_completed.inc()
+        proxy_state.record_prefiller_result(prefiller_idx, prefill_latency)
+    except (httpx.RequestError, httpx.HTTPStatusError) as e:
+        logger.error(f"Eager prefill failed with: {str(e)}")
+        proxy_metrics.eager_prefill_failed.inc()
+        proxy_state.record_prefiller_result(prefiller_idx, failed=True)
+    except asyncio.TimeoutError:
+        logger.error(f"Decoder did not ask for the prefill of {request_id} in {global_args.eager_prefill_timeout}s")
+        proxy_metrics.eager_prefill_abandoned.inc()
+    finally:
+        proxy_state.prefill_tasks.pop(request_id, None)
+        proxy_state.req_to_prefiller.pop(request_id, None)
+        proxy_state.release_prefiller(prefiller_idx, prefiller_score)
+        proxy_state.release_prefiller_kv(prefiller_idx, prefiller_score)
+
+
+def is_complete_response(chunks: List[bytes], media_type: str) -> bool:
+    """Whether a response is whole, the decoder stream may end early once its first chunk was relayed."""
+    if not chunks:
+        return False
+    if media_type == "text/event-stream":
+        return chunks[-1].rstrip().endswith(b"[DONE]")
+    try:
+        return bool(json.loads(b"".join(chunks)).get("choices"))
+    except (ValueError, AttributeError):
+        return False
+
+
+async def record_response(stream, cache_key: str, media_type: str, completed):
+    """Relay a response and store it in the response cache if completed() says it ended normally."""
+    chunks = []
+    size = 0
+    max_entry_bytes = proxy_state.response_cache.config.max_entry_bytes
+    try:
+        async for chunk in stream:
+            if chunks is not None:
+                size += len(chunk)
+                if size > max_entry_bytes:
+                    # Too large to be cached, stop keeping it
+                    chunks = None
+                else:
+                    chunks.append(chunk)
+            yield chunk
+    finally:
+        await stream.aclose()
+    if chunks is not None and completed() and is_complete_response(chunks, media_type):
+        proxy_state.response_cache.put(cache_key, chunks, media_type)
+
+
 async def _handle_completions(api: str, request: Request):
     try:
-        req_data = await request.json()
+        arrival_time = time.perf_counter()
         req_body = await request.body()
+        req_data = json.loads(req_body)
         request_length = len(req_body)
+        response_cache = proxy_state.response_cache
+        cache_key = response_cache.key(api, req_data, request.headers.get("cache-control", ""))
+        if cache_key is not None:
+            cached = response_cache.get(cache_key)
+            if cached is not None:
+                proxy_metrics.response_cache_hits.inc()
+                return Response(content=cached.body, media_type=cached.media_type, headers={"X-Cache": "hit"})
+            proxy_metrics.response_cache_misses.inc()
+        elif response_cache.config.enabled:
+            proxy_metrics.response_cache_bypassed.inc()
         request_id = await proxy_state.next_req_id()
         request_id_api = get_api_request_id(api, request_id)
-        proxy_state.req_data_dict[request_id_api] = (copy.deepcopy(req_data), request_length, api)
-        req_data["kv_transfer_params"] = {
+        prefix_hashes = proxy_state.request_prefix_hashes(req_data)
+        model = req_data.get("model")
+        prompt_tokens = await proxy_state.cost_model.count_prompt_tokens_async(req_data)
+        decoder_score = proxy_state.calculate_decode_scores(
+            prompt_tokens, req_data.get("max_completion_tokens") or req_data.get("max_tokens"), model
+        )
+        logger.debug("Decoder score: %f", decoder_score)
+        priority_class, deadline_seconds = proxy_state.priority_classifier.classify(request.headers)
+        deadline = time.monotonic() + deadline_seconds if deadline_seconds else None
+        # Select decoder, waits for capacity or rejects when every decoder is saturated
+        admit_start = time.perf_counter()
+        try:
+            decoder_idx = await proxy_state.admit_decoder(
+                decoder_score, prefix_hashes, deadline, priority_class.weight
+            )
+        except AdmissionRejected as e:
+            return admission_rejected_response(e)
+        proxy_metrics.admission_wait.labels("decode", priority_class.name).observe(time.perf_counter() - admit_start)
+        decoder = proxy_state.decoders[decoder_idx]
+        # The client's body is kept as received, the decoder and prefiller requests only patch it
+        inflight_entry = InflightRequest(
+            req_data, req_body, api, prompt_tokens, prefix_hashes, priority_class, deadline, decoder.group
+        )
+        eager_prefill_task = None
+        if global_args.eager_prefill:
+            # Pick the prefiller now and start its request alongside the decoder's
+            prefiller_score = proxy_state.calculate_prefill_scores(prompt_tokens, model)
+            admit_start = time.perf_counter()
+            try:
+                prefiller_idx = await proxy_state.admit_prefiller(
+                    prefiller_score, prefix_hashes, deadline, priority_class.weight, decoder.group
+                )
+            except AdmissionRejected as e:
+                proxy_state.release_decoder(decoder_idx, decoder_score)
+                return admission_rejected_response(e)
+            except asyncio.CancelledError:
+                # The client disconnected while the prefill was queued
+                proxy_state.release_decoder(decoder_idx, decoder_score)
+                raise
+            proxy_metrics.admission_wait.labels("prefill", priority_class.name).observe(
+                time.perf_counter() - admit_start
+            )
+            inflight_entry.kv_transfer_future = asyncio.get_running_loop().create_future()
+            eager_prefill_task = asyncio.create_task(
+                eager_prefill(prefiller_idx, prefiller_score, request_id, inflight_entry)
+            )
+            proxy_state.prefill_tasks[request_id] = eager_prefill_task
+            proxy_state.req_to_prefiller[request_id] = prefiller_idx
+        proxy_state.inflight_requests.add(request_id_api, inflight_entry)
+        kv_transfer_params = {
             "do_remote_decode": False,
             "do_remote_prefill": True,
-            "metaserver": f"http://{global_args.host}:{global_args.port}/v1/metaserver",
+            "metaserver": f"http://{global_args.host}:{global_args.metaserver_port}/v1/metaserver",
         }
-        # Select decoder
-        decoder_score = proxy_state.calculate_decode_scores(request_length)
-        logger.debug("Decoder score: %f", decoder_score)
-        # Use the prefiller's kv_transfer_params to select decoder
-        decoder_idx = proxy_state.select_decoder(decoder_score)
-        decoder = proxy_state.decoders[decoder_idx]
+        decode_body = patch_json_body(req_body, {"kv_transfer_params": kv_transfer_params})
+        proxy_state.record_request_bytes(received=request_length, copied=len(decode_body), new_request=True)
+        proxy_state.retry_budget.record_request()
         # logger.debug("Using %s %s", prefiller.url, decoder.url)
         # Stream response from decoder
         released_kv = False
@@ -448,90 +1777,173 @@ async def _handle_completions(api: str, request: Request):
         # refer to vLLM sampling_params: max_token default value
         origin_max_tokens = req_data.get("max_tokens", 16)
 
+        ttft_metric = proxy_metrics.ttft.labels(api, priority_class.name)
+        tpot_metric = proxy_metrics.tpot.labels(api, priority_class.name)
+
+        def release_request():
+            # After streaming done or the client went away, release tokens and the in-flight entry
+            proxy_state.release_decoder(decoder_idx, decoder_score)
+            proxy_state.inflight_requests.pop(request_id_api)
+            if (
+                eager_prefill_task is not None
+                and not eager_prefill_task.done()
+                and not inflight_entry.kv_transfer_future.done()
+            ):
+                # The decoder never asked for the prefill, free the prefiller instead of waiting for the timeout
+                eager_prefill_task.cancel()
+                proxy_metrics.eager_prefill_abandoned.inc()
+
+        # Set once the decoder's response ended normally, only such responses are cached
+        response_complete = False
+
         async def generate_stream():
-            nonlocal released_kv
-            generated_token = ""
+            nonlocal released_kv, response_complete
+            stream_body = decode_body
+            # Event count and first event time only, so timing costs nothing per token
+            event_count = 0
+            first_event_time = 0.0
+            generated_tokens = []
+            # Chunks forwarded untouched since the last decode, parsed in batches or when a recompute shows up
+            pending_chunks = []
             released_kv = False
             retry_count = 0
             retry = True
             completion_tokens = 0
+            stream_failed = False
+
+            def consume_chunk(chunk_json):
+                nonlocal completion_tokens
+                choices = chunk_json.get("choices")
+                if not choices:
+                    return None
+                choice = choices[0]
+                delta = choice.get("delta") or {}
+                message = choice.get("message") or {}
+                generated_tokens.append(delta.get("content") or message.get("content") or choice.get("text") or "")
+                if stream_flag:
+                    completion_tokens += 1
+                else:
+                    completion_tokens += chunk_json.get("usage", {}).get("completion_tokens") or 0
+                return choice
+
+            def fold_pending_chunks():
+                for pending_chunk in pending_chunks:
+                    pending_json = decode_stream_chunk(pending_chunk)
+                    if pending_json is not None:
+                        consume_chunk(pending_json)
+                pending_chunks.clear()
+
             # Only one await per chunk, minimal logic in loop
             try:
                 while retry:
                     retry = False
-                    async for chunk in stream_service_response_with_retry(
-                        decoder.client,
-                        api,
-                        req_data,
-                        request_id=request_id,
-                        max_retries=global_args.max_retries,
-                        base_delay=global_args.retry_delay,
+                    # Re-frame raw reads so that every chunk below is exactly one event
+                    async for chunk in aiter_sse_events(
+                        stream_service_response_with_retry(
+                            decoder.client,
+                            api,
+                            stream_body,
+                            request_id=request_id,
+                            max_retries=global_args.max_retries,
+                            base_delay=global_args.retry_delay,
+                        )
                     ):
-                        try:
-                            chunk_str = chunk.decode("utf-8").strip()
-                        except UnicodeDecodeError:
-                            logger.debug(f"Skipping chunk: {chunk}")
-                            yield chunk
-                            continue
-                        if not chunk_str:
-                            continue
-                        if chunk_str.startswith("data: "):
-                            chunk_str = chunk_str[len("data: ") :]
-                        try:
-                            chunk_json = json.loads(chunk_str)
-                        except json.JSONDecodeError:
-                            # if chunk is [done], skip it.
-                            logger.debug(f"Skipping chunk: {chunk_str}")
+                        if event_count == 0:
+                            first_event_time = time.perf_counter()
+                        event_count += 1
+                        # Fast path: pass the bytes through, a recompute can only come with the marker
+                        if RECOMPUTE_MARKER not in chunk and (stream_flag or retry_count == 0):
+                            pending_chunks.append(chunk)
+                            if len(pending_chunks) >= PENDING_CHUNK_LIMIT:
+                                fold_pending_chunks()
                             yield chunk
                             continue
-                        choices = chunk_json.get("choices", [])
-                        if not choices:
+
+                        fold_pending_chunks()
+                        chunk_json = decode_stream_chunk(chunk)
+                        choice = consume_chunk(chunk_json) if chunk_json is not None else None
+                        if choice is None:
                             yield chunk
                             continue
 
-                        choice = choices[0]
-                        delta = choice.get("delta") or {}
-                        message = choice.get("message") or {}
-                        content = delta.get("content") or message.get("content") or choice.get("text") or ""
-                        generated_token += content
-
-                        stop_reason = choice.get("stop_reason")
-                        usage = chunk_json.get("usage", {})
-                        completion_tokens = (
-                            (completion_tokens + 1)
-                            if stream_flag
-                            else (completion_tokens + usage.get("completion_tokens"))
-                        )
-                        if stop_reason == "recomputed":
+                        if choice.get("stop_reason") == "recomputed":
                             retry = True
                             retry_count += 1
+                            proxy_metrics.recomputes.inc()
+                            generated_token = "".join(generated_tokens)
+                            # Shallow copy, the client's request stays untouched for the in-flight entry
+                            recompute_data = dict(req_data)
                             if chat_flag:
-                                messages[0]["content"] = origin_prompt + generated_token
+                                recompute_data["messages"] = [
+                                    {**messages[0], "content": origin_prompt + generated_token}
+                                ] + messages[1:]
                             else:
-                                req_data["prompt"] = origin_prompt + generated_token
-                            req_data["max_tokens"] = origin_max_tokens - completion_tokens + retry_count
+                                recompute_data["prompt"] = origin_prompt + generated_token
+                            recompute_data["max_tokens"] = origin_max_tokens - completion_tokens + retry_count
+                            recompute_body = json.dumps(recompute_data).encode("utf-8")
+                            stream_body = patch_json_body(recompute_body, {"kv_transfer_params": kv_transfer_params})
+                            proxy_state.record_request_bytes(copied=len(recompute_body) + len(stream_body))
+                            # The decoder calls back into the metaserver again for the recomputed prompt
+                            proxy_state.inflight_requests.add(
+                                request_id_api,
+                                InflightRequest(
+                                    recompute_data,
+                                    recompute_body,
+                                    api,
+                                    prompt_tokens,
+                                    prefix_hashes,
+                                    priority_class,
+                                    deadline,
+                                    decoder.group,
+                                ),
+                            )
                             break
                         if retry_count > 0 and not stream_flag:
+                            generated_token = "".join(generated_tokens)
                             if chat_flag:
                                 choice["message"]["content"] = generated_token
                             else:
                                 choice["text"] = generated_token
                             chunk = json.dumps(chunk_json).encode("utf-8")
                         yield chunk
+            except (asyncio.CancelledError, GeneratorExit):
+                # The client disconnected mid-response, unwinding closed the decoder stream
+                if proxy_state.abort_request(request_id, request_id_api):
+                    proxy_metrics.prefill_aborts.inc()
+                release_request()
+                raise
             except Exception as e:
+                stream_failed = True
                 logger.error(
                     f"Error during streaming from decoder {decoder.url}: {str(e)} "
                     f"the aborted request {request_id} will be routing to the target "
                     "prefiller when new request is ready to dispatch to it"
                 )
 
-            # After streaming done, release tokens
-            proxy_state.release_decoder(decoder_idx, decoder_score)
-
-        if stream_flag:
-            return StreamingResponse(generate_stream(), media_type="text/event-stream")
-        else:
-            return StreamingResponse(generate_stream(), media_type="application/json")
+            # Time per output token is the decoder's own latency, TTFT also contains the prefill
+            tpot = None
+            end_time = time.perf_counter()
+            if stream_flag and event_count:
+                ttft_metric.observe(first_event_time - arrival_time)
+                if event_count > 1:
+                    tpot = (end_time - first_event_time) / (event_count - 1)
+                    tpot_metric.observe(tpot)
+            if event_count:
+                proxy_metrics.request_latency.labels(api, priority_class.name).observe(end_time - arrival_time)
+                # Without streaming the first event is the whole response
+                if deadline_seconds and first_event_time - arrival_time > deadline_seconds:
+                    proxy_metrics.deadline_misses.labels(priority_class.name).inc()
+            proxy_state.record_decoder_result(decoder_idx, tpot, stream_failed)
+            response_complete = event_count > 0 and not stream_failed
+            release_request()
+
+        media_type = "text/event-stream" if stream_flag else "application/json"
+        if cache_key is not None:
+            return StreamingResponse(
+                record_response(generate_stream(), cache_key, media_type, lambda: response_complete),
+                media_type=media_type,
+            )
+        return StreamingResponse(generate_stream(), media_type=media_type)
     except Exception as e:
         import traceback
 
@@ -542,66 +1954,427 @@ async def _handle_completions(api: str, request: Request):
         raise
 
 
+def admission_rejected_response(e: AdmissionRejected) -> JSONResponse:
+    proxy_metrics.admission_rejections.labels(e.reason).inc()
+    return JSONResponse(
+        {"error": {"message": str(e), "type": "overloaded", "code": 429}},
+        status_code=429,
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
+
 @app.post("/v1/completions")
-@with_cancellation
 async def handle_completions(request: Request):
     return await _handle_completions("/completions", request)
 
 
 @app.post("/v1/chat/completions")
-@with_cancellation
 async def handle_chat_completions(request: Request):
     return await _handle_completions("/chat/completions", request)
 
 
 @app.get("/healthcheck")
 async def healthcheck():
-    return {
-        "status": "ok",
+    stats = {
+        "status": "draining" if request_drain.draining else "ok",
         "prefill_instances": len(proxy_state.prefillers),
         "decode_instances": len(proxy_state.decoders),
+        "inflight_requests": proxy_state.inflight_requests.stats(),
+        "request_bytes": proxy_state.request_bytes_stats(),
+        "admission": proxy_state.decoder_admission.stats(),
+        "prefill_admission": proxy_state.prefiller_admission.stats(),
+        "priority_classes": proxy_state.priority_classifier.stats(),
+        "outlier_detection": proxy_state.outlier_stats(),
+        "topology": proxy_state.topology_stats(),
+        "retry": {**proxy_state.retry_budget.stats(), "hedge_delay": proxy_state.prefill_hedge_delay()},
+        "response_cache": proxy_state.response_cache.stats(),
+        "prefill_coalescing": proxy_state.prefill_coalescer.stats(),
+        "drain": request_drain.stats(),
+        "routing": {
+            "prefiller": proxy_state.prefiller_policy.stats(),
+            "decoder": proxy_state.decoder_policy.stats(),
+        },
+    }
+    # Fails readiness probes, so that a draining router leaves its Service
+    return JSONResponse(stats, status_code=503) if request_drain.draining else stats
+
+
+@app.get("/load")
+async def load():
+    """Load summary polled by the global router, see global_router.py."""
+    routable = [server for idx, server in proxy_state.decoders.items() if idx in proxy_state.decoder_heap]
+    return {
+        "requests": sum(server.active_requests + server.remote_requests for server in proxy_state.decoders.values()),
+        "tokens": sum(server.active_tokens + server.remote_tokens for server in proxy_state.decoders.values()),
+        "capacity": sum(server.capacity for server in routable),
+        "queued": proxy_state.decoder_admission.queue_depth + proxy_state.prefiller_admission.queue_depth,
+        "prefillers": len(proxy_state.prefiller_heap),
+        "decoders": len(routable),
+        "draining": request_drain.draining,
+    }
+
+
+@app.get("/metrics")
+async def metrics():
+    return Response(content=proxy_metrics.render(), media_type=CONTENT_TYPE_LATEST)
+
+
+def _admin_backend_request(body):
+    role = body.get("role")
+    host = body.get("host")
+    port = body.get("port")
+    if role not in ("prefill", "decode"):
+        raise ValueError(f"role must be prefill or decode, got: {role}")
+    if not isinstance(host, str) or not host:
+        raise ValueError(f"host must be a non-empty string, got: {host}")
+    if not isinstance(port, int) or isinstance(port, bool) or port <= 0 or port > 65535:
+        raise ValueError(f"port must be a valid positive integer between 1 and 65535, got: {port}")
+    return role, host, port
+
+
+def _admin_backend_capacity(body):
+    capacity = body.get("capacity")
+    if capacity is not None and (not isinstance(capacity, (int, float)) or isinstance(capacity, bool) or capacity <= 0):
+        raise ValueError(f"capacity must be a positive number, got: {capacity}")
+    return capacity
+
+
+@app.get("/admin/backends")
+async def list_backends():
+    if not global_args.enable_admin_api:
+        return JSONResponse({"error": "admin api is disabled"}, status_code=403)
+    return proxy_state.backend_stats()
+
+
+@app.post("/admin/backends")
+async def add_backend(request: Request):
+    if not global_args.enable_admin_api:
+        return JSONResponse({"error": "admin api is disabled"}, status_code=403)
+    try:
+        body = await request.json()
+        role, host, port = _admin_backend_request(body)
+        capacity = _admin_backend_capacity(body)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    idx = proxy_state.add_backend(role, host, port, source="admin", capacity=capacity)
+    return {"role": role, "index": idx, "url": proxy_state.backends(role)[idx].url}
+
+
+@app.post("/admin/backends/drain")
+async def drain_backend(request: Request):
+    if not global_args.enable_admin_api:
+        return JSONResponse({"error": "admin api is disabled"}, status_code=403)
+    try:
+        body = await request.json()
+        role, host, port = _admin_backend_request(body)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    idx = proxy_state.find_backend(role, host, port)
+    if idx is None:
+        return JSONResponse({"error": f"no {role} backend at {host}:{port}"}, status_code=404)
+    if body.get("force"):
+        proxy_state.remove_backend(role, idx)
+    else:
+        proxy_state.drain_backend(role, idx)
+    return {"role": role, "index": idx, "removed": idx not in proxy_state.backends(role)}
+
+
+@app.post("/admin/drain")
+async def drain_router():
+    """Drain the router as on SIGTERM, every worker of it, and report the requests in flight here."""
+    if not global_args.enable_admin_api:
+        return JSONResponse({"error": "admin api is disabled"}, status_code=403)
+    # Workers are drained by the run_workers process, it passes SIGTERM on to them
+    os.kill(os.getppid() if shared_load_table is not None else os.getpid(), signal.SIGTERM)
+    return {
+        "draining": True,
+        "in_flight": request_drain.in_flight,
+        "shutdown_timeout": global_args.shutdown_timeout,
     }
 
 
+async def send_prefill(
+    prefiller_idx: int, request_id: str, inflight_entry: InflightRequest, prefill_body: bytes, prefiller_score: float
+) -> int:
+    """
+    Send a prefill to a prefiller and return the prefiller that completed it.
+
+    A prefill still running after the hedge delay is also sent to a second prefiller
+    with capacity, if the retry budget allows. The first of them to succeed wins and
+    the other one is cancelled, which closes its connection.
+    """
+
+    def send(idx):
+        return asyncio.ensure_future(
+            send_request_to_service(
+                proxy_state.prefillers[idx].client,
+                idx,
+                inflight_entry.api,
+                prefill_body,
+                request_id,
+                max_retries=global_args.max_retries,
+                base_delay=global_args.retry_delay,
+            )
+        )
+
+    primary = send(prefiller_idx)
+    attempts = {primary: prefiller_idx}
+    hedge_idx = None
+    try:
+        hedge_delay = proxy_state.prefill_hedge_delay()
+        if hedge_delay is not None and not (await asyncio.wait((primary,), timeout=hedge_delay))[0]:
+            hedge_idx = proxy_state.try_select_hedge_prefiller(
+                prefiller_score, prefiller_idx, inflight_entry.prefix_hashes, inflight_entry.decoder_group
+            )
+            if hedge_idx is None:
+                proxy_metrics.hedged_prefills.labels("no_prefiller").inc()
+            elif not proxy_state.retry_budget.try_acquire():
+                proxy_state.release_prefiller(hedge_idx, prefiller_score)
+                proxy_state.release_prefiller_kv(hedge_idx, prefiller_score)
+                hedge_idx = None
+                proxy_metrics.hedged_prefills.labels("no_budget").inc()
+            else:
+                logger.debug(f"Hedging prefill {request_id} on {proxy_state.prefillers[hedge_idx].url}")
+                attempts[send(hedge_idx)] = hedge_idx
+        pending = set(attempts)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if hedge_idx is not None:
+                        proxy_metrics.hedged_prefills.labels("lost" if task is primary else "won").inc()
+                    return attempts[task]
+        if hedge_idx is not None:
+            proxy_metrics.hedged_prefills.labels("failed").inc()
+        raise primary.exception()
+    finally:
+        for task, idx in attempts.items():
+            if not task.done():
+                task.cancel()
+                if proxy_state.abort_api and idx in proxy_state.prefillers:
+                    proxy_state.abort_prefiller_request(idx, request_id)
+        if hedge_idx is not None:
+            proxy_state.release_prefiller(hedge_idx, prefiller_score)
+            proxy_state.release_prefiller_kv(hedge_idx, prefiller_score)
+
+
+async def run_prefill(request_id: str, inflight_entry: InflightRequest, prefill_body: bytes, prefiller_score: float):
+    """Prefill asked for by the decoder's metaserver callback, a task that an abort of the request cancels."""
+    prefiller_idx = None
+    # A follower's prompt is computed from the prefix cache, but its whole KV cache is held and sent
+    prefiller_kv = prefiller_score
+    prefill_start = None
+    completed_idx = None
+    coalescer = proxy_state.prefill_coalescer
+    flight_key = None
+    coalesced = False
+    try:
+        if coalescer.enabled:
+            flight_key = coalescer.key(inflight_entry.api, inflight_entry.req_data)
+            flight = coalescer.join(flight_key)
+            if flight is not None:
+                # An identical prompt is being prefilled, follow it to its prefiller
+                flight_key = None
+                # Prefill costs are milliseconds once the cost model is calibrated, see cost_model.calibrate
+                leader_idx = await coalescer.follow(flight, prefiller_score / 1000)
+                cached_score = proxy_state.calculate_prefill_scores(1, inflight_entry.req_data.get("model"))
+                # A prefiller at capacity is left to the admission queue like any other prefill
+                coalesced = leader_idx is not None and proxy_state.pin_prefiller(
+                    leader_idx, cached_score, prefiller_kv
+                )
+                coalescer.record(coalesced, inflight_entry.prompt_tokens)
+                if coalesced:
+                    proxy_metrics.coalesced_prefills.inc()
+                    proxy_metrics.coalesced_prompt_tokens.inc(inflight_entry.prompt_tokens)
+                    prefiller_idx, prefiller_score = leader_idx, cached_score
+        if prefiller_idx is None:
+            # Select prefiller, waits for capacity in deadline or size order with --scheduling-policy
+            priority_class = inflight_entry.priority_class or proxy_state.priority_classifier.default_class
+            admit_start = time.perf_counter()
+            try:
+                prefiller_idx = await proxy_state.admit_prefiller(
+                    prefiller_score,
+                    inflight_entry.prefix_hashes,
+                    inflight_entry.deadline,
+                    priority_class.weight,
+                    inflight_entry.decoder_group,
+                )
+            except AdmissionRejected as e:
+                # The decoder gives up on the KV cache and fails the request
+                proxy_metrics.admission_rejections.labels(e.reason).inc()
+                logger.warning(f"Prefill of request {request_id} rejected: {e}")
+                return
+            proxy_metrics.admission_wait.labels("prefill", priority_class.name).observe(
+                time.perf_counter() - admit_start
+            )
+        proxy_state.req_to_prefiller[request_id] = prefiller_idx
+        prefiller = proxy_state.prefillers[prefiller_idx]
+        logger.debug(f"Using prefill {prefiller.url=} {request_id=} {coalesced=}")
+        # Send request to prefiller
+        prefill_start = time.perf_counter()
+        completed_idx = await send_prefill(prefiller_idx, request_id, inflight_entry, prefill_body, prefiller_score)
+        prefill_latency = time.perf_counter() - prefill_start
+        if not coalesced:
+            # Prefills served from the prefix cache would pull the hedge delay down
+            proxy_state.prefill_latencies.observe(prefill_latency)
+        locality = proxy_state.pairing_locality(completed_idx, inflight_entry.decoder_group)
+        proxy_metrics.prefill_latency.labels(locality).observe(prefill_latency)
+        proxy_state.record_prefiller_result(completed_idx, prefill_latency)
+    except Exception as e:
+        logger.error(f"Post metaserver failed with: {str(e)}")
+        if prefill_start is not None:
+            proxy_state.record_prefiller_result(prefiller_idx, failed=True)
+    finally:
+        if flight_key is not None:
+            coalescer.land(flight_key, completed_idx)
+        proxy_state.prefill_tasks.pop(request_id, None)
+        proxy_state.req_to_prefiller.pop(request_id, None)
+        if prefiller_idx is not None:
+            proxy_state.release_prefiller(prefiller_idx, prefiller_score)
+            proxy_state.release_prefiller_kv(prefiller_idx, prefiller_kv)
+
+
 @app.post("/v1/metaserver")
 async def metaserver(request: Request):
     try:
         kv_transfer_params = await request.json()
 
         request_id = kv_transfer_params["request_id"]
-        assert request_id in proxy_state.req_data_dict
-        req_data, request_length, api = proxy_state.req_data_dict[request_id]
-        request_id = get_origin_request_id(api, request_id)
-        req_data["kv_transfer_params"] = kv_transfer_params
-        prefiller_score = proxy_state.calculate_prefill_scores(request_length)
-        logger.debug(f"Request length: {request_length}, Prefiller score: {prefiller_score}")
-
-        # Select prefiller
-        prefiller_idx = proxy_state.select_prefiller(prefiller_score)
-        prefiller = proxy_state.prefillers[prefiller_idx]
-        logger.debug(f"Using prefill {prefiller.url=} {req_data=}")
-        # Send request to prefiller
-        await send_request_to_service(
-            prefiller.client,
-            prefiller_idx,
-            api,
-            req_data,
-            request_id,
-            max_retries=global_args.max_retries,
-            base_delay=global_args.retry_delay,
+        inflight_entry = proxy_state.inflight_requests.pop(request_id)
+        if inflight_entry is None:
+            logger.warning(f"Request {request_id} is no longer in flight, skip prefill")
+            return
+        if inflight_entry.kv_transfer_future is not None:
+            # The prefill was dispatched on arrival and only waits for these parameters
+            if not inflight_entry.kv_transfer_future.done():
+                inflight_entry.kv_transfer_future.set_result(kv_transfer_params)
+            return
+        request_id = get_origin_request_id(inflight_entry.api, request_id)
+        prefill_body = build_prefill_body(inflight_entry.req_data, inflight_entry.req_body, kv_transfer_params)
+        proxy_state.record_request_bytes(copied=len(prefill_body))
+        prefiller_score = proxy_state.calculate_prefill_scores(
+            inflight_entry.prompt_tokens, inflight_entry.req_data.get("model")
         )
-        proxy_state.release_prefiller(prefiller_idx, prefiller_score)
-        proxy_state.release_prefiller_kv(prefiller_idx, prefiller_score)
+        logger.debug(f"Prompt tokens: {inflight_entry.prompt_tokens}, Prefiller score: {prefiller_score}")
+        prefill_task = asyncio.create_task(run_prefill(request_id, inflight_entry, prefill_body, prefiller_score))
+        proxy_state.prefill_tasks[request_id] = prefill_task
+        # Answer the decoder once the prefill is done, or cancelled by an abort
+        await asyncio.wait((prefill_task,))
 
     except Exception as e:
         logger.error(f"Post metaserver failed with: {str(e)}")
-        proxy_state.release_prefiller(prefiller_idx, prefiller_score)
-        proxy_state.release_prefiller_kv(prefiller_idx, prefiller_score)
+
+
+def _bind_socket(host: str, port: int, reuse_port: bool) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.set_inheritable(True)
+    return sock
+
+
+def _bind_metaserver_socket(worker_id: int) -> socket.socket:
+    """
+    Bind the metaserver port of a worker and set global_args.metaserver_port to it.
+
+    While a router that is draining still holds the port, its decoders calling back
+    for requests in flight there, the worker takes the same port of a second range
+    following the first one instead, and the next router takes the first range again.
+    """
+    ports = [global_args.worker_port_base + worker_id]
+    ports.append(ports[0] + global_args.workers)
+    for port in ports:
+        try:
+            sock = _bind_socket(global_args.host, port, reuse_port=False)
+        except OSError as e:
+            if e.errno != errno.EADDRINUSE or port == ports[-1]:
+                raise
+            logger.warning(f"Metaserver port {port} of worker {worker_id} is in use, taking {ports[-1]}")
+            continue
+        global_args.metaserver_port = port
+        return sock
+
+
+def _run_worker(worker_id: int, shared_socket: Optional[socket.socket]):
+    import uvicorn
+
+    # Forked from run_workers, drop its signal handlers so that uvicorn installs its own
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    global_args.worker_id = worker_id
+    shared_load_table.reset_worker(worker_id)
+    # Every worker binds the public port with SO_REUSEPORT so the kernel spreads
+    # connections over them, and a private port that only its own metaserver
+    # callbacks use, because the in-flight requests live in this process. When
+    # draining, the worker stops listening on the public port only, a new router
+    # bound to it takes every new connection while the callbacks still come here.
+    if shared_socket is None:
+        shared_socket = _bind_socket(global_args.host, global_args.port, reuse_port=True)
+    private_socket = _bind_metaserver_socket(worker_id)
+    server = DrainingServer(
+        uvicorn.Config(app, host=global_args.host, port=global_args.port),
+        request_drain,
+        global_args.shutdown_timeout,
+        public_sockets=[shared_socket],
+    )
+    server.run(sockets=[shared_socket, private_socket])
+
+
+def run_workers():
+    """Run global_args.workers proxy processes that share backend load through shared memory."""
+    global shared_load_table
+    context = multiprocessing.get_context("fork")
+    shared_load_table = SharedLoadTable(global_args.workers, global_args.load_table_capacity, lock=context.Lock())
+    # Without SO_REUSEPORT all workers accept from one inherited socket instead
+    shared_socket = None
+    if not hasattr(socket, "SO_REUSEPORT"):
+        shared_socket = _bind_socket(global_args.host, global_args.port, reuse_port=False)
+    workers = {}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for process in workers.values():
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    try:
+        for worker_id in range(global_args.workers):
+            workers[worker_id] = context.Process(target=_run_worker, args=(worker_id, shared_socket))
+            workers[worker_id].start()
+        while workers:
+            multiprocessing.connection.wait([process.sentinel for process in workers.values()])
+            for worker_id, process in list(workers.items()):
+                if process.is_alive():
+                    continue
+                process.join()
+                if stopping:
+                    del workers[worker_id]
+                    continue
+                # The requests of a dead worker are gone with it, its replacement starts from zero load
+                logger.error(f"Proxy worker {worker_id} exited with code {process.exitcode}, restarting it")
+                time.sleep(1)
+                workers[worker_id] = context.Process(target=_run_worker, args=(worker_id, shared_socket))
+                workers[worker_id].start()
+    finally:
+        shared_load_table.close()
 
 
 if __name__ == "__main__":
     global global_args
     global_args = parse_args()
-    import uvicorn
-
-    uvicorn.run(app, host=global_args.host, port=global_args.port)
+    if global_args.workers > 1 or global_args.reuse_port:
+        run_workers()
+    else:
+        import uvicorn
+
+        # Decoders call back on the listening port, it stays open while the requests drain
+        config = uvicorn.Config(app, host=global_args.host, port=global_args.port)
+        server = DrainingServer(config, request_drain, global_args.shutdown_timeout)
+        server.run()
@@ -0,0 +1,247 @@
+from dataclasses import dataclass, fields
+import time
+from typing import Any, Dict, List, Mapping, Optional
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+# Exported as the proxy_backend_circuit_state gauge
+STATE_CODES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+@dataclass
+class OutlierDetectionConfig:
+    """
+    Passive outlier detection settings of one backend role.
+
+    A closed backend is ejected (opened) after consecutive_failures failures in a
+    row, or by the periodic sweep once its EWMA latency exceeds latency_factor times
+    the median of its peers (and min_outlier_latency), or its EWMA error rate exceeds
+    error_rate_threshold. Ejection lasts base_ejection_time, doubled on every repeated
+    ejection up to max_ejection_time. A half-open backend takes one probe request at
+    a time more for each successful one, and closes after half_open_successes.
+    Detection is opt-in, it only runs once enabled is set.
+    """
+
+    enabled: bool = False
+    interval: float = 1.0
+    alpha: float = 0.2
+    min_samples: int = 10
+    latency_factor: float = 3.0
+    min_outlier_latency: float = 0.5
+    error_rate_threshold: float = 0.5
+    consecutive_failures: int = 5
+    base_ejection_time: float = 10.0
+    max_ejection_time: float = 300.0
+    max_ejection_ratio: float = 0.5
+    half_open_successes: int = 5
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> 'OutlierDetectionConfig':
+        values = {}
+        known = {f.name for f in fields(cls)}
+        for key, value in (data or {}).items():
+            if key not in known:
+                raise ValueError(f"Unknown outlier detection option '{key}', expected one of {sorted(known)}")
+            if key == "enabled":
+                if not isinstance(value, bool):
+                    raise TypeError(f"Outlier detection option 'enabled' must be a bool, got {type(value).__name__}")
+            elif not isinstance(value, (int, float)) or isinstance(value, bool) or value < 0:
+                raise ValueError(f"Outlier detection option '{key}' must be a non-negative number, got: {value}")
+            values[key] = value
+        config = cls(**values)
+        if not 0 < config.alpha <= 1:
+            raise ValueError(f"Outlier detection alpha must be in (0, 1], got: {config.alpha}")
+        if config.interval <= 0:
+            raise ValueError(f"Outlier detection interval must be positive, got: {config.interval}")
+        return config
+
+
+class BackendHealth:
+    """Circuit breaker state and EWMA statistics of one backend."""
+
+    __slots__ = (
+        "state",
+        "ewma_latency",
+        "ewma_error",
+        "samples",
+        "latency_samples",
+        "consecutive_failures",
+        "ejections",
+        "open_until",
+        "closed_at",
+        "probe_limit",
+        "probe_successes",
+    )
+
+    def __init__(self):
+        self.state = CLOSED
+        self.ewma_latency = 0.0
+        self.ewma_error = 0.0
+        self.samples = 0
+        self.latency_samples = 0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.open_until = 0.0
+        self.closed_at = 0.0
+        self.probe_limit = 0
+        self.probe_successes = 0
+
+    def routable(self, active_requests: int) -> bool:
+        """Whether the backend belongs in the selection heap with active_requests in flight."""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            return False
+        return active_requests < self.probe_limit
+
+    def _reset_stats(self):
+        self.ewma_latency = 0.0
+        self.ewma_error = 0.0
+        self.samples = 0
+        self.latency_samples = 0
+        self.consecutive_failures = 0
+
+
+class OutlierDetector:
+    """
+    Passive outlier detection and circuit breaking for the backends of one role.
+
+    Requests only update two EWMAs of the backend they used; comparing backends
+    against each other and re-admitting ejected ones happens in sweep(), which the
+    proxy runs every config.interval seconds. The proxy keeps non-routable backends
+    out of its selection heap, so selection itself never looks at health state.
+    """
+
+    def __init__(self, config: Optional[OutlierDetectionConfig] = None):
+        self.config = config or OutlierDetectionConfig()
+        self.latency_limit = 0.0
+        self.ejected = 0
+        self.ejections_total = 0
+
+    def record_success(self, health: BackendHealth, latency: Optional[float] = None) -> bool:
+        """Record a successful request, return True when the backend's routability changed."""
+        config = self.config
+        health.samples += 1
+        health.consecutive_failures = 0
+        health.ewma_error -= config.alpha * health.ewma_error
+        if latency is not None:
+            if health.latency_samples:
+                health.ewma_latency += config.alpha * (latency - health.ewma_latency)
+            else:
+                health.ewma_latency = latency
+            health.latency_samples += 1
+        if health.state != HALF_OPEN:
+            return False
+        if latency is not None and self.latency_limit and latency > self.latency_limit:
+            self._eject(health, time.monotonic())
+            return True
+        health.probe_successes += 1
+        if health.probe_successes >= config.half_open_successes:
+            health.state = CLOSED
+            health.closed_at = time.monotonic()
+            self.ejected -= 1
+        else:
+            # Slow start: one more concurrent probe for every successful one
+            health.probe_limit += 1
+        return True
+
+    def record_failure(self, health: BackendHealth, backend_count: int) -> bool:
+        """Record a failed request, return True when the backend's routability changed."""
+        config = self.config
+        health.samples += 1
+        health.consecutive_failures += 1
+        health.ewma_error += config.alpha * (1.0 - health.ewma_error)
+        if health.state == HALF_OPEN:
+            self._eject(health, time.monotonic())
+            return True
+        if (
+            health.state == CLOSED
+            and health.consecutive_failures >= config.consecutive_failures
+            and self._can_eject(backend_count)
+        ):
+            self._eject(health, time.monotonic())
+            self.ejected += 1
+            return True
+        return False
+
+    def sweep(self, healths: Mapping[int, BackendHealth], now: Optional[float] = None) -> List[int]:
+        """Re-admit backends whose ejection expired and eject outliers, return the changed server indices."""
+        config = self.config
+        now = time.monotonic() if now is None else now
+        changed = []
+        latencies = []
+        for idx, health in healths.items():
+            if health.state == OPEN and now >= health.open_until:
+                health.state = HALF_OPEN
+                health.probe_limit = 1
+                health.probe_successes = 0
+                health._reset_stats()
+                changed.append(idx)
+            elif health.state == CLOSED and health.latency_samples >= config.min_samples:
+                latencies.append(health.ewma_latency)
+
+        # Without enough closed peers the previous limit still applies to half-open probes
+        if len(latencies) >= 2:
+            latencies.sort()
+            # Lower median, so that with two backends the slow one is compared against the fast one
+            median = latencies[(len(latencies) - 1) // 2]
+            self.latency_limit = max(median * config.latency_factor, config.min_outlier_latency)
+
+        outliers = []
+        for idx, health in healths.items():
+            if health.state != CLOSED or health.samples < config.min_samples:
+                continue
+            if health.ewma_error > config.error_rate_threshold:
+                outliers.append((health.ewma_error + 1.0, idx))
+            elif (
+                self.latency_limit
+                and health.latency_samples >= config.min_samples
+                and health.ewma_latency > self.latency_limit
+            ):
+                outliers.append((health.ewma_latency / self.latency_limit, idx))
+        # Worst first, the ejection ratio may not allow ejecting all of them
+        for _, idx in sorted(outliers, reverse=True):
+            if not self._can_eject(len(healths)):
+                break
+            self._eject(healths[idx], now)
+            self.ejected += 1
+            changed.append(idx)
+        return changed
+
+    def forget(self, health: BackendHealth):
+        """Stop counting a backend that left the pool."""
+        if health.state != CLOSED:
+            self.ejected -= 1
+
+    def _can_eject(self, backend_count: int) -> bool:
+        return self.ejected + 1 <= self.config.max_ejection_ratio * backend_count
+
+    def _eject(self, health: BackendHealth, now: float):
+        config = self.config
+        if health.state == CLOSED and now - health.closed_at > config.max_ejection_time:
+            # Healthy for longer than the longest ejection, forget earlier ejections
+            health.ejections = 0
+        health.ejections += 1
+        health.state = OPEN
+        health.open_until = now + min(
+            config.base_ejection_time * 2 ** (health.ejections - 1), config.max_ejection_time
+        )
+        self.ejections_total += 1
+
+    def stats(self, healths: Mapping[str, BackendHealth]) -> Dict[str, Any]:
+        return {
+            "enabled": self.config.enabled,
+            "latency_limit": self.latency_limit,
+            "ejected": self.ejected,
+            "ejections_total": self.ejections_total,
+            "backends": {
+                url: {
+                    "state": health.state,
+                    "ewma_latency": health.ewma_latency,
+                    "ewma_error": health.ewma_error,
+                }
+                for url, health in healths.items()
+                if health.state != CLOSED or health.samples
+            },
+        }
@@ -0,0 +1,81 @@
+import asyncio
+import hashlib
+from typing import Dict, Optional
+
+from routing_policy import request_prefix_text
+
+
+class PrefillCoalescer:
+    """
+    Single-flight prefills of identical prompts.
+
+    The first prefill of a prompt leads its flight. Prefills of the same prompt
+    (and model) asked for while it runs follow it: they wait until it lands and are
+    then sent to the leader's prefiller, whose prefix cache holds the prompt by then,
+    so only its last token is computed again. Every follower still sends its own
+    prefill request with its own decoder's kv_transfer_params, since the prefiller
+    pushes the KV cache to the decoder named in them. A follower whose leader failed,
+    or did not land within the prompt's expected prefill time plus max_wait seconds,
+    is prefilled on its own.
+
+    coalesced_prompt_tokens counts the prompt tokens of the followers, an upper bound
+    of the tokens not prefilled again: whether a follower actually hit the prefix
+    cache is up to the prefiller.
+    """
+
+    def __init__(self, enabled: bool = False, max_wait: float = 5.0):
+        self.enabled = enabled
+        self.max_wait = max_wait
+        # Prompt key -> future of the leader, resolved with its prefiller or None
+        self._flights: Dict[str, asyncio.Future] = {}
+        self.prefills = 0
+        self.coalesced = 0
+        self.coalesced_prompt_tokens = 0
+        self.fallbacks = 0
+
+    @staticmethod
+    def key(api: str, req_data: dict) -> str:
+        text = f"{api}\n{req_data.get('model', '')}\n{request_prefix_text(req_data)}"
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def join(self, key: str) -> Optional[asyncio.Future]:
+        """Return the flight of an identical prefill in progress, or lead a new one and return None."""
+        self.prefills += 1
+        flight = self._flights.get(key)
+        if flight is None:
+            self._flights[key] = asyncio.get_running_loop().create_future()
+        return flight
+
+    def land(self, key: str, prefiller_idx: Optional[int]):
+        """End a flight the caller leads, its followers go to prefiller_idx, or on their own with None."""
+        flight = self._flights.pop(key, None)
+        if flight is not None and not flight.done():
+            flight.set_result(prefiller_idx)
+
+    async def follow(self, flight: asyncio.Future, expected_prefill: float = 0.0) -> Optional[int]:
+        """
+        Wait for the leader of a flight at most expected_prefill + max_wait seconds, return
+        its prefiller or None if it did not land in time.
+        """
+        try:
+            return await asyncio.wait_for(asyncio.shield(flight), expected_prefill + self.max_wait)
+        except asyncio.TimeoutError:
+            return None
+
+    def record(self, coalesced: bool, prompt_tokens: int = 0):
+        if coalesced:
+            self.coalesced += 1
+            self.coalesced_prompt_tokens += prompt_tokens
+        else:
+            self.fallbacks += 1
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "in_flight": len(self._flights),
+            "prefills": self.prefills,
+            "coalesced": self.coalesced,
+            "coalescing_rate": self.coalesced / self.prefills if self.prefills else 0.0,
+            "coalesced_prompt_tokens": self.coalesced_prompt_tokens,
+            "fallbacks": self.fallbacks,
+        }
@@ -0,0 +1,106 @@
+from dataclasses import dataclass
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+DEFAULT_CLASS = "default"
+
+
+@dataclass
+class PriorityClass:
+    """
+    Scheduling class of a request.
+
+    deadline is the class's time to first token objective in seconds, 0 means none.
+    It orders the admission queues under edf and counts deadline misses. weight
+    scales the request's size under sjf, below 1 favours the class.
+    """
+
+    name: str
+    deadline: float = 0.0
+    weight: float = 1.0
+
+
+class PriorityClassifier:
+    """
+    Assigns requests to priority classes.
+
+    A request's API key (Authorization: Bearer <key>) mapped in api_keys decides
+    its class, so that clients cannot promote themselves; other requests may pick a
+    class with the class header, and fall back to the default class. The deadline
+    header overrides the class deadline with a number of seconds from arrival.
+    """
+
+    def __init__(
+        self,
+        classes: Optional[Mapping[str, PriorityClass]] = None,
+        default_class: str = DEFAULT_CLASS,
+        api_keys: Optional[Mapping[str, str]] = None,
+        class_header: str = "x-priority-class",
+        deadline_header: str = "x-request-deadline",
+    ):
+        self.classes: Dict[str, PriorityClass] = dict(classes or {})
+        self.classes.setdefault(default_class, PriorityClass(default_class))
+        self.default_class = self.classes[default_class]
+        self.api_keys = dict(api_keys or {})
+        for name in self.api_keys.values():
+            if name not in self.classes:
+                raise ValueError(f"API key mapped to unknown priority class '{name}'")
+        self.class_header = class_header.lower()
+        self.deadline_header = deadline_header.lower()
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict[str, Any]]) -> 'PriorityClassifier':
+        """
+        Build from {"classes": {name: {"deadline": s, "weight": w}}, "default": name,
+        "api_keys": {key: name}, "class_header": h, "deadline_header": h}.
+        """
+        config = dict(config or {})
+        known = {"classes", "default", "api_keys", "class_header", "deadline_header"}
+        unknown = set(config) - known
+        if unknown:
+            raise ValueError(f"Unknown priority class options {sorted(unknown)}, expected some of {sorted(known)}")
+        classes = {}
+        for name, options in (config.get("classes") or {}).items():
+            if not isinstance(options, dict):
+                raise TypeError(f"Priority class '{name}' must be a JSON object, got {type(options).__name__}")
+            for key, value in options.items():
+                if key not in ("deadline", "weight"):
+                    raise ValueError(f"Unknown option '{key}' of priority class '{name}', expected deadline or weight")
+                if not isinstance(value, (int, float)) or isinstance(value, bool) or value < 0:
+                    raise ValueError(f"Priority class '{name}' {key} must be a non-negative number, got: {value}")
+            classes[name] = PriorityClass(name, **options)
+        default_class = config.get("default", DEFAULT_CLASS)
+        if classes and default_class not in classes:
+            raise ValueError(f"Default priority class '{default_class}' is not one of {sorted(classes)}")
+        return cls(
+            classes,
+            default_class,
+            config.get("api_keys"),
+            config.get("class_header", "x-priority-class"),
+            config.get("deadline_header", "x-request-deadline"),
+        )
+
+    def classify(self, headers: Mapping[str, str]) -> Tuple[PriorityClass, float]:
+        """Return the request's class and its deadline in seconds from arrival, 0 for none."""
+        priority_class = None
+        if self.api_keys:
+            authorization = headers.get("authorization", "")
+            if authorization.startswith("Bearer "):
+                name = self.api_keys.get(authorization[len("Bearer ") :])
+                if name is not None:
+                    priority_class = self.classes[name]
+        if priority_class is None:
+            priority_class = self.classes.get(headers.get(self.class_header, ""), self.default_class)
+        deadline = priority_class.deadline
+        requested = headers.get(self.deadline_header)
+        if requested:
+            try:
+                requested_deadline = float(requested)
+            except ValueError:
+                requested_deadline = -1.0
+            # Also false for nan
+            if 0.0 <= requested_deadline < float("inf"):
+                deadline = requested_deadline
+        return priority_class, deadline
+
+    def stats(self) -> Dict[str, Any]:
+        return {name: {"deadline": c.deadline, "weight": c.weight} for name, c in self.classes.items()}
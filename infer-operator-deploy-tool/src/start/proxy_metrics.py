@@ -0,0 +1,258 @@
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TPOT_BUCKETS = (0.005, 0.01, 0.02, 0.03, 0.04, 0.05, 0.075, 0.1, 0.15, 0.2, 0.3, 0.5, 1.0)
+SELECTION_BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 1e-3, 1e-2)
+
+
+def _format_labels(labelnames: Sequence[str], labelvalues: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+
+class Histogram:
+    """Fixed-bucket histogram; observe only bumps preallocated integers."""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricFamily:
+    def __init__(self, name: str, documentation: str, metric_type: str, labelnames: Sequence[str] = (),
+                 buckets: Optional[Sequence[float]] = None):
+        self.name = name
+        self.documentation = documentation
+        self.metric_type = metric_type
+        self.labelnames = tuple(labelnames)
+        self.buckets = buckets
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    def labels(self, *labelvalues: str):
+        """Return the child series for the label values; keep it around on hot paths."""
+        child = self._children.get(labelvalues)
+        if child is None:
+            if len(labelvalues) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {labelvalues}")
+            child = Histogram(self.buckets) if self.metric_type == "histogram" else Counter()
+            self._children[labelvalues] = child
+        return child
+
+    def render(self, lines: List[str]):
+        for labelvalues, child in self._children.items():
+            if self.metric_type == "histogram":
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+                    cumulative += count
+                    le = _format_labels(self.labelnames, labelvalues, f'le="{_format_value(bound)}"')
+                    lines.append(f"{self.name}_bucket{le} {cumulative}")
+                labels = _format_labels(self.labelnames, labelvalues)
+                lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+                lines.append(f"{self.name}_count{labels} {child.count}")
+            else:
+                lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(child.value)}")
+
+
+class GaugeCallback:
+    """Gauge whose samples are read from live state at scrape time, so nothing is updated per request."""
+
+    metric_type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str],
+                 callback: Callable[[], Iterable[Tuple[Sequence[str], float]]]):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+
+    def render(self, lines: List[str]):
+        for labelvalues, value in self.callback():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}")
+
+
+class MetricsRegistry:
+    """Minimal Prometheus text exposition, the proxy does not depend on prometheus_client."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> MetricFamily:
+        return self._register(MetricFamily(name, documentation, "counter", labelnames))
+
+    def histogram(self, name: str, documentation: str, buckets: Sequence[float],
+                  labelnames: Sequence[str] = ()) -> MetricFamily:
+        return self._register(MetricFamily(name, documentation, "histogram", labelnames, buckets))
+
+    def gauge_callback(self, name: str, documentation: str, labelnames: Sequence[str],
+                       callback: Callable[[], Iterable[Tuple[Sequence[str], float]]]) -> GaugeCallback:
+        return self._register(GaugeCallback(name, documentation, labelnames, callback))
+
+    def _register(self, metric):
+        if any(m.name == metric.name for m in self._metrics):
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.metric_type}")
+            metric.render(lines)
+        lines.append("")
+        return "\n".join(lines)
+
+
+class ProxyMetrics:
+    """Series exported by the PD proxy on /metrics."""
+
+    def __init__(self):
+        self.registry = MetricsRegistry()
+        self._backend_collectors = []
+        self._queue_collectors = []
+        registry = self.registry
+        registry.gauge_callback(
+            "proxy_backend_active_requests", "Requests currently routed to a backend", ("role", "backend"),
+            lambda: self._collect_backends("active_requests"),
+        )
+        registry.gauge_callback(
+            "proxy_backend_active_tokens", "Scheduled token load currently on a backend", ("role", "backend"),
+            lambda: self._collect_backends("active_tokens"),
+        )
+        registry.gauge_callback(
+            "proxy_backend_circuit_state", "Circuit breaker state of a backend: 0 closed, 1 half-open, 2 open",
+            ("role", "backend"), lambda: self._collect_backends("circuit_state"),
+        )
+        registry.gauge_callback(
+            "proxy_admission_queue_depth", "Requests waiting for backend capacity", ("role",),
+            lambda: self._collect_queues(),
+        )
+        self.admission_rejections = registry.counter(
+            "proxy_admission_rejections_total", "Requests rejected with 429", ("reason",)
+        )
+        self.admission_wait = registry.histogram(
+            "proxy_admission_wait_seconds", "Time a request waited in an admission queue before it got a backend",
+            LATENCY_BUCKETS, ("role", "priority_class"),
+        )
+        self.deadline_misses = registry.counter(
+            "proxy_deadline_misses_total", "Requests whose first token came after their deadline",
+            ("priority_class",),
+        )
+        self.ttft = registry.histogram(
+            "proxy_time_to_first_token_seconds", "Time from request arrival to the first streamed event",
+            LATENCY_BUCKETS, ("api", "priority_class"),
+        )
+        self.tpot = registry.histogram(
+            "proxy_time_per_output_token_seconds", "Mean time between streamed events after the first one",
+            TPOT_BUCKETS, ("api", "priority_class"),
+        )
+        self.request_latency = registry.histogram(
+            "proxy_request_duration_seconds", "Time from request arrival to the end of the response",
+            LATENCY_BUCKETS, ("api", "priority_class"),
+        )
+        self.prefill_latency = registry.histogram(
+            "proxy_prefill_latency_seconds",
+            "Prefill round trip from the decoder's /v1/metaserver callback to the prefiller's response, "
+            "by topology group of the prefiller relative to the decoder",
+            LATENCY_BUCKETS, ("locality",),
+        )
+        self.retries = registry.counter("proxy_retries_total", "Retried upstream requests", ("role",))
+        self.retries_denied = registry.counter(
+            "proxy_retries_denied_total", "Retries not made because the retry budget was exhausted", ("role",)
+        )
+        self.hedged_prefills = registry.counter(
+            "proxy_hedged_prefills_total",
+            "Prefills running past the hedge delay, by outcome: the hedge won, lost or failed too, "
+            "or was not sent for lack of a prefiller or retry budget",
+            ("outcome",),
+        )
+        self.response_cache_requests = registry.counter(
+            "proxy_response_cache_requests_total",
+            "Requests looked up in the response cache by result, bypass for those sampling with randomness",
+            ("result",),
+        )
+        self.coalesced_prefills = registry.counter(
+            "proxy_coalesced_prefills_total", "Prefills that followed an identical one to its prefiller's prefix cache"
+        ).labels()
+        self.coalesced_prompt_tokens = registry.counter(
+            "proxy_coalesced_prompt_tokens_total",
+            "Prompt tokens of coalesced prefills, an upper bound of the tokens not computed again",
+        ).labels()
+        self.recomputes = registry.counter("proxy_recomputes_total", "Decoder recomputes handled by the proxy").labels()
+        self.eager_prefills = registry.counter(
+            "proxy_eager_prefills_total", "Prefills dispatched on request arrival, by outcome", ("outcome",)
+        )
+        self.client_aborts = registry.counter(
+            "proxy_client_aborts_total", "Requests whose client disconnected before the response ended, by stage",
+            ("stage",),
+        )
+        self.prefill_aborts = registry.counter(
+            "proxy_prefill_aborts_total", "Prefills cancelled because their client disconnected"
+        ).labels()
+        self.prefiller_abort_ids = registry.counter(
+            "proxy_prefiller_abort_ids_total", "Aborted request ids sent to prefiller abort endpoints, by outcome",
+            ("outcome",),
+        )
+        self.selection_latency = registry.histogram(
+            "proxy_selection_latency_seconds", "Time spent picking a backend", SELECTION_BUCKETS, ("role",),
+        )
+        # children bound once so hot paths do not look up labels
+        self.prefill_retries = self.retries.labels("prefill")
+        self.decode_retries = self.retries.labels("decode")
+        self.prefill_retries_denied = self.retries_denied.labels("prefill")
+        self.response_cache_hits = self.response_cache_requests.labels("hit")
+        self.response_cache_misses = self.response_cache_requests.labels("miss")
+        self.response_cache_bypassed = self.response_cache_requests.labels("bypass")
+        self.decode_retries_denied = self.retries_denied.labels("decode")
+        self.prefiller_selection = self.selection_latency.labels("prefill")
+        self.decoder_selection = self.selection_latency.labels("decode")
+        self.eager_prefill_completed = self.eager_prefills.labels("completed")
+        self.eager_prefill_failed = self.eager_prefills.labels("failed")
+        self.eager_prefill_abandoned = self.eager_prefills.labels("abandoned")
+
+    def add_backend_collector(self, collector: Callable[[], Iterable[Tuple[str, str, object]]]):
+        """Register a callable yielding (role, backend url, server state) at scrape time."""
+        self._backend_collectors.append(collector)
+
+    def add_queue_collector(self, collector: Callable[[], Iterable[Tuple[str, int]]]):
+        """Register a callable yielding (role, queue depth) at scrape time."""
+        self._queue_collectors.append(collector)
+
+    def _collect_queues(self):
+        for collector in self._queue_collectors:
+            for role, depth in collector():
+                yield (role,), depth
+
+    def _collect_backends(self, attr: str):
+        for collector in self._backend_collectors:
+            for role, backend, server in collector():
+                yield (role, backend), getattr(server, attr)
+
+    def render(self) -> str:
+        return self.registry.render()
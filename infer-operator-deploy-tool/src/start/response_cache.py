@@ -0,0 +1,131 @@
+from collections import OrderedDict
+from dataclasses import dataclass, fields
+import hashlib
+import json
+import time
+from typing import Any, Dict, List, Optional
+
+# Request fields that do not change the generated output
+IGNORED_FIELDS = ("user",)
+
+
+@dataclass
+class ResponseCacheConfig:
+    """
+    Cache of complete responses to deterministic requests.
+
+    Only requests with an explicit temperature of 0 are cached, anything sampling
+    with randomness bypasses the cache, as do requests with a Cache-Control header
+    of no-cache or no-store. Entries expire ttl seconds after they were stored, the
+    least recently used ones are evicted beyond max_bytes, and responses larger than
+    max_entry_bytes are not stored.
+    """
+
+    enabled: bool = False
+    max_bytes: int = 256 * 1024 * 1024
+    max_entry_bytes: int = 1024 * 1024
+    ttl: float = 300.0
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> 'ResponseCacheConfig':
+        values = {}
+        known = {f.name for f in fields(cls)}
+        for key, value in (data or {}).items():
+            if key not in known:
+                raise ValueError(f"Unknown response cache option '{key}', expected one of {sorted(known)}")
+            if key == "enabled":
+                if not isinstance(value, bool):
+                    raise TypeError(f"Response cache option 'enabled' must be a bool, got {type(value).__name__}")
+            elif not isinstance(value, (int, float)) or isinstance(value, bool) or value <= 0:
+                raise ValueError(f"Response cache option '{key}' must be a positive number, got: {value}")
+            values[key] = value
+        return cls(**values)
+
+
+class CachedResponse:
+    __slots__ = ("body", "media_type", "expires")
+
+    def __init__(self, body: bytes, media_type: str, expires: float):
+        self.body = body
+        self.media_type = media_type
+        self.expires = expires
+
+
+class ResponseCache:
+    """
+    Bytes-bounded LRU cache of responses, keyed by a hash of the normalised request.
+
+    A streamed response is stored as the SSE events it was made of and replayed to
+    later clients in one write.
+    """
+
+    def __init__(self, config: Optional[ResponseCacheConfig] = None):
+        self.config = config or ResponseCacheConfig()
+        self._entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.stored = 0
+        self.evicted = 0
+
+    def key(self, api: str, req_data: dict, cache_control: str = "") -> Optional[str]:
+        """Return the cache key of a request, or None if it has to reach the backends."""
+        if not self.config.enabled:
+            return None
+        temperature = req_data.get("temperature")
+        if (
+            isinstance(temperature, bool)
+            or not isinstance(temperature, (int, float))
+            or temperature != 0
+            or "no-cache" in cache_control
+            or "no-store" in cache_control
+        ):
+            self.bypassed += 1
+            return None
+        normalised = {k: v for k, v in req_data.items() if k not in IGNORED_FIELDS}
+        # Key order and whitespace of the client's JSON do not matter
+        encoded = json.dumps([api, normalised], sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires <= time.monotonic():
+            self._remove(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key: str, chunks: List[bytes], media_type: str):
+        body = b"".join(chunks)
+        if len(body) > self.config.max_entry_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = CachedResponse(body, media_type, time.monotonic() + self.config.ttl)
+        self.size += len(body)
+        self.stored += 1
+        while self.size > self.config.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evicted += 1
+
+    def _remove(self, key: str):
+        self.size -= len(self._entries.pop(key).body)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.config.enabled,
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "stored": self.stored,
+            "evicted": self.evicted,
+        }
@@ -0,0 +1,135 @@
+from collections import deque
+from dataclasses import dataclass, fields
+import math
+import time
+from typing import Any, Dict, Optional
+
+BOOL_OPTIONS = ("budget", "hedge_prefill")
+INT_OPTIONS = ("hedge_min_samples", "hedge_window")
+
+
+@dataclass
+class RetryConfig:
+    """
+    Retry budget and prefill hedging settings.
+
+    With budget, retries of failed prefill and decode requests draw from a token
+    bucket refilled by budget_ratio tokens per client request and by
+    min_retries_per_second, holding at most budget_burst tokens. Retries thereby stay
+    under about budget_ratio of the traffic during an outage instead of multiplying
+    it, while a lightly loaded proxy can still retry.
+
+    With hedge_prefill, a prefill still running after the hedge_quantile of recent
+    prefill latencies (at least hedge_min_delay, once hedge_min_samples are known) is
+    also sent to a second prefiller; the first to answer wins and the other is
+    cancelled. Hedges draw from the retry budget as well.
+    """
+
+    budget: bool = True
+    budget_ratio: float = 0.2
+    min_retries_per_second: float = 10.0
+    budget_burst: float = 100.0
+    hedge_prefill: bool = False
+    hedge_quantile: float = 0.95
+    hedge_min_delay: float = 0.01
+    hedge_min_samples: int = 20
+    hedge_window: int = 1000
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> 'RetryConfig':
+        values = {}
+        known = {f.name for f in fields(cls)}
+        for key, value in (data or {}).items():
+            if key not in known:
+                raise ValueError(f"Unknown retry option '{key}', expected one of {sorted(known)}")
+            if key in BOOL_OPTIONS:
+                if not isinstance(value, bool):
+                    raise TypeError(f"Retry option '{key}' must be a bool, got {type(value).__name__}")
+            elif key in INT_OPTIONS:
+                if not isinstance(value, int) or isinstance(value, bool) or value <= 0:
+                    raise ValueError(f"Retry option '{key}' must be a positive integer, got: {value}")
+            elif not isinstance(value, (int, float)) or isinstance(value, bool) or value < 0:
+                raise ValueError(f"Retry option '{key}' must be a non-negative number, got: {value}")
+            values[key] = value
+        config = cls(**values)
+        if not 0 < config.hedge_quantile < 1:
+            raise ValueError(f"Retry hedge_quantile must be in (0, 1), got: {config.hedge_quantile}")
+        if config.hedge_min_samples > config.hedge_window:
+            raise ValueError(
+                f"Retry hedge_min_samples must not exceed hedge_window, got: "
+                f"{config.hedge_min_samples} > {config.hedge_window}"
+            )
+        return config
+
+
+class RetryBudget:
+    """
+    Token bucket bounding retries and hedges to a share of the requests.
+
+    share scales the time-based refill and the burst, so that workers splitting the
+    traffic of one proxy together keep the configured rates.
+    """
+
+    def __init__(self, config: Optional[RetryConfig] = None, share: float = 1.0):
+        self.config = config or RetryConfig()
+        self.refill_rate = self.config.min_retries_per_second * share
+        self.burst = max(self.config.budget_burst * share, 1.0)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.requests = 0
+        self.granted = 0
+        self.denied = 0
+
+    def record_request(self):
+        self.requests += 1
+        self.tokens = min(self.burst, self.tokens + self.config.budget_ratio)
+
+    def try_acquire(self) -> bool:
+        """Take a token for one retry or hedge, return False when the budget is exhausted."""
+        if not self.config.budget:
+            self.granted += 1
+            return True
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.refill_rate)
+        self.updated = now
+        if self.tokens < 1.0:
+            self.denied += 1
+            return False
+        self.tokens -= 1.0
+        self.granted += 1
+        return True
+
+    def stats(self):
+        return {
+            "enabled": self.config.budget,
+            "tokens": self.tokens,
+            "requests": self.requests,
+            "granted": self.granted,
+            "denied": self.denied,
+        }
+
+
+class LatencyWindow:
+    """Quantile of the last window latencies, sorted again every window // 10 samples rather than per read."""
+
+    def __init__(self, window: int, quantile: float, min_samples: int):
+        self.samples = deque(maxlen=window)
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.refresh = max(window // 10, 1)
+        self._pending = 0
+        self._value: Optional[float] = None
+
+    def observe(self, latency: float):
+        self.samples.append(latency)
+        self._pending += 1
+
+    def value(self) -> Optional[float]:
+        """Return the quantile, or None until min_samples latencies were observed."""
+        if len(self.samples) < self.min_samples:
+            return None
+        if self._value is None or self._pending >= self.refresh:
+            ordered = sorted(self.samples)
+            self._value = ordered[min(math.ceil(self.quantile * len(ordered)) - 1, len(ordered) - 1)]
+            self._pending = 0
+        return self._value
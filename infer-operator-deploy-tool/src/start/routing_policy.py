@@ -0,0 +1,186 @@
+from collections import OrderedDict
+import json
+from typing import Any, Callable, Dict, List, Optional
+import zlib
+
+from indexed_heap import IndexedHeap
+
+
+def request_prefix_text(req_data: Dict[str, Any]) -> str:
+    """Return the part of a completion or chat request that determines its prefix KV cache."""
+    if "prompt" in req_data:
+        prompt = req_data["prompt"]
+        return prompt if isinstance(prompt, str) else json.dumps(prompt)
+    messages = req_data.get("messages")
+    if not messages:
+        return ""
+    parts = []
+    for message in messages:
+        content = message.get("content", "")
+        if not isinstance(content, str):
+            content = json.dumps(content)
+        parts.append(f"{message.get('role', '')}:{content}\n")
+    return "".join(parts)
+
+
+def prefix_block_hashes(text: str, block_size: int, max_blocks: int) -> List[int]:
+    """
+    Hash the leading full blocks of text, hash i covers blocks 0..i.
+
+    crc32 is chained over the blocks so every hash identifies a whole prefix, and it
+    is stable across processes unlike the builtin hash.
+    """
+    data = text.encode("utf-8")
+    view = memoryview(data)
+    hashes = []
+    prefix_hash = 0
+    for start in range(0, min(len(data) // block_size, max_blocks) * block_size, block_size):
+        prefix_hash = zlib.crc32(view[start : start + block_size], prefix_hash)
+        hashes.append(prefix_hash)
+    return hashes
+
+
+def within_bounded_load(heap: IndexedHeap, server_idx: int, added: float, load_factor: float) -> bool:
+    """
+    Whether a backend stays within the bounded load after taking a request adding added to its priority.
+
+    The bound is load_factor times the mean priority counting the request, but never
+    less than the mean plus the request itself, so that a backend at or below the mean
+    always qualifies; on an idle or lightly loaded pool load_factor times the mean is
+    smaller than a single request.
+    """
+    mean = (heap.total + added) / len(heap)
+    return heap.priority(server_idx) + added <= max(load_factor * mean, mean + added)
+
+
+def least_loaded(heap: IndexedHeap, eligible: Optional[Callable[[int], bool]] = None) -> Optional[int]:
+    """Return the least loaded backend of heap that is eligible, None when no backend is."""
+    server_idx = heap.peek()[1]
+    if eligible is None or eligible(server_idx):
+        return server_idx
+    # Only scanned while the least loaded backend is not eligible, e.g. at its concurrency cap
+    candidates = [(priority, idx) for priority, idx in heap if eligible(idx)]
+    return min(candidates)[1] if candidates else None
+
+
+class LeastLoadPolicy:
+    """
+    Always pick the least loaded backend.
+
+    select only considers backends for which eligible, when given, is true, and
+    returns None when there is none.
+    """
+
+    name = "least_load"
+
+    def select(
+        self,
+        heap: IndexedHeap,
+        token_count: float,
+        prefix_hashes: Optional[List[int]] = None,
+        added_load: Optional[Callable[[int], float]] = None,
+        eligible: Optional[Callable[[int], bool]] = None,
+    ) -> Optional[int]:
+        return least_loaded(heap, eligible)
+
+    def forget(self, server_idx: int):
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {"policy": self.name}
+
+
+class PrefixAffinityPolicy(LeastLoadPolicy):
+    """
+    Prefer the backend that last served the longest known prefix of a request.
+
+    A bounded LRU index maps prefix block hashes to the backend they were routed to.
+    The preferred backend is only used while its load stays within the bounded load of
+    within_bounded_load, otherwise the request falls back to the least loaded backend,
+    which then becomes the owner of the prefix. added_load gives the priority a backend
+    gains from the request, in the heap's units, the token count when it is None.
+    """
+
+    name = "prefix_affinity"
+
+    def __init__(self, load_factor: float = 1.25, max_entries: int = 100000):
+        if load_factor < 1.0:
+            raise ValueError(f"load_factor must be at least 1.0, got: {load_factor}")
+        self.load_factor = load_factor
+        self.max_entries = max_entries
+        self._index: OrderedDict = OrderedDict()
+        self.requests = 0
+        self.affinity_hits = 0
+        self.overload_fallbacks = 0
+        self.matched_blocks = 0
+        self.total_blocks = 0
+
+    def select(
+        self,
+        heap: IndexedHeap,
+        token_count: float,
+        prefix_hashes: Optional[List[int]] = None,
+        added_load: Optional[Callable[[int], float]] = None,
+        eligible: Optional[Callable[[int], bool]] = None,
+    ) -> Optional[int]:
+        chosen = least_loaded(heap, eligible)
+        if chosen is None or not prefix_hashes:
+            return chosen
+        self.requests += 1
+        self.total_blocks += len(prefix_hashes)
+
+        owner = None
+        matched = 0
+        for prefix_hash in prefix_hashes:
+            server_idx = self._index.get(prefix_hash)
+            if server_idx is None:
+                break
+            owner = server_idx
+            matched += 1
+
+        if owner is not None and owner in heap:
+            added = added_load(owner) if added_load is not None else token_count
+            if (eligible is None or eligible(owner)) and within_bounded_load(heap, owner, added, self.load_factor):
+                chosen = owner
+                self.affinity_hits += 1
+                self.matched_blocks += matched
+            else:
+                self.overload_fallbacks += 1
+
+        index = self._index
+        for prefix_hash in prefix_hashes:
+            index[prefix_hash] = chosen
+            index.move_to_end(prefix_hash)
+        while len(index) > self.max_entries:
+            index.popitem(last=False)
+        return chosen
+
+    def forget(self, server_idx: int):
+        """Drop every prefix owned by a backend that left the pool."""
+        for prefix_hash in [h for h, owner in self._index.items() if owner == server_idx]:
+            del self._index[prefix_hash]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "policy": self.name,
+            "requests": self.requests,
+            "affinity_hits": self.affinity_hits,
+            "overload_fallbacks": self.overload_fallbacks,
+            "hit_rate": self.affinity_hits / self.requests if self.requests else 0.0,
+            "matched_block_rate": self.matched_blocks / self.total_blocks if self.total_blocks else 0.0,
+            "index_size": len(self._index),
+        }
+
+
+ROUTING_POLICIES = {
+    LeastLoadPolicy.name: LeastLoadPolicy,
+    PrefixAffinityPolicy.name: PrefixAffinityPolicy,
+}
+
+
+def create_routing_policy(name: str, **kwargs):
+    if name not in ROUTING_POLICIES:
+        raise ValueError(f"Unsupported routing policy: {name}, expected one of {list(ROUTING_POLICIES)}")
+    if name == LeastLoadPolicy.name:
+        return LeastLoadPolicy()
+    return ROUTING_POLICIES[name](**kwargs)
@@ -1,9 +1,12 @@
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
 import logging
 import os
+import signal
 import subprocess
 import time
 
+from admission_control import SCHEDULING_POLICIES
+from pull_engine import HARDWARE_TYPE_A2, HARDWARE_TYPES_A3
 from user_config_loader import UserConfig
 from utils import convert_args_dict_to_list, resolve_with_retry
 
@@ -15,6 +18,11 @@ logging.basicConfig(
 MAX_RESOLVE_ATTEMPTS = 5
 RESOLVE_DELAY = 10
 MAX_WORKERS = 20
+# Namespace of the pod, mounted with its service account token
+SERVICE_ACCOUNT_NAMESPACE_FILE = '/var/run/secrets/kubernetes.io/serviceaccount/namespace'
+# Relative throughput of one NPU device of each hardware type, an instance's capacity is this
+# times its dp_size * tp_size devices; override with router_config.capacity.hardware_factors
+HARDWARE_CAPACITY_FACTORS = {HARDWARE_TYPE_A2: 1.0, **{hardware_type: 1.0 for hardware_type in HARDWARE_TYPES_A3}}
 
 
 def _validate_router_config(user_config: UserConfig) -> int:
@@ -31,21 +39,274 @@ def _validate_router_config(user_config: UserConfig) -> int:
     return port
 
 
-def get_prefiller_or_decoder_hosts(user_config: UserConfig, role: str) -> list:
-    infer_service_name = os.environ.get('INFER_SERVICE_NAME')
-    infer_service_index = os.environ.get('INFER_SERVICE_INDEX')
-    namespace = user_config.deploy_config.namespace
+def get_cost_model_config(user_config: UserConfig):
+    cost_model_config = user_config.router_config.get('cost_model')
+    if cost_model_config is None:
+        return None
+    if not isinstance(cost_model_config, dict):
+        raise ValueError(f"router_config.cost_model must be a JSON object, got: {cost_model_config}")
+
+    cost_model_config = dict(cost_model_config)
+    # The model weights are mounted into the router pod as well, reuse their tokenizer by default
+    cost_model_config.setdefault('tokenizer_path', user_config.engine_common_config.model_path)
+    return cost_model_config
+
+
+def get_router_workers(user_config: UserConfig):
+    workers = user_config.router_config.get('workers')
+    if workers is None:
+        return None
+    if not isinstance(workers, int) or isinstance(workers, bool) or workers <= 0:
+        raise ValueError(f"router_config.workers must be a positive integer, got: {workers}")
+    return workers
+
+
+def get_shutdown_timeout(user_config: UserConfig):
+    shutdown_timeout = user_config.router_config.get('shutdown_timeout')
+    if shutdown_timeout is None:
+        return None
+    if not isinstance(shutdown_timeout, (int, float)) or isinstance(shutdown_timeout, bool) or shutdown_timeout <= 0:
+        raise ValueError(f"router_config.shutdown_timeout must be a positive number, got: {shutdown_timeout}")
+    return shutdown_timeout
+
+
+def get_eager_prefill(user_config: UserConfig):
+    eager_prefill = user_config.router_config.get('eager_prefill', False)
+    if not isinstance(eager_prefill, bool):
+        raise ValueError(f"router_config.eager_prefill must be a bool, got: {eager_prefill}")
+    return eager_prefill
+
+
+def get_coalesce_prefills(user_config: UserConfig):
+    coalesce_prefills = user_config.router_config.get('coalesce_prefills', False)
+    if not isinstance(coalesce_prefills, bool):
+        raise ValueError(f"router_config.coalesce_prefills must be a bool, got: {coalesce_prefills}")
+    return coalesce_prefills
+
+
+def get_coalesce_max_wait(user_config: UserConfig):
+    coalesce_max_wait = user_config.router_config.get('coalesce_max_wait', 5.0)
+    if (
+        not isinstance(coalesce_max_wait, (int, float))
+        or isinstance(coalesce_max_wait, bool)
+        or coalesce_max_wait < 0
+    ):
+        raise ValueError(f"router_config.coalesce_max_wait must be a non-negative number, got: {coalesce_max_wait}")
+    return coalesce_max_wait
+
+
+def get_abort_api(user_config: UserConfig):
+    abort_api = user_config.router_config.get('abort_api')
+    if abort_api is None:
+        return None
+    if not isinstance(abort_api, str) or not abort_api.startswith('/'):
+        raise ValueError(f"router_config.abort_api must be a path starting with '/', got: {abort_api}")
+    return abort_api
+
+
+def get_outlier_detection_config(user_config: UserConfig):
+    outlier_detection_config = user_config.router_config.get('outlier_detection')
+    if outlier_detection_config is not None and not isinstance(outlier_detection_config, dict):
+        raise ValueError(f"router_config.outlier_detection must be a JSON object, got: {outlier_detection_config}")
+    return outlier_detection_config
+
+
+def get_retry_config(user_config: UserConfig):
+    retry_config = user_config.router_config.get('retry')
+    if retry_config is not None and not isinstance(retry_config, dict):
+        raise ValueError(f"router_config.retry must be a JSON object, got: {retry_config}")
+    return retry_config
+
+
+def get_response_cache_config(user_config: UserConfig):
+    response_cache_config = user_config.router_config.get('response_cache')
+    if response_cache_config is not None and not isinstance(response_cache_config, dict):
+        raise ValueError(f"router_config.response_cache must be a JSON object, got: {response_cache_config}")
+    return response_cache_config
+
+
+def get_topology_config(user_config: UserConfig):
+    topology_config = user_config.router_config.get('topology')
+    if topology_config is not None and not isinstance(topology_config, dict):
+        raise ValueError(f"router_config.topology must be a JSON object, got: {topology_config}")
+    return topology_config
+
+
+ADMISSION_ARGS = {
+    'max_requests_per_backend': 'max_requests_per_backend',
+    'max_tokens_per_backend': 'max_tokens_per_backend',
+    'queue_size': 'admission_queue_size',
+    'queue_timeout': 'admission_queue_timeout',
+    'max_requests_per_prefiller': 'max_requests_per_prefiller',
+    'max_tokens_per_prefiller': 'max_tokens_per_prefiller',
+    'prefill_queue_timeout': 'prefill_queue_timeout',
+    'retry_after': 'retry_after',
+}
+# Passed to proxy arguments of type int, the other admission fields may be fractional
+ADMISSION_INT_FIELDS = (
+    'max_requests_per_backend',
+    'max_tokens_per_backend',
+    'queue_size',
+    'max_requests_per_prefiller',
+    'max_tokens_per_prefiller',
+    'retry_after',
+)
+
+
+def get_admission_args(user_config: UserConfig) -> dict:
+    admission_config = user_config.router_config.get('admission')
+    if admission_config is None:
+        return {}
+    if not isinstance(admission_config, dict):
+        raise ValueError(f"router_config.admission must be a JSON object, got: {admission_config}")
+
+    args = {}
+    for key, value in admission_config.items():
+        if key not in ADMISSION_ARGS:
+            raise ValueError(f"Unknown router_config.admission field '{key}', expected one of {list(ADMISSION_ARGS)}")
+        if key in ADMISSION_INT_FIELDS:
+            if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+                raise ValueError(f"router_config.admission.{key} must be a non-negative integer, got: {value}")
+        elif not isinstance(value, (int, float)) or isinstance(value, bool) or value < 0:
+            raise ValueError(f"router_config.admission.{key} must be a non-negative number, got: {value}")
+        args[ADMISSION_ARGS[key]] = value
+    return args
+
+
+def get_scheduling_args(user_config: UserConfig) -> dict:
+    scheduling_config = user_config.router_config.get('scheduling')
+    if scheduling_config is None:
+        return {}
+    if not isinstance(scheduling_config, dict):
+        raise ValueError(f"router_config.scheduling must be a JSON object, got: {scheduling_config}")
+
+    args = {}
+    unknown = set(scheduling_config) - {'policy', 'sjf_aging', 'priority_classes'}
+    if unknown:
+        raise ValueError(f"Unknown router_config.scheduling fields {sorted(unknown)}, "
+                         f"expected policy, sjf_aging or priority_classes")
+    policy = scheduling_config.get('policy')
+    if policy is not None:
+        if policy not in SCHEDULING_POLICIES:
+            raise ValueError(f"router_config.scheduling.policy must be one of {list(SCHEDULING_POLICIES)}, "
+                             f"got: {policy}")
+        args['scheduling_policy'] = policy
+    sjf_aging = scheduling_config.get('sjf_aging')
+    if sjf_aging is not None:
+        if not isinstance(sjf_aging, (int, float)) or isinstance(sjf_aging, bool) or sjf_aging <= 0:
+            raise ValueError(f"router_config.scheduling.sjf_aging must be a positive number, got: {sjf_aging}")
+        args['sjf_aging'] = sjf_aging
+    priority_classes = scheduling_config.get('priority_classes')
+    if priority_classes is not None:
+        if not isinstance(priority_classes, dict):
+            raise ValueError(f"router_config.scheduling.priority_classes must be a JSON object, "
+                             f"got: {priority_classes}")
+        args['priority_classes'] = priority_classes
+    return args
+
+
+def _get_capacity_config(user_config: UserConfig) -> dict:
+    capacity_config = user_config.router_config.get('capacity') or {}
+    if not isinstance(capacity_config, dict):
+        raise ValueError(f"router_config.capacity must be a JSON object, got: {capacity_config}")
+    unknown = set(capacity_config) - {'prefill', 'decode', 'hardware_factors'}
+    if unknown:
+        raise ValueError(f"Unknown router_config.capacity fields {sorted(unknown)}, "
+                         f"expected prefill, decode or hardware_factors")
+    return capacity_config
+
+
+def get_backend_capacity(user_config: UserConfig, role: str) -> float:
+    """Capacity shared by the instances of a role, router_config.capacity.<role> or derived from the deployment."""
+    capacity_config = _get_capacity_config(user_config)
+    capacity = capacity_config.get(role)
+    if capacity is None:
+        if role == 'prefill':
+            deploy_config = user_config.deploy_config.prefill
+            dp_size = user_config.engine_common_config.prefill_dp_size
+            tp_size = user_config.engine_common_config.prefill_tp_size
+        else:
+            deploy_config = user_config.deploy_config.decode
+            dp_size = user_config.engine_common_config.decode_dp_size or 1
+            tp_size = user_config.engine_common_config.decode_tp_size or 1
+        hardware_factors = capacity_config.get('hardware_factors', {})
+        if not isinstance(hardware_factors, dict):
+            raise ValueError(f"router_config.capacity.hardware_factors must be a JSON object, got: {hardware_factors}")
+        hardware_factors = {**HARDWARE_CAPACITY_FACTORS, **hardware_factors}
+        if deploy_config.hardware_type not in hardware_factors:
+            raise ValueError(f"No capacity factor for hardware_type {deploy_config.hardware_type}, "
+                             f"set router_config.capacity.hardware_factors")
+        capacity = hardware_factors[deploy_config.hardware_type] * dp_size * tp_size
+    if not isinstance(capacity, (int, float)) or isinstance(capacity, bool) or capacity <= 0:
+        raise ValueError(f"router_config.capacity.{role} must be a positive number, got: {capacity}")
+    return capacity
+
+
+def get_backend_capacities(user_config: UserConfig, role: str) -> list:
+    """
+    Capacity of each instance of a role, in instance index order.
+
+    The derived capacity is the same for every instance of a role, which balances
+    load exactly like equal capacities; weighting only takes effect once
+    router_config.capacity.<role> lists one value per instance.
+    """
+    capacities = _get_capacity_config(user_config).get(role)
+    if not isinstance(capacities, list):
+        return [get_backend_capacity(user_config, role)]
+    instance_count = get_instance_count(user_config, role)
+    if len(capacities) != instance_count:
+        raise ValueError(f"router_config.capacity.{role} must list one capacity per instance, "
+                         f"expected {instance_count}, got: {capacities}")
+    for capacity in capacities:
+        if not isinstance(capacity, (int, float)) or isinstance(capacity, bool) or capacity <= 0:
+            raise ValueError(f"router_config.capacity.{role} must list positive numbers, got: {capacities}")
+    return capacities
+
+
+def get_instance_count(user_config: UserConfig, role: str) -> int:
     if role == 'prefill':
-        instance_count = user_config.deploy_config.prefill.instance_count
+        return user_config.deploy_config.prefill.instance_count
     elif role == 'decode':
-        instance_count = user_config.deploy_config.decode.instance_count
+        return user_config.deploy_config.decode.instance_count
     else:
         raise ValueError(f"Unsupported role: {role}")
 
+
+def get_instance_hostname(infer_service_name, infer_service_index, role: str, instance_index: int,
+                          namespace: str) -> str:
+    return f"{infer_service_name}-{infer_service_index}-{role}-{instance_index}-0.service-{infer_service_name}-{infer_service_index}-{role}-{instance_index}.{namespace}.svc.cluster.local"
+
+
+def get_namespace(user_config: UserConfig) -> str:
+    """Namespace of the service set, deploy_config.namespace or else the namespace the router pod runs in."""
+    namespace = user_config.deploy_config.namespace or os.environ.get('POD_NAMESPACE')
+    if not namespace:
+        try:
+            with open(SERVICE_ACCOUNT_NAMESPACE_FILE, 'r', encoding='utf-8') as f:
+                namespace = f.read().strip()
+        except OSError:
+            namespace = None
+    if not namespace:
+        raise ValueError("deploy_config.namespace is not set and the namespace of the router pod is unknown, "
+                         "set deploy_config.namespace")
+    return namespace
+
+
+def get_prefiller_or_decoder_hostnames(user_config: UserConfig, role: str, instance_count: int) -> list:
+    infer_service_name = os.environ.get('INFER_SERVICE_NAME')
+    infer_service_index = os.environ.get('INFER_SERVICE_INDEX')
+    namespace = get_namespace(user_config)
+
     hostnames = []
     for instance_index in range(instance_count):
-        hostname = f"{infer_service_name}-{infer_service_index}-{role}-{instance_index}-0.service-{infer_service_name}-{infer_service_index}-{role}-{instance_index}.{namespace}.svc.cluster.local"
+        hostname = get_instance_hostname(infer_service_name, infer_service_index, role, instance_index, namespace)
         hostnames.append(hostname)
+    return hostnames
+
+
+def get_prefiller_or_decoder_hosts(user_config: UserConfig, role: str) -> list:
+    instance_count = get_instance_count(user_config, role)
+    hostnames = get_prefiller_or_decoder_hostnames(user_config, role, instance_count)
 
     def resolve_hostname(hostname: str) -> str:
         max_resolve_attempts = MAX_RESOLVE_ATTEMPTS
@@ -67,24 +328,54 @@ def get_prefiller_or_decoder_hosts(user_config: UserConfig, role: str) -> list:
 
         raise ValueError(f"Failed to resolve hostname {hostname} after {max_resolve_attempts} attempts")
 
-    result = []
     max_workers = min(instance_count, MAX_WORKERS)
     with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        future_to_hostname = {
-            executor.submit(resolve_hostname, hostname): hostname
-            for hostname in hostnames
-        }
-
-        for future in as_completed(future_to_hostname):
-            try:
-                ip = future.result()
-                result.append(ip)
-            except Exception as e:
-                raise e
+        futures = [executor.submit(resolve_hostname, hostname) for hostname in hostnames]
+        # In instance index order, which per-instance capacities follow
+        result = [future.result() for future in futures]
 
     return result
 
 
+MEMBERSHIP_FIELDS = ('dns_watch', 'interval', 'max_instances', 'drain_timeout', 'admin_api')
+
+
+def get_membership_args(user_config: UserConfig) -> dict:
+    membership_config = user_config.router_config.get('membership', {})
+    if not isinstance(membership_config, dict):
+        raise ValueError(f"router_config.membership must be a JSON object, got: {membership_config}")
+    for key in membership_config:
+        if key not in MEMBERSHIP_FIELDS:
+            raise ValueError(
+                f"Unknown router_config.membership field '{key}', expected one of {list(MEMBERSHIP_FIELDS)}"
+            )
+
+    args = {}
+    if membership_config.get('dns_watch', True):
+        max_instances = membership_config.get('max_instances', {})
+        if not isinstance(max_instances, dict):
+            raise ValueError(f"router_config.membership.max_instances must be a JSON object, got: {max_instances}")
+        for role, arg_name in (('prefill', 'prefiller_watch_hosts'), ('decode', 'decoder_watch_hosts')):
+            instance_count = get_instance_count(user_config, role)
+            # Instances beyond the configured count are watched too, so scaling out is picked up
+            watch_count = max_instances.get(role, instance_count)
+            if not isinstance(watch_count, int) or isinstance(watch_count, bool) or watch_count < instance_count:
+                raise ValueError(
+                    f"router_config.membership.max_instances.{role} must be an integer not less than "
+                    f"the instance count {instance_count}, got: {watch_count}"
+                )
+            args[arg_name] = get_prefiller_or_decoder_hostnames(user_config, role, watch_count)
+    for key, arg_name in (('interval', 'dns_watch_interval'), ('drain_timeout', 'drain_timeout')):
+        if key in membership_config:
+            value = membership_config[key]
+            if not isinstance(value, (int, float)) or isinstance(value, bool) or value <= 0:
+                raise ValueError(f"router_config.membership.{key} must be a positive number, got: {value}")
+            args[arg_name] = value
+    if membership_config.get('admin_api', False):
+        args['enable_admin_api'] = True
+    return args
+
+
 def get_prefiller_or_decoder_ports(user_config: UserConfig, role: str) -> list:
     if role == 'prefill':
         port_num = user_config.deploy_config.prefill.instance_count
@@ -111,6 +402,23 @@ def run_router(config_path):
         args_dict['prefiller_ports'] = get_prefiller_or_decoder_ports(user_config, 'prefill')
         args_dict['decoder_hosts'] = get_prefiller_or_decoder_hosts(user_config, 'decode')
         args_dict['decoder_ports'] = get_prefiller_or_decoder_ports(user_config, 'decode')
+        # One value per role or per instance, the first also applies to instances found later by the DNS watch
+        args_dict['prefiller_capacities'] = get_backend_capacities(user_config, 'prefill')
+        args_dict['decoder_capacities'] = get_backend_capacities(user_config, 'decode')
+        args_dict['cost_model_config'] = get_cost_model_config(user_config)
+        args_dict['workers'] = get_router_workers(user_config)
+        args_dict['shutdown_timeout'] = get_shutdown_timeout(user_config)
+        args_dict['eager_prefill'] = get_eager_prefill(user_config)
+        args_dict['coalesce_prefills'] = get_coalesce_prefills(user_config)
+        args_dict['coalesce_max_wait'] = get_coalesce_max_wait(user_config)
+        args_dict['abort_api'] = get_abort_api(user_config)
+        args_dict['outlier_detection_config'] = get_outlier_detection_config(user_config)
+        args_dict['topology_config'] = get_topology_config(user_config)
+        args_dict['retry_config'] = get_retry_config(user_config)
+        args_dict['response_cache_config'] = get_response_cache_config(user_config)
+        args_dict.update(get_admission_args(user_config))
+        args_dict.update(get_scheduling_args(user_config))
+        args_dict.update(get_membership_args(user_config))
 
         converted_args_list = convert_args_dict_to_list(args_dict)
         current_dir = os.path.dirname(__file__)
@@ -119,6 +427,8 @@ def run_router(config_path):
         logging.info(f"Starting router with command: {' '.join(router_cmd)}")
 
         process = subprocess.Popen(router_cmd, shell=False)
+        # Let the router drain its requests in flight when the pod is terminated
+        signal.signal(signal.SIGTERM, lambda signum, frame: process.send_signal(signum))
         stdout, stderr = process.communicate()
         if process.returncode != 0:
             logging.error(f"Router process failed with return code {process.returncode}")
@@ -129,3 +439,84 @@ def run_router(config_path):
     except Exception as e:
         logging.error(f"Error in run_router: {e}")
         raise
+
+
+GLOBAL_ROUTER_FIELDS = ('port', 'replicas', 'spillover', 'max_spills', 'poll_interval', 'poll_failures')
+
+
+def get_global_router_args(user_config: UserConfig) -> dict:
+    """Arguments of global_router.py from router_config.global_router and the replicas of the service set."""
+    router_port = _validate_router_config(user_config)
+    global_router_config = user_config.router_config.get('global_router', {})
+    if not isinstance(global_router_config, dict):
+        raise ValueError(f"router_config.global_router must be a JSON object, got: {global_router_config}")
+    for key in global_router_config:
+        if key not in GLOBAL_ROUTER_FIELDS:
+            raise ValueError(
+                f"Unknown router_config.global_router field '{key}', expected one of {list(GLOBAL_ROUTER_FIELDS)}"
+            )
+
+    args = {'port': global_router_config.get('port', router_port)}
+    if not isinstance(args['port'], int) or args['port'] <= 0 or args['port'] > 65535:
+        raise ValueError(f"router_config.global_router.port must be between 1 and 65535, got: {args['port']}")
+    replicas = global_router_config.get('replicas')
+    if replicas is None:
+        deploy_config = user_config.deploy_config
+        if not deploy_config.job_name or not deploy_config.infer_service_num:
+            raise ValueError("deploy_config.job_name and infer_service_num are required to find the replica routers")
+        namespace = get_namespace(user_config)
+        # The router of every replica is instance 0 of its router role
+        replicas = [
+            f"http://{get_instance_hostname(deploy_config.job_name, index, 'router', 0, namespace)}:{router_port}"
+            for index in range(deploy_config.infer_service_num)
+        ]
+    elif not isinstance(replicas, list) or not replicas or not all(isinstance(url, str) for url in replicas):
+        raise ValueError(f"router_config.global_router.replicas must be a list of URLs, got: {replicas}")
+    args['replicas'] = replicas
+    if global_router_config.get('spillover', False):
+        args['spillover'] = True
+    if 'max_spills' in global_router_config:
+        max_spills = global_router_config['max_spills']
+        if not isinstance(max_spills, int) or isinstance(max_spills, bool) or max_spills < 0:
+            raise ValueError(
+                f"router_config.global_router.max_spills must be a non-negative integer, got: {max_spills}"
+            )
+        args['max_spills'] = max_spills
+    if 'poll_interval' in global_router_config:
+        poll_interval = global_router_config['poll_interval']
+        if not isinstance(poll_interval, (int, float)) or isinstance(poll_interval, bool) or poll_interval <= 0:
+            raise ValueError(
+                f"router_config.global_router.poll_interval must be a positive number, got: {poll_interval}"
+            )
+        args['poll_interval'] = poll_interval
+    if 'poll_failures' in global_router_config:
+        poll_failures = global_router_config['poll_failures']
+        if not isinstance(poll_failures, int) or isinstance(poll_failures, bool) or poll_failures <= 0:
+            raise ValueError(
+                f"router_config.global_router.poll_failures must be a positive integer, got: {poll_failures}"
+            )
+        args['poll_failures'] = poll_failures
+    return args
+
+
+def run_global_router(config_path):
+    try:
+        user_config = UserConfig.load_from_file(config_path)
+        args_dict = {'host': os.environ.get('POD_IP')}
+        args_dict.update(get_global_router_args(user_config))
+
+        converted_args_list = convert_args_dict_to_list(args_dict)
+        current_dir = os.path.dirname(__file__)
+        script_path = os.path.join(current_dir, 'global_router.py')
+        router_cmd = ['python', script_path] + converted_args_list
+        logging.info(f"Starting global router with command: {' '.join(router_cmd)}")
+
+        process = subprocess.Popen(router_cmd, shell=False)
+        process.communicate()
+        if process.returncode != 0:
+            logging.error(f"Global router process failed with return code {process.returncode}")
+            raise subprocess.CalledProcessError(process.returncode, router_cmd)
+
+    except Exception as e:
+        logging.error(f"Error in run_global_router: {e}")
+        raise
@@ -0,0 +1,113 @@
+import hashlib
+from multiprocessing import shared_memory
+from typing import Optional, Tuple
+
+# Per worker and backend slot, in this order
+FIELDS = ("active_tokens", "active_kv_cache", "active_requests")
+_FIELD_COUNT = len(FIELDS)
+_KEY_BYTES = 8
+
+
+def _slot_key(key: str) -> int:
+    # 0 marks a free directory entry
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=_KEY_BYTES).digest(), "little") or 1
+
+
+class SharedLoadTable:
+    """
+    Backend load counters shared by the proxy's worker processes.
+
+    Every worker only writes its own counters, so updates need no atomic
+    read-modify-write: each value is a single aligned 8-byte store that readers see
+    either before or after. A backend's global load is the sum over workers. The
+    values of one counter are laid out contiguously across workers, so summing them
+    is one slice.
+
+    Backends are mapped to slots through a directory of key hashes. Workers claim a
+    slot under the lock the first time they see a backend, so the same backend gets
+    the same slot in every worker whatever order they learn about it in. Slots are
+    never freed, capacity bounds the number of distinct backends over the lifetime
+    of the proxy.
+    """
+
+    def __init__(self, workers: int, capacity: int = 4096, lock=None, name: Optional[str] = None):
+        if workers <= 0:
+            raise ValueError(f"workers must be positive, got: {workers}")
+        if capacity <= 0:
+            raise ValueError(f"capacity must be positive, got: {capacity}")
+        self.workers = workers
+        self.capacity = capacity
+        self._lock = lock
+        directory_size = capacity * _KEY_BYTES
+        values_size = capacity * _FIELD_COUNT * workers * 8
+        if name is None:
+            self._shm = shared_memory.SharedMemory(create=True, size=directory_size + values_size)
+            self._shm.buf[: directory_size + values_size] = bytes(directory_size + values_size)
+            self._owner = True
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+            self._owner = False
+        self._directory = self._shm.buf[:directory_size].cast("Q")
+        self._values = self._shm.buf[directory_size : directory_size + values_size].cast("d")
+        self._slots = {}
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    def slot(self, key: str) -> int:
+        """Return the slot of a backend, claiming a free one for a backend seen for the first time."""
+        slot = self._slots.get(key)
+        if slot is not None:
+            return slot
+        hashed = _slot_key(key)
+        if self._lock is not None:
+            self._lock.acquire()
+        try:
+            directory = self._directory
+            start = hashed % self.capacity
+            for probe in range(self.capacity):
+                slot = (start + probe) % self.capacity
+                if directory[slot] == hashed:
+                    break
+                if directory[slot] == 0:
+                    directory[slot] = hashed
+                    break
+            else:
+                raise RuntimeError(f"Shared load table is full, capacity: {self.capacity}")
+        finally:
+            if self._lock is not None:
+                self._lock.release()
+        self._slots[key] = slot
+        return slot
+
+    def publish(self, slot: int, worker: int, active_tokens: float, active_kv_cache: float, active_requests: int):
+        """Store this worker's counters of a backend."""
+        base = slot * _FIELD_COUNT * self.workers + worker
+        values = self._values
+        values[base] = active_tokens
+        values[base + self.workers] = active_kv_cache
+        values[base + 2 * self.workers] = active_requests
+
+    def reset_worker(self, worker: int):
+        """Zero every counter of a worker, e.g. when a replacement worker starts."""
+        values = self._values
+        for i in range(worker, len(values), self.workers):
+            values[i] = 0.0
+
+    def remote(self, slot: int, worker: int) -> Tuple[float, float, float]:
+        """Return the counters of a backend summed over every worker except this one."""
+        workers = self.workers
+        base = slot * _FIELD_COUNT * workers
+        values = self._values
+        tokens = sum(values[base : base + workers]) - values[base + worker]
+        kv_cache = sum(values[base + workers : base + 2 * workers]) - values[base + workers + worker]
+        requests = sum(values[base + 2 * workers : base + 3 * workers]) - values[base + 2 * workers + worker]
+        return tokens, kv_cache, requests
+
+    def close(self):
+        self._directory.release()
+        self._values.release()
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
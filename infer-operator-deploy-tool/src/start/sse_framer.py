@@ -0,0 +1,65 @@
+from typing import AsyncIterable, AsyncIterator, List, Optional
+
+EVENT_TERMINATOR = b"\n\n"
+
+
+class SSEFramer:
+    """
+    Incrementally split a byte stream into whole server-sent events.
+
+    Bytes that have not formed a complete event yet are kept in one reusable
+    bytearray. Every feed only scans the bytes it has not looked at before (plus
+    one byte, in case the terminator was split across reads). When a read carries
+    exactly one complete event and nothing is buffered, the chunk is returned
+    as is without being copied.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._scanned = 0
+
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+    def feed(self, chunk: bytes) -> List[bytes]:
+        """Add a chunk and return the events it completed, each ending with the terminator."""
+        buffer = self._buffer
+        if buffer:
+            buffer += chunk
+            end = buffer.find(EVENT_TERMINATOR, max(self._scanned - 1, 0))
+        else:
+            end = chunk.find(EVENT_TERMINATOR)
+            if end >= 0 and end == len(chunk) - len(EVENT_TERMINATOR):
+                return [chunk]
+            buffer += chunk
+        events = []
+        start = 0
+        while end >= 0:
+            stop = end + len(EVENT_TERMINATOR)
+            events.append(bytes(buffer[start:stop]))
+            start = stop
+            end = buffer.find(EVENT_TERMINATOR, start)
+        if start:
+            del buffer[:start]
+        self._scanned = len(buffer)
+        return events
+
+    def flush(self) -> Optional[bytes]:
+        """Return whatever is left once the stream ended, e.g. a non-streaming JSON body."""
+        if not self._buffer:
+            return None
+        tail = bytes(self._buffer)
+        self._buffer.clear()
+        self._scanned = 0
+        return tail
+
+
+async def aiter_sse_events(chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+    """Re-frame an async stream of raw reads into whole events."""
+    framer = SSEFramer()
+    async for chunk in chunks:
+        for event in framer.feed(chunk):
+            yield event
+    tail = framer.flush()
+    if tail is not None:
+        yield tail
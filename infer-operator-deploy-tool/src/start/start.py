@@ -3,16 +3,18 @@ import logging
 import os
 
 from pull_engine import pull_engine
-from run_router import run_router
+from run_router import run_global_router, run_router
 
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
-ALL_POSSIBLE_ROLES = ['union', 'prefill', 'decode', 'router']
+ALL_POSSIBLE_ROLES = ['union', 'prefill', 'decode', 'router', 'global_router']
 INSTANCE_ROLE_LIST = ['union', 'prefill', 'decode']
 ROUTER_ROLE = 'router'
+# Deployed once in front of the routers of all service replicas, outside the InferServiceSet
+GLOBAL_ROUTER_ROLE = 'global_router'
 
 
 class ArgsConfig:
@@ -24,7 +26,7 @@ class ArgsConfig:
         parser = argparse.ArgumentParser(description='Infer Operator Deploy Tool')
 
         parser.add_argument('--role', required=True, choices=ALL_POSSIBLE_ROLES,
-                            help='Role of the component: prefill, decode, or router')
+                            help='Role of the component: prefill, decode, router, or global_router')
 
         parser.add_argument('--config', required=True, type=str,
                             help='Path to user_config.json file')
@@ -56,6 +58,8 @@ def main():
         pull_engine(args_config.role, args_config.config_path)
     elif args_config.role == ROUTER_ROLE:
         run_router(args_config.config_path)
+    elif args_config.role == GLOBAL_ROUTER_ROLE:
+        run_global_router(args_config.config_path)
 
 
 if __name__ == "__main__":
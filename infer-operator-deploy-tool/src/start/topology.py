@@ -0,0 +1,132 @@
+from dataclasses import dataclass, field, fields
+import os
+from typing import Any, Dict, Iterable, Optional
+
+import httpx
+
+# Node label written by multilevel-label-tool, nodes of one super-pod or rack group share its value
+TOPOTREE_GROUP_LABEL = "huawei.com/topotree.groupid"
+SERVICE_ACCOUNT_DIR = "/var/run/secrets/kubernetes.io/serviceaccount"
+# Prefill/decode pairs by topology, exported with the prefill latency
+LOCAL = "local"
+REMOTE = "remote"
+UNKNOWN = "unknown"
+LOCALITIES = (LOCAL, REMOTE, UNKNOWN)
+
+
+@dataclass
+class TopologyConfig:
+    """
+    Topology-aware pairing of prefillers with decoders.
+
+    The KV cache of a request moves from its prefiller to its decoder, which is much
+    faster inside a topotree group. When enabled, the prefiller is picked among the
+    prefillers in the decoder's group while the least loaded of them below its
+    concurrency cap stays within the bounded load of routing_policy's
+    within_bounded_load: the larger of load_factor times the mean prefiller load and
+    the mean plus the request, counting the new request, per unit of capacity.
+    Otherwise it is picked among all prefillers. Draining prefillers leave their
+    group at once.
+
+    Backend groups come from groups, keyed by "host:port" or "host", and with
+    kubernetes from the label of the node a backend pod runs on. Backends without a
+    group are looked up again every refresh_interval seconds.
+    """
+
+    enabled: bool = False
+    load_factor: float = 1.5
+    groups: Dict[str, str] = field(default_factory=dict)
+    kubernetes: bool = True
+    namespace: str = ""
+    label: str = TOPOTREE_GROUP_LABEL
+    refresh_interval: float = 30.0
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> 'TopologyConfig':
+        values = {}
+        known = {f.name for f in fields(cls)}
+        for key, value in (data or {}).items():
+            if key not in known:
+                raise ValueError(f"Unknown topology option '{key}', expected one of {sorted(known)}")
+            if key in ("enabled", "kubernetes"):
+                if not isinstance(value, bool):
+                    raise TypeError(f"Topology option '{key}' must be a bool, got {type(value).__name__}")
+            elif key in ("namespace", "label"):
+                if not isinstance(value, str):
+                    raise TypeError(f"Topology option '{key}' must be a string, got {type(value).__name__}")
+            elif key == "groups":
+                if not isinstance(value, dict) or not all(isinstance(g, str) for g in value.values()):
+                    raise TypeError("Topology option 'groups' must map backend addresses to group names")
+            elif not isinstance(value, (int, float)) or isinstance(value, bool) or value <= 0:
+                raise ValueError(f"Topology option '{key}' must be a positive number, got: {value}")
+            values[key] = value
+        config = cls(**values)
+        if config.load_factor < 1.0:
+            raise ValueError(f"Topology load_factor must be at least 1.0, got: {config.load_factor}")
+        return config
+
+    def static_group(self, host: str, port: int) -> Optional[str]:
+        return self.groups.get(f"{host}:{port}") or self.groups.get(host)
+
+
+class KubernetesGroupResolver:
+    """
+    Looks up the topology group of backend pods through the in-cluster Kubernetes API.
+
+    Backends are matched to pods by IP. The router's service account needs to list
+    pods in the namespace and get nodes.
+    """
+
+    def __init__(self, label: str = TOPOTREE_GROUP_LABEL, namespace: str = ""):
+        self.label = label
+        self.namespace = namespace or self._read_service_account("namespace")
+        host = os.environ.get("KUBERNETES_SERVICE_HOST")
+        port = os.environ.get("KUBERNETES_SERVICE_PORT", "443")
+        if not host or not self.namespace:
+            raise RuntimeError("not running in a Kubernetes pod with a service account")
+        if ":" in host:
+            host = f"[{host}]"
+        self._client = httpx.AsyncClient(
+            base_url=f"https://{host}:{port}",
+            verify=os.path.join(SERVICE_ACCOUNT_DIR, "ca.crt"),
+            timeout=10.0,
+        )
+        # Nodes do not move between groups while the router runs
+        self._node_groups: Dict[str, Optional[str]] = {}
+
+    @staticmethod
+    def _read_service_account(name: str) -> str:
+        try:
+            with open(os.path.join(SERVICE_ACCOUNT_DIR, name), encoding="utf-8") as f:
+                return f.read().strip()
+        except OSError:
+            return ""
+
+    async def _get(self, path: str, **params) -> dict:
+        # Projected service account tokens are rotated, read the current one every time
+        token = self._read_service_account("token")
+        response = await self._client.get(path, params=params, headers={"Authorization": f"Bearer {token}"})
+        response.raise_for_status()
+        return response.json()
+
+    async def resolve(self, hosts: Iterable[str]) -> Dict[str, str]:
+        """Return the group of each host that is the IP of a pod on a labelled node."""
+        hosts = set(hosts)
+        pods = await self._get(f"/api/v1/namespaces/{self.namespace}/pods")
+        host_nodes = {}
+        for pod in pods.get("items", []):
+            pod_ip = pod.get("status", {}).get("podIP")
+            node = pod.get("spec", {}).get("nodeName")
+            if pod_ip in hosts and node:
+                host_nodes[pod_ip] = node
+        groups = {}
+        for host, node in host_nodes.items():
+            if node not in self._node_groups:
+                labels = (await self._get(f"/api/v1/nodes/{node}")).get("metadata", {}).get("labels") or {}
+                self._node_groups[node] = labels.get(self.label)
+            if self._node_groups[node] is not None:
+                groups[host] = self._node_groups[node]
+        return groups
+
+    async def aclose(self):
+        await self._client.aclose()
@@ -60,6 +60,8 @@ class DeployConfig:
     prefill: InstanceDeployConfig
     decode: Optional[InstanceDeployConfig]
     namespace: Optional[str]
+    job_name: Optional[str] = None
+    infer_service_num: Optional[int] = None
 
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> 'DeployConfig':
@@ -73,7 +75,13 @@ class DeployConfig:
         if 'namespace' in data:
             namespace = _validate_optional_field(data, 'namespace', str)
 
-        return cls(prefill=prefill, decode=decode, namespace=namespace)
+        return cls(
+            prefill=prefill,
+            decode=decode,
+            namespace=namespace,
+            job_name=_validate_optional_field(data, 'job_name', str),
+            infer_service_num=_validate_optional_field(data, 'infer_service_num', int),
+        )
 
 
 @dataclass
@@ -0,0 +1,52 @@
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'start'))
+
+from admission_control import AdmissionController  # noqa: E402
+
+
+class Backends:
+    """One backend taking at most capacity requests."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.load = 0
+
+    def try_admit(self, token_count):
+        if self.load >= self.capacity:
+            return None
+        self.load += 1
+        return 0
+
+    def release(self, idx):
+        self.load -= 1
+
+
+class AdmissionControllerTest(unittest.IsolatedAsyncioTestCase):
+    async def test_wake_skips_waiter_cancelled_before_it_resumed(self):
+        backends = Backends(capacity=1)
+        controller = AdmissionController(queue_timeout=10.0)
+        self.assertEqual(await controller.admit(backends.try_admit, backends.release, 1), 0)
+
+        cancelled = asyncio.create_task(controller.admit(backends.try_admit, backends.release, 1))
+        waiting = asyncio.create_task(controller.admit(backends.try_admit, backends.release, 1))
+        await asyncio.sleep(0)
+        self.assertEqual(controller.queue_depth, 2)
+
+        # The client goes away, capacity is released before the cancelled task runs its cleanup
+        cancelled.cancel()
+        backends.release(0)
+        controller.wake()
+
+        self.assertEqual(await waiting, 0)
+        with self.assertRaises(asyncio.CancelledError):
+            await cancelled
+        self.assertEqual(backends.load, 1)
+        self.assertEqual(controller.queue_depth, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
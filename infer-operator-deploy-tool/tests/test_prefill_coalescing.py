@@ -0,0 +1,53 @@
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'start'))
+
+from prefill_coalescing import PrefillCoalescer  # noqa: E402
+
+REQUEST = {'model': 'mock', 'prompt': 'the same prompt'}
+
+
+class PrefillCoalescerTest(unittest.IsolatedAsyncioTestCase):
+    async def test_follower_gets_the_leaders_prefiller(self):
+        coalescer = PrefillCoalescer(enabled=True, max_wait=1.0)
+        key = coalescer.key('/completions', REQUEST)
+        self.assertIsNone(coalescer.join(key))
+        follower = asyncio.create_task(coalescer.follow(coalescer.join(key)))
+        await asyncio.sleep(0)
+        coalescer.land(key, 3)
+        self.assertEqual(await follower, 3)
+
+    async def test_follower_times_out_when_the_leader_does_not_land(self):
+        coalescer = PrefillCoalescer(enabled=True, max_wait=0.05)
+        key = coalescer.key('/completions', REQUEST)
+        coalescer.join(key)
+        flight = coalescer.join(key)
+        self.assertIsNone(await coalescer.follow(flight, expected_prefill=0.05))
+        # The leader is not affected by a follower giving up
+        self.assertFalse(flight.cancelled())
+        coalescer.land(key, 0)
+
+    async def test_follower_waits_for_the_expected_prefill_time(self):
+        coalescer = PrefillCoalescer(enabled=True, max_wait=0.05)
+        key = coalescer.key('/completions', REQUEST)
+        coalescer.join(key)
+        follower = asyncio.create_task(coalescer.follow(coalescer.join(key), expected_prefill=1.0))
+        # The leader of a long prompt lands after max_wait, but within its expected prefill time
+        await asyncio.sleep(0.2)
+        coalescer.land(key, 1)
+        self.assertEqual(await follower, 1)
+
+    async def test_record_counts_prompt_tokens_of_followers(self):
+        coalescer = PrefillCoalescer(enabled=True)
+        coalescer.record(True, 100)
+        coalescer.record(False, 100)
+        stats = coalescer.stats()
+        self.assertEqual(stats['coalesced_prompt_tokens'], 100)
+        self.assertEqual(stats['fallbacks'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()